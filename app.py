@@ -4,24 +4,116 @@ NILM Web Application - Simple web interface for data collection and labeling.
 
 import os
 import json
-import pandas as pd
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory, g
+from channel import LiveReader, ChannelError
+from baseload import load_state, BaseloadError
+from sites import site_paths, configured_paths, list_sites, check_site_name, SiteError
+from lazy import lazy_import
+import metrics
+import profiling
+import settings
 import subprocess
 import threading
 import time
 
+# Heavy modules are imported on first use so the server is ready quickly
+pd = lazy_import('pandas')
+pairing = lazy_import('pairing')
+data_loader = lazy_import('data_loader')
+pyramid = lazy_import('pyramid')
+disaggregation = lazy_import('disaggregation')
+label_propagation = lazy_import('label_propagation')
+labeling_queue = lazy_import('labeling_queue')
+sketches = lazy_import('sketches')
+
 app = Flask(__name__)
 
 # Global variables for process management
 collection_process = None
 collection_status = "stopped"
 
+# Read sides of the collector's live channels, one per site
+live_readers = {}
+
+REQUEST_SECONDS = metrics.histogram(
+    'nilm_http_request_seconds', 'Latency of web requests', ['endpoint', 'method', 'status'])
+
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request_latency(response):
+        start = g.get('request_start')
+        if start is not None:
+            REQUEST_SECONDS.labels(request.endpoint or 'unknown', request.method,
+                                   response.status_code).observe(time.perf_counter() - start)
+        return response
+
+@app.before_request
+def start_request_profile():
+    """Profile the request if NILM_PROFILE is set, or if it has ?profile=1 and NILM_PROFILE=request."""
+    if profiling.enabled() or (profiling.requests_enabled() and request.args.get('profile') == '1'):
+        session = profiling.profile(f"request_{request.endpoint or 'unknown'}", force=True)
+        g.profile_session = session.__enter__()
+
+@app.teardown_request
+def stop_request_profile(exc):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        session.__exit__(None, None, None)
+
+@app.before_request
+def check_site():
+    """Reject requests for an invalid ``site`` parameter."""
+    site = request.args.get('site')
+    if site is not None:
+        try:
+            check_site_name(site)
+        except SiteError as e:
+            return jsonify({'error': str(e)}), 400
+
+def storage_paths(site=None):
+    """Storage paths of a site under the data_dir and live channel path of config.yaml."""
+    try:
+        config = settings.load_config()
+    except settings.ConfigError:
+        return site_paths(site)
+    return configured_paths(config, site)
+
+def request_paths():
+    """Storage paths of the site selected by the ``site`` query parameter."""
+    return storage_paths(request.args.get('site') or None)
+
+def get_live_reader(path):
+    """Live channel reader for a database path, created on first use."""
+    reader = live_readers.get(path)
+    if reader is None:
+        reader = live_readers.setdefault(path, LiveReader(path))
+    return reader
+
+@app.route('/metrics')
+def get_metrics():
+    """Metrics of the web app and the collector in the Prometheus text format."""
+    return app.response_class(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Main dashboard."""
     return render_template('index.html')
 
+@app.route('/api/health')
+def get_health():
+    """Lightweight liveness check that does not touch the data files."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/api/sites')
+def get_sites():
+    """List the sites with their own data directory."""
+    return jsonify({'sites': list_sites(storage_paths()['raw'])})
+
 @app.route('/api/status')
 def get_status():
     """Get current system status."""
@@ -29,7 +121,7 @@ def get_status():
     collection_status = "running"
     
     # Get data statistics
-    stats = get_data_stats()
+    stats = get_data_stats(request_paths()['raw'])
     
     return jsonify({
         'collection_status': collection_status,
@@ -41,7 +133,7 @@ def get_status():
 def get_unlabeled_events():
     """Get all unlabeled events."""
     try:
-        events = find_unlabeled_events()
+        events = find_unlabeled_events(request_paths()['raw'])
         if events.empty:
             return jsonify({'events': []})
         
@@ -56,17 +148,113 @@ def label_events():
     """Label events."""
     try:
         data = request.json
-        power_change = data.get('power_change')
+        # A queue group labels several power changes at once
+        power_change = data.get('power_changes') or data.get('power_change')
         device_name = data.get('device_name')
         confidence = data.get('confidence', 3)
+        site = request.args.get('site') or data.get('site')
         
         if not power_change or not device_name:
             return jsonify({'error': 'Missing required fields'}), 400
+        try:
+            paths = storage_paths(site or None)
+        except SiteError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Update events in CSV files; files still being collected are left alone
+        values = power_change if isinstance(power_change, (list, tuple)) else [power_change]
+        labeled, deferred = label_propagation.label_power_changes(values, device_name, confidence, paths['raw'])
+        label_propagation.add_labels(paths['raw'])
+        if len(labeled):
+            # Labels change the appliance of events, rebuild the energy rollups
+            disaggregation.start_build(paths['raw'], paths['rollups'])
+        
+        deferred = deferred[['timestamp', 'power_change', 'source_file']].astype({'timestamp': str})
+        return jsonify({'message': 'Events labeled successfully', 'labeled': len(labeled),
+                        'deferred': len(deferred), 'deferred_events': deferred.to_dict('records')})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events/queue')
+def get_labeling_queue():
+    """Get one page of unlabeled event groups, most valuable to label first."""
+    try:
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', 20, type=int)
+        tolerance = request.args.get('tolerance', labeling_queue.TOLERANCE, type=float)
+        if not 0 < tolerance < 1:
+            return jsonify({'error': 'tolerance must be between 0 and 1'}), 400
+        
+        # Later pages are read from the ranking the first page came from
+        data_dir = request_paths()['raw']
+        snapshot = request.args.get('snapshot')
+        if snapshot:
+            queue = labeling_queue.get_snapshot(snapshot, data_dir, tolerance)
+            if queue is None:
+                return jsonify({'error': 'Queue snapshot expired, reload the queue'}), 410
+        else:
+            snapshot, queue = labeling_queue.get_queue(data_dir, tolerance)
+        return jsonify(labeling_queue.queue_page(queue, offset, limit, snapshot))
+    except (label_propagation.LabelPropagationError, labeling_queue.LabelingQueueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events/proposals')
+def get_label_proposals():
+    """Propose labels for unlabeled events from their labeled nearest neighbours."""
+    try:
+        min_confidence = request.args.get('min_confidence', 0.0, type=float)
+        limit = request.args.get('limit', 100, type=int)
+        data_dir = request_paths()['raw']
         
-        # Update events in CSV files
-        update_events_in_files(power_change, device_name, confidence)
+        events = label_propagation.load_events(data_dir)
+        index = label_propagation.get_index(data_dir)
+        unlabeled = events[~label_propagation.is_labeled(events['device_name'])]
+        proposals = label_propagation.propose_labels(unlabeled, index, min_confidence)
         
-        return jsonify({'message': 'Events labeled successfully'})
+        summary = proposals['proposed_label'].value_counts().to_dict()
+        columns = ['timestamp', 'change_type', 'power_change', 'power_before', 'power_after',
+                   'proposed_label', 'proposal_confidence', 'neighbour_distance']
+        top = proposals[[c for c in columns if c in proposals]].head(limit)
+        return jsonify({
+            'proposals': top.to_dict('records'),
+            'summary': summary,
+            'total': len(proposals),
+            'labeled_events': len(index)
+        })
+    except label_propagation.LabelPropagationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events/proposals/apply', methods=['POST'])
+def apply_label_proposals():
+    """Accept the proposed labels at or above a confidence, optionally for some labels only."""
+    try:
+        data = request.json or {}
+        min_confidence = float(data.get('min_confidence', 0.8))
+        only = data.get('labels')
+        site = request.args.get('site') or data.get('site')
+        try:
+            data_dir = storage_paths(site or None)['raw']
+        except SiteError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        events = label_propagation.load_events(data_dir)
+        index = label_propagation.get_index(data_dir)
+        unlabeled = events[~label_propagation.is_labeled(events['device_name'])]
+        proposals = label_propagation.propose_labels(unlabeled, index, min_confidence)
+        if only:
+            proposals = proposals[proposals['proposed_label'].isin(only)]
+        
+        applied = label_propagation.apply_proposals(proposals, data_dir)
+        # Files still being collected are left alone until their collector stops
+        deferred = int(proposals['source_file'].isin(label_propagation.collecting_files(data_dir)).sum())
+        return jsonify({'message': f'Applied {applied} proposed labels', 'applied': applied,
+                        'deferred': deferred})
+    except (label_propagation.LabelPropagationError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -74,7 +262,7 @@ def label_events():
 def get_event_statistics():
     """Get event statistics."""
     try:
-        events = find_unlabeled_events()
+        events = find_unlabeled_events(request_paths()['raw'])
         if events.empty:
             return jsonify({'statistics': {}})
         
@@ -84,64 +272,275 @@ def get_event_statistics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/data/distribution')
+def get_power_distribution():
+    """Get a power histogram and quantiles over a time range from the hourly sketches."""
+    try:
+        bins = request.args.get('bins', 50, type=int)
+        series = request.args.get('series', 'power')
+        store = sketches.SketchStore(request_paths()['sketches'])
+        sketch = store.query(series, request.args.get('start'), request.args.get('end'))
+        counts, edges = sketch.histogram(bins)
+        return jsonify({
+            'series': series,
+            'counts': counts.astype(int).tolist(),
+            'edges': edges.tolist(),
+            'summary': sketches.summary(sketch)
+        })
+    except sketches.SketchError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/data/power')
 def get_power_data():
     """Get all power data."""
     try:
-        power_data = []
-        data_dir = "data/raw"
+        try:
+            data = data_loader.load_power_data(request_paths()['raw'])
+        except data_loader.DataLoadError:
+            return jsonify({'data': []})
+        
+        # Serialise in one vectorised step instead of building a dict per row
+        body = data.to_json(orient='records', date_format='iso', double_precision=3)
+        return app.response_class(f'{{"data": {body}}}', mimetype='application/json')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/data/overview')
+def get_power_overview():
+    """Get min/mean/max power for a time range at a resolution fitting the chart."""
+    try:
+        level, overview = pyramid.PowerPyramid(request_paths()['pyramid']).query(
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            points=request.args.get('points', 1000, type=int),
+            level=request.args.get('level')
+        )
+        overview['timestamp'] = overview['timestamp'].astype(str)
+        return jsonify({'level': level, 'data': overview.to_dict('records')})
+    except pyramid.PyramidError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/data/live')
+def get_live_data():
+    """
+    Live tail of samples and events published by the collector.
+    
+    Without ``after`` the latest ``limit`` samples are returned. Clients then
+    pass the returned ``last_sample_id`` and ``last_event_id`` as ``after``
+    and ``events_after`` to receive only newer rows.
+    """
+    try:
+        limit = min(request.args.get('limit', 300, type=int), 10000)
+        events_after = request.args.get('events_after', 0, type=int)
+        after = request.args.get('after', type=int)
+        live_reader = get_live_reader(request_paths()['live'])
+        if after is None:
+            samples = live_reader.latest_samples(limit)
+        else:
+            samples = live_reader.samples_since(after, limit)
+        events = live_reader.events_since(events_after)
+        return jsonify({
+            'samples': samples,
+            'events': events,
+            'last_sample_id': samples[-1]['id'] if samples else after or 0,
+            'last_event_id': events[-1]['id'] if events else events_after,
+        })
+    except ChannelError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/baseload')
+def get_baseload():
+    """Get the collector's baseload estimate, power quantiles and unusual draws."""
+    try:
+        state = load_state(request_paths()['baseload'])
+    except BaseloadError as e:
+        return jsonify({'error': str(e)}), 404
+    state.pop('state', None)  # Estimator internals
+    return jsonify(state)
+
+@app.route('/api/data/events')
+def get_all_events():
+    """Get all events (labeled and unlabeled)."""
+    try:
+        all_events = []
+        data_dir = request_paths()['raw']
         
         if not os.path.exists(data_dir):
             return jsonify({'data': []})
         
         for filename in os.listdir(data_dir):
-            if filename.startswith("power_data_") and filename.endswith(".csv"):
+            if filename.startswith("device_events_") and filename.endswith(".csv"):
                 filepath = os.path.join(data_dir, filename)
                 try:
                     df = pd.read_csv(filepath)
+                    # Events not yet classified have empty prediction columns
+                    df = df.astype(object).where(df.notna(), None)
                     # Convert to list of dicts
                     data_list = df.to_dict('records')
-                    power_data.extend(data_list)
+                    all_events.extend(data_list)
                 except Exception as e:
                     print(f"Error reading {filename}: {e}")
         
         # Sort by timestamp
-        power_data.sort(key=lambda x: x.get('timestamp', ''))
-        return jsonify({'data': power_data})
+        all_events.sort(key=lambda x: x.get('timestamp', ''))
+        return jsonify({'data': all_events})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/data/events')
-def get_all_events():
-    """Get all events (labeled and unlabeled)."""
+@app.route('/api/events/predictions')
+def get_event_predictions():
+    """Get events classified by the live model, most recent first."""
     try:
-        all_events = []
-        data_dir = "data/raw"
+        limit = request.args.get('limit', 100, type=int)
+        predictions = []
+        data_dir = request_paths()['raw']
         
         if not os.path.exists(data_dir):
-            return jsonify({'data': []})
+            return jsonify({'predictions': [], 'summary': {}})
         
         for filename in os.listdir(data_dir):
             if filename.startswith("device_events_") and filename.endswith(".csv"):
                 filepath = os.path.join(data_dir, filename)
                 try:
                     df = pd.read_csv(filepath)
-                    # Convert to list of dicts
-                    data_list = df.to_dict('records')
-                    all_events.extend(data_list)
+                    if 'predicted_appliance' not in df.columns:
+                        continue
+                    df = df[df['predicted_appliance'].notna()]
+                    predictions.append(df[['timestamp', 'change_type', 'power_change',
+                                           'predicted_appliance', 'predicted_confidence']])
                 except Exception as e:
                     print(f"Error reading {filename}: {e}")
         
-        # Sort by timestamp
-        all_events.sort(key=lambda x: x.get('timestamp', ''))
-        return jsonify({'data': all_events})
+        if not predictions:
+            return jsonify({'predictions': [], 'summary': {}})
+        
+        combined = pd.concat(predictions, ignore_index=True)
+        combined = combined.sort_values('timestamp', ascending=False)
+        summary = combined['predicted_appliance'].value_counts().to_dict()
+        recent = combined.head(limit)
+        recent = recent.astype(object).where(recent.notna(), None)
+        return jsonify({'predictions': recent.to_dict('records'), 'summary': summary})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/energy/appliances')
+def get_appliance_energy():
+    """Get per-appliance energy (kWh) and mean power over a time range."""
+    try:
+        resolution = request.args.get('resolution', 'hour')
+        start = request.args.get('start')
+        end = request.args.get('end')
+        
+        paths = request_paths()
+        
+        # Rollups are kept up to date by the collector; only read them here
+        if not disaggregation.rollups_built(paths['rollups']):
+            disaggregation.start_build(paths['raw'], paths['rollups'])
+            return jsonify({'error': 'Energy rollups are being built, try again shortly'}), 503
+        
+        series, totals = disaggregation.query_energy(start, end, resolution, paths['rollups'])
+        series = series.assign(period_start=series['period_start'].astype(str))
+        return jsonify({
+            'resolution': resolution,
+            'totals_kwh': totals,
+            'series': series.to_dict('records')
+        })
+    except disaggregation.DisaggregationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/energy/power')
+def get_appliance_power():
+    """Get the power step function of each appliance over a time range."""
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        appliance = request.args.get('appliance')
+        
+        paths = request_paths()
+        if not disaggregation.rollups_built(paths['rollups']):
+            disaggregation.start_build(paths['raw'], paths['rollups'])
+            return jsonify({'error': 'Appliance power is being built, try again shortly'}), 503
+        
+        power = disaggregation.query_power(start, end, appliance, paths['rollups'])
+        power = power.assign(timestamp=power['timestamp'].astype(str))
+        return jsonify({'series': power.to_dict('records')})
+    except disaggregation.DisaggregationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def find_unlabeled_events():
+@app.route('/api/events/runs')
+def get_event_runs():
+    """Get appliance runs built by pairing on and off events."""
+    try:
+        tolerance = request.args.get('tolerance', 0.15, type=float)
+        events = []
+        data_dir = request_paths()['raw']
+        
+        if not os.path.exists(data_dir):
+            return jsonify({'runs': []})
+        
+        for filename in os.listdir(data_dir):
+            if filename.startswith("device_events_") and filename.endswith(".csv"):
+                filepath = os.path.join(data_dir, filename)
+                try:
+                    events.append(pd.read_csv(filepath, usecols=['timestamp', 'power_change', 'device_name']))
+                except Exception as e:
+                    print(f"Error reading {filename}: {e}")
+        
+        if not events:
+            return jsonify({'runs': []})
+        
+        runs = pairing.pair_events(pd.concat(events, ignore_index=True), tolerance=tolerance)
+        runs['on_timestamp'] = runs['on_timestamp'].astype(str)
+        runs['off_timestamp'] = runs['off_timestamp'].astype(str)
+        runs = runs.astype(object).where(runs.notna(), None)
+        return jsonify({'runs': runs.to_dict('records')})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def plot_dir():
+    """Directory visualize.py writes plots to, from visualization.plot_dir."""
+    try:
+        config = settings.load_config()
+    except settings.ConfigError:
+        return "plots"
+    return (config.get('visualization') or {}).get('plot_dir') or "plots"
+
+@app.route('/api/plots')
+def get_plots():
+    """List the cached plots generated by visualize.py."""
+    try:
+        index_path = os.path.join(plot_dir(), "cache.json")
+        if not os.path.exists(index_path):
+            return jsonify({'plots': []})
+        
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        plots = [
+            {'name': key, 'url': url_for('get_plot', filename=f"{key}.png"), 'version': version}
+            for key, version in sorted(index.items())
+        ]
+        return jsonify({'plots': plots})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/plots/<path:filename>')
+def get_plot(filename):
+    """Serve a cached plot image."""
+    return send_from_directory(os.path.abspath(plot_dir()), filename, max_age=300)
+
+def find_unlabeled_events(data_dir="data/raw"):
     """Find all unlabeled events."""
     unlabeled_events = []
-    data_dir = "data/raw"
     
     if not os.path.exists(data_dir):
         return pd.DataFrame()
@@ -163,24 +562,7 @@ def find_unlabeled_events():
     
     return pd.concat(unlabeled_events, ignore_index=True)
 
-def update_events_in_files(power_change, device_name, confidence):
-    """Update events in CSV files."""
-    data_dir = "data/raw"
-    
-    for filename in os.listdir(data_dir):
-        if filename.startswith("device_events_") and filename.endswith(".csv"):
-            filepath = os.path.join(data_dir, filename)
-            try:
-                df = pd.read_csv(filepath)
-                # Update matching events
-                mask = (df['power_change'] == power_change) & (df['device_name'] == 'unlabeled')
-                df.loc[mask, 'device_name'] = device_name
-                df.loc[mask, 'confidence'] = confidence
-                df.to_csv(filepath, index=False)
-            except Exception as e:
-                print(f"Error updating {filename}: {e}")
-
-def get_data_stats():
+def get_data_stats(data_dir="data/raw"):
     """Get data collection statistics."""
     stats = {
         'total_events': 0,
@@ -190,11 +572,10 @@ def get_data_stats():
     }
     
     try:
-        events = find_unlabeled_events()
+        events = find_unlabeled_events(data_dir)
         stats['unlabeled_events'] = len(events)
         
         # Count all events
-        data_dir = "data/raw"
         if os.path.exists(data_dir):
             for filename in os.listdir(data_dir):
                 if filename.startswith("device_events_") and filename.endswith(".csv"):
@@ -207,12 +588,12 @@ def get_data_stats():
                         pass
         
         # Get last update time
-        if os.path.exists("data/raw"):
-            files = [f for f in os.listdir("data/raw") if f.endswith('.csv')]
+        if os.path.exists(data_dir):
+            files = [f for f in os.listdir(data_dir) if f.endswith('.csv')]
             if files:
-                latest_file = max(files, key=lambda x: os.path.getmtime(os.path.join("data/raw", x)))
+                latest_file = max(files, key=lambda x: os.path.getmtime(os.path.join(data_dir, x)))
                 stats['last_update'] = datetime.fromtimestamp(
-                    os.path.getmtime(os.path.join("data/raw", latest_file))
+                    os.path.getmtime(os.path.join(data_dir, latest_file))
                 ).isoformat()
     
     except Exception as e:
@@ -221,342 +602,4 @@ def get_data_stats():
     return stats
 
 if __name__ == '__main__':
-    # Create templates directory and basic template
-    os.makedirs('templates', exist_ok=True)
-    
-    # Create basic HTML template
-    template_content = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>NILM Data Collection</title>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body { font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }
-        .container { max-width: 800px; margin: 0 auto; background: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header { text-align: center; margin-bottom: 30px; }
-        .status { padding: 15px; border-radius: 5px; margin: 20px 0; }
-        .status.running { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
-        .status.stopped { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
-        .controls { margin: 20px 0; }
-        button { padding: 10px 20px; margin: 5px; border: none; border-radius: 4px; cursor: pointer; }
-        .btn-primary { background: #007bff; color: white; }
-        .btn-success { background: #28a745; color: white; }
-        .btn-danger { background: #dc3545; color: white; }
-        .btn-secondary { background: #6c757d; color: white; }
-        .events-section { margin-top: 30px; }
-        .event-group { margin: 15px 0; padding: 15px; border: 1px solid #ddd; border-radius: 5px; }
-        .event-group h4 { margin: 0 0 10px 0; color: #333; }
-        .event-list { margin: 10px 0; }
-        .event-item { padding: 8px; background: #f8f9fa; margin: 5px 0; border-radius: 3px; }
-        .form-group { margin: 10px 0; }
-        .form-group label { display: block; margin-bottom: 5px; font-weight: bold; }
-        .form-group input, .form-group select { width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
-        .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(150px, 1fr)); gap: 15px; margin: 20px 0; }
-        .stat-card { background: #f8f9fa; padding: 15px; border-radius: 5px; text-align: center; }
-        .stat-number { font-size: 24px; font-weight: bold; color: #007bff; }
-        .stat-label { color: #666; font-size: 14px; }
-        .data-section { margin-top: 30px; }
-        .tabs { margin: 20px 0; }
-        .tab-btn { padding: 10px 20px; margin-right: 5px; border: 1px solid #ddd; background: #f8f9fa; cursor: pointer; border-radius: 4px 4px 0 0; }
-        .tab-btn.active { background: white; border-bottom: 1px solid white; }
-        .tab-content { border: 1px solid #ddd; border-top: none; padding: 20px; background: white; }
-        .data-table-container { max-height: 400px; overflow-y: auto; border: 1px solid #ddd; }
-        .data-table { width: 100%; border-collapse: collapse; }
-        .data-table th, .data-table td { padding: 8px 12px; text-align: left; border-bottom: 1px solid #eee; }
-        .data-table th { background: #f8f9fa; font-weight: bold; position: sticky; top: 0; }
-        .data-table tr:hover { background: #f5f5f5; }
-        .data-table tr.unlabeled { background: #fff3cd; }
-        .data-table tr.labeled { background: #d4edda; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🔌 NILM Data Collection</h1>
-            <p>Non-Intrusive Load Monitoring System</p>
-            <p><small>💡 Container läuft = Datensammlung läuft | Container stoppen = Datensammlung stoppen</small></p>
-        </div>
-        
-        <div id="status" class="status running">
-            Status: <span id="status-text">Running</span>
-        </div>
-        
-        <div class="stats">
-            <div class="stat-card">
-                <div class="stat-number" id="total-events">0</div>
-                <div class="stat-label">Total Events</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-number" id="unlabeled-events">0</div>
-                <div class="stat-label">Unlabeled</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-number" id="labeled-events">0</div>
-                <div class="stat-label">Labeled</div>
-            </div>
-        </div>
-        
-        <div class="controls">
-            <button class="btn-secondary" onclick="refreshData()">🔄 Refresh</button>
-        </div>
-        
-        <div class="events-section">
-            <h3>📝 Event Labeling</h3>
-            <div id="events-container">
-                <p>Loading events...</p>
-            </div>
-        </div>
-        
-        <div class="data-section">
-            <h3>📊 Data View</h3>
-            <div class="tabs">
-                <button class="tab-btn active" onclick="showTab('power')">Power Data</button>
-                <button class="tab-btn" onclick="showTab('events')">All Events</button>
-            </div>
-            
-            <div id="power-tab" class="tab-content">
-                <h4>Power Consumption Data</h4>
-                <div class="data-table-container">
-                    <table class="data-table">
-                        <thead>
-                            <tr>
-                                <th>Timestamp</th>
-                                <th>Power (W)</th>
-                                <th>Change (W)</th>
-                            </tr>
-                        </thead>
-                        <tbody id="power-data-body">
-                            <tr><td colspan="3">Loading...</td></tr>
-                        </tbody>
-                    </table>
-                </div>
-            </div>
-            
-            <div id="events-tab" class="tab-content" style="display: none;">
-                <h4>All Events (Labeled & Unlabeled)</h4>
-                <div class="data-table-container">
-                    <table class="data-table">
-                        <thead>
-                            <tr>
-                                <th>Timestamp</th>
-                                <th>Device</th>
-                                <th>Type</th>
-                                <th>Power Change (W)</th>
-                                <th>Confidence</th>
-                            </tr>
-                        </thead>
-                        <tbody id="events-data-body">
-                            <tr><td colspan="5">Loading...</td></tr>
-                        </tbody>
-                    </table>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        function updateStatus() {
-            fetch('/api/status')
-                .then(response => response.json())
-                .then(data => {
-                    // Always show running since container is running
-                    const statusEl = document.getElementById('status');
-                    const statusText = document.getElementById('status-text');
-                    
-                    statusText.textContent = 'Running';
-                    statusEl.className = 'status running';
-                    
-                    document.getElementById('total-events').textContent = data.stats.total_events || 0;
-                    document.getElementById('unlabeled-events').textContent = data.stats.unlabeled_events || 0;
-                    document.getElementById('labeled-events').textContent = data.stats.labeled_events || 0;
-                });
-        }
-        
-        function loadEvents() {
-            fetch('/api/events/unlabeled')
-                .then(response => response.json())
-                .then(data => {
-                    const container = document.getElementById('events-container');
-                    
-                    if (data.events.length === 0) {
-                        container.innerHTML = '<p>No unlabeled events found.</p>';
-                        return;
-                    }
-                    
-                    // Group events by power change
-                    const grouped = {};
-                    data.events.forEach(event => {
-                        const key = event.power_change;
-                        if (!grouped[key]) {
-                            grouped[key] = [];
-                        }
-                        grouped[key].push(event);
-                    });
-                    
-                    let html = '';
-                    Object.keys(grouped).forEach(powerChange => {
-                        const events = grouped[powerChange];
-                        const count = events.length;
-                        const changeType = events[0].change_type;
-                        const timestamp = new Date(events[0].timestamp).toLocaleString();
-                        
-                        html += `
-                            <div class="event-group">
-                                <h4>${powerChange}W ${changeType} (${count} events)</h4>
-                                <div class="event-list">
-                                    <div class="event-item">
-                                        <strong>Time:</strong> ${timestamp}<br>
-                                        <strong>Type:</strong> ${changeType}<br>
-                                        <strong>Count:</strong> ${count} similar events
-                                    </div>
-                                </div>
-                                <div class="form-group">
-                                    <label>Device Name:</label>
-                                    <input type="text" id="device-${powerChange}" placeholder="e.g., Wasserkocher, TV, etc.">
-                                </div>
-                                <div class="form-group">
-                                    <label>Confidence (1-5):</label>
-                                    <select id="confidence-${powerChange}">
-                                        <option value="1">1 - Unsure</option>
-                                        <option value="2">2 - Somewhat sure</option>
-                                        <option value="3" selected>3 - Moderately sure</option>
-                                        <option value="4">4 - Pretty sure</option>
-                                        <option value="5">5 - Very sure</option>
-                                    </select>
-                                </div>
-                                <button class="btn-primary" onclick="labelEvents(${powerChange})">Label Events</button>
-                            </div>
-                        `;
-                    });
-                    
-                    container.innerHTML = html;
-                });
-        }
-        
-        
-        function labelEvents(powerChange) {
-            const deviceName = document.getElementById(`device-${powerChange}`).value;
-            const confidence = document.getElementById(`confidence-${powerChange}`).value;
-            
-            if (!deviceName.trim()) {
-                alert('Please enter a device name');
-                return;
-            }
-            
-            fetch('/api/events/label', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    power_change: powerChange,
-                    device_name: deviceName,
-                    confidence: parseInt(confidence)
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert('Error: ' + data.error);
-                } else {
-                    alert('Events labeled successfully!');
-                    loadEvents();
-                    updateStatus();
-                }
-            });
-        }
-        
-        function refreshData() {
-            updateStatus();
-            loadEvents();
-            loadPowerData();
-            loadAllEvents();
-        }
-        
-        function showTab(tabName) {
-            // Hide all tabs
-            document.querySelectorAll('.tab-content').forEach(tab => {
-                tab.style.display = 'none';
-            });
-            document.querySelectorAll('.tab-btn').forEach(btn => {
-                btn.classList.remove('active');
-            });
-            
-            // Show selected tab
-            document.getElementById(tabName + '-tab').style.display = 'block';
-            event.target.classList.add('active');
-        }
-        
-        function loadPowerData() {
-            fetch('/api/data/power')
-                .then(response => response.json())
-                .then(data => {
-                    const tbody = document.getElementById('power-data-body');
-                    if (data.data.length === 0) {
-                        tbody.innerHTML = '<tr><td colspan="3">No power data available</td></tr>';
-                        return;
-                    }
-                    
-                    let html = '';
-                    data.data.forEach(row => {
-                        const timestamp = new Date(row.timestamp).toLocaleString();
-                        const power = parseFloat(row.power).toFixed(1);
-                        const change = parseFloat(row.power_change).toFixed(1);
-                        html += `<tr>
-                            <td>${timestamp}</td>
-                            <td>${power}</td>
-                            <td>${change}</td>
-                        </tr>`;
-                    });
-                    tbody.innerHTML = html;
-                });
-        }
-        
-        function loadAllEvents() {
-            fetch('/api/data/events')
-                .then(response => response.json())
-                .then(data => {
-                    const tbody = document.getElementById('events-data-body');
-                    if (data.data.length === 0) {
-                        tbody.innerHTML = '<tr><td colspan="5">No events available</td></tr>';
-                        return;
-                    }
-                    
-                    let html = '';
-                    data.data.forEach(row => {
-                        const timestamp = new Date(row.timestamp).toLocaleString();
-                        const device = row.device_name || 'unlabeled';
-                        const type = row.change_type || '';
-                        const change = parseFloat(row.power_change).toFixed(1);
-                        const confidence = row.confidence || 0;
-                        
-                        const deviceClass = device === 'unlabeled' ? 'unlabeled' : 'labeled';
-                        html += `<tr class="${deviceClass}">
-                            <td>${timestamp}</td>
-                            <td>${device}</td>
-                            <td>${type}</td>
-                            <td>${change}</td>
-                            <td>${confidence}</td>
-                        </tr>`;
-                    });
-                    tbody.innerHTML = html;
-                });
-        }
-        
-        // Auto-refresh every 30 seconds
-        setInterval(updateStatus, 30000);
-        
-        // Initial load
-        updateStatus();
-        loadEvents();
-        loadPowerData();
-        loadAllEvents();
-    </script>
-</body>
-</html>
-    '''
-    
-    with open('templates/index.html', 'w') as f:
-        f.write(template_content)
-    
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)), debug=False)
@@ -0,0 +1,332 @@
+"""
+Streaming baseload and anomaly detection on the collector's samples.
+
+Rolling quantiles of the power are tracked with P² estimators (Jain and
+Chlamtac, 1985), which keep five markers per quantile instead of the samples,
+so a site's state is a few dozen numbers however long the collector runs:
+
+- the low quantile (default 5%) is the always-on baseload, the standby floor
+  under which the household never drops;
+- the high quantile (default 99%) is the upper bound of normal consumption.
+  A draw that stays above it for longer than ``anomaly_minutes`` is flagged
+  as an anomaly until it falls back below.
+
+A P² estimator summarises everything it has seen, so each quantile is kept by
+two estimators started half a window apart; the older one answers and is
+replaced when it has seen a full window. Estimates therefore cover between a
+half and a full window of recent samples.
+
+The collector saves the state to ``data/processed/baseload.json`` (one file
+per site) at every flush; the web app serves it from ``/api/baseload``.
+"""
+
+import os
+import json
+import logging
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BASELOAD_PATH = "data/processed/baseload.json"
+RECENT_ANOMALIES = 20
+
+class BaseloadError(Exception):
+    """Raised when the baseload state cannot be read."""
+    pass
+
+class P2Quantile:
+    """
+    P² estimate of one quantile in constant memory.
+
+    Args:
+        p (float): Quantile between 0 and 1
+    """
+
+    def __init__(self, p):
+        if not 0 < p < 1:
+            raise ValueError(f"Quantile {p} is not between 0 and 1")
+        self.p = p
+        self.count = 0
+        self.heights = []  # Marker heights, the first five samples until initialised
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        """Add one observation."""
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < height < q[i + 1]:
+                    # Linear prediction when the parabola overshoots a neighbour
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    @property
+    def value(self):
+        """Current estimate, None before the first observation."""
+        if not self.heights:
+            return None
+        if self.count < 5:
+            return self.heights[int(round(self.p * (self.count - 1)))]
+        return self.heights[2]
+
+    def to_dict(self):
+        return {'p': self.p, 'count': self.count, 'heights': list(self.heights),
+                'positions': list(self.positions), 'desired': list(self.desired)}
+
+    @classmethod
+    def from_dict(cls, state):
+        estimator = cls(state['p'])
+        estimator.count = state['count']
+        estimator.heights = list(state['heights'])
+        estimator.positions = list(state['positions'])
+        estimator.desired = list(state['desired'])
+        return estimator
+
+class WindowedQuantile:
+    """
+    Quantile over roughly the last ``window`` samples from staggered P² estimators.
+
+    Args:
+        p (float): Quantile between 0 and 1
+        window (int): Samples per window, at least 2
+    """
+
+    def __init__(self, p, window):
+        self.p = p
+        self.window = max(int(window), 2)
+        self.estimators = [P2Quantile(p)]
+
+    def add(self, x):
+        """Add one observation."""
+        for estimator in self.estimators:
+            estimator.add(x)
+        if self.estimators[-1].count >= self.window // 2:
+            self.estimators.append(P2Quantile(self.p))
+            if len(self.estimators) > 2:
+                self.estimators.pop(0)
+
+    @property
+    def count(self):
+        """Samples behind the current estimate."""
+        return self.estimators[0].count
+
+    @property
+    def value(self):
+        return self.estimators[0].value
+
+    def to_dict(self):
+        return {'p': self.p, 'window': self.window, 'estimators': [e.to_dict() for e in self.estimators]}
+
+    @classmethod
+    def from_dict(cls, state):
+        quantile = cls(state['p'], state['window'])
+        quantile.estimators = [P2Quantile.from_dict(e) for e in state['estimators']]
+        return quantile
+
+class BaseloadMonitor:
+    """
+    Baseload estimate and sustained-draw anomaly detection for one power sensor.
+
+    Args:
+        interval (float): Seconds between samples, sets the window in samples
+        window_hours (float): Length of the rolling window
+        quantile (float): Quantile taken as the baseload
+        anomaly_quantile (float): Quantile above which power counts as unusual
+        anomaly_minutes (float): Minutes power must stay unusual to be flagged
+        min_samples (int): Samples before anomalies are flagged
+    """
+
+    def __init__(self, interval, window_hours=24, quantile=0.05, anomaly_quantile=0.99,
+                 anomaly_minutes=10, min_samples=100):
+        window = window_hours * 3600 / interval
+        self.anomaly_seconds = anomaly_minutes * 60
+        self.min_samples = min_samples
+        self.baseload = WindowedQuantile(quantile, window)
+        self.median = WindowedQuantile(0.5, window)
+        self.upper = WindowedQuantile(anomaly_quantile, window)
+        self.anomaly = None  # Excursion above the upper quantile in progress
+        self.recent = deque(maxlen=RECENT_ANOMALIES)
+
+    def add(self, timestamp, power):
+        """
+        Add a sample.
+
+        Args:
+            timestamp (datetime): Sample time
+            power (float): Power in Watts
+
+        Returns:
+            dict: The anomaly when one is flagged or ends, otherwise None
+        """
+        result = None
+        upper = self.upper.value
+        if self.upper.count >= self.min_samples and upper is not None:
+            if self.anomaly is None and power > upper:
+                # The threshold is fixed for the excursion so it cannot drift up with it
+                self.anomaly = {'start': timestamp, 'threshold': upper, 'baseload': self.baseload.value,
+                                'samples': 0, 'power_sum': 0.0, 'peak': power, 'flagged': False}
+            if self.anomaly is not None:
+                anomaly = self.anomaly
+                if power > anomaly['threshold']:
+                    anomaly['samples'] += 1
+                    anomaly['power_sum'] += power
+                    anomaly['peak'] = max(anomaly['peak'], power)
+                    anomaly['end'] = timestamp
+                    if not anomaly['flagged'] and _seconds(anomaly['start'], timestamp) >= self.anomaly_seconds:
+                        anomaly['flagged'] = True
+                        result = self._summary(anomaly, active=True)
+                else:
+                    if anomaly['flagged']:
+                        result = self._summary(anomaly, active=False)
+                        self.recent.append(result)
+                    self.anomaly = None
+
+        self.baseload.add(power)
+        self.median.add(power)
+        self.upper.add(power)
+        return result
+
+    @staticmethod
+    def _summary(anomaly, active):
+        return {
+            'start': _iso(anomaly['start']),
+            'end': _iso(anomaly['end']),
+            'duration_seconds': _seconds(anomaly['start'], anomaly['end']),
+            'mean_power': anomaly['power_sum'] / anomaly['samples'],
+            'peak_power': anomaly['peak'],
+            'threshold': anomaly['threshold'],
+            'baseload': anomaly['baseload'],
+            'active': active,
+        }
+
+    @property
+    def anomaly_active(self):
+        return self.anomaly is not None and self.anomaly['flagged']
+
+    def snapshot(self):
+        """JSON-ready estimates and estimator state, taken on the sampling thread."""
+        return {
+            'updated': datetime.now().isoformat(),
+            'baseload_watts': self.baseload.value,
+            'median_watts': self.median.value,
+            'upper_watts': self.upper.value,
+            'samples': self.baseload.count,
+            'anomaly': self._summary(self.anomaly, True) if self.anomaly_active else None,
+            'recent_anomalies': list(self.recent),
+            'state': {
+                'baseload': self.baseload.to_dict(),
+                'median': self.median.to_dict(),
+                'upper': self.upper.to_dict(),
+            },
+        }
+
+    def restore(self, snapshot):
+        """
+        Continue from a saved snapshot if it has the same quantiles and window.
+
+        Returns:
+            bool: True if the state was restored
+        """
+        try:
+            state = snapshot['state']
+            quantiles = {name: WindowedQuantile.from_dict(state[name]) for name in ('baseload', 'median', 'upper')}
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring saved baseload state: {e}")
+            return False
+        for name, quantile in quantiles.items():
+            current = getattr(self, name)
+            if (quantile.p, quantile.window) != (current.p, current.window):
+                return False
+        self.baseload, self.median, self.upper = quantiles['baseload'], quantiles['median'], quantiles['upper']
+        self.recent.extend(snapshot.get('recent_anomalies') or [])
+        return True
+
+def _seconds(start, end):
+    return (end - start).total_seconds()
+
+def _iso(timestamp):
+    return timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp
+
+def start_baseload_monitor(config, path=BASELOAD_PATH):
+    """
+    Create the baseload monitor of a site if it is enabled.
+
+    Args:
+        config (dict): Configuration dictionary
+        path (str): State file to resume from
+
+    Returns:
+        BaseloadMonitor: Monitor, or None if disabled
+    """
+    settings = config.get('baseload', {})
+    if not settings.get('enabled', True):
+        return None
+    monitor = BaseloadMonitor(
+        config['data_collection']['interval'],
+        window_hours=settings.get('window_hours', 24),
+        quantile=settings.get('quantile', 0.05),
+        anomaly_quantile=settings.get('anomaly_quantile', 0.99),
+        anomaly_minutes=settings.get('anomaly_minutes', 10),
+    )
+    try:
+        if monitor.restore(load_state(path)):
+            logger.info(f"Resumed baseload estimates from {path}")
+    except BaseloadError:
+        pass
+    return monitor
+
+def save_state(snapshot, path=BASELOAD_PATH):
+    """Write a snapshot atomically."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def load_state(path=BASELOAD_PATH):
+    """
+    Read a saved snapshot.
+
+    Raises:
+        BaseloadError: If the file is missing or invalid
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise BaseloadError(f"{path} not found, is the collector running?")
+    except (OSError, ValueError) as e:
+        raise BaseloadError(f"Error reading {path}: {e}")
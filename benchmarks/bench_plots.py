@@ -0,0 +1,54 @@
+"""
+Benchmark of visualize.create_plots for growing history lengths.
+
+Plot time should stay roughly flat as the number of samples grows, because
+line plots are decimated to the output width and the histogram is binned
+before drawing.
+
+Example:
+    python benchmarks/bench_plots.py --min-exponent 5 --max-exponent 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from visualize import load_config, create_plots, detect_events
+
+def make_series(n_samples, seed=0):
+    """Random step series sampled every second."""
+    rng = np.random.default_rng(seed)
+    steps = rng.choice([0.0, 0.0, 0.0, 50.0, -50.0], size=n_samples) * (rng.random(n_samples) < 0.001)
+    power = np.clip(200 + np.cumsum(steps), 50, None) + rng.normal(0, 2, n_samples)
+    timestamps = pd.date_range('2025-01-01', periods=n_samples, freq='s')
+    return pd.DataFrame({'timestamp': timestamps, 'power': power})
+
+def main():
+    """Time plot generation for each history length."""
+    parser = argparse.ArgumentParser(description="Benchmark plot rendering.")
+    parser.add_argument('--min-exponent', type=int, default=5)
+    parser.add_argument('--max-exponent', type=int, default=7,
+                        help="Largest size as a power of ten (8 needs several GB of memory)")
+    args = parser.parse_args()
+
+    config = load_config()
+    # Fixed detection parameters so that runs are comparable
+    config['event_detection'].update(threshold=20, min_peak_distance=10)
+    for exponent in range(args.min_exponent, args.max_exponent + 1):
+        data = make_series(10 ** exponent)
+        events = detect_events(data, config)
+        with tempfile.TemporaryDirectory() as plot_dir:
+            config['visualization']['plot_dir'] = plot_dir
+            start = time.perf_counter()
+            create_plots(data, events, config)
+            elapsed = time.perf_counter() - start
+        print(f"10^{exponent} samples: {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
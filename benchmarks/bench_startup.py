@@ -0,0 +1,115 @@
+"""
+Startup benchmark of the entry points and the web app.
+
+Measures the import time of each entry point with ``python -X importtime``,
+lists the slowest imports, and times how long ``app.py`` takes until
+``/api/health`` answers.
+
+Example:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --modules app --max-ready 1.0
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ENTRY_POINTS = ['app', 'main', 'train_model', 'visualize', 'sweep', 'disaggregation', 'pyramid']
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Args:
+        module (str): Module name
+
+    Returns:
+        tuple: (total seconds, list of (cumulative seconds, imported module)
+            sorted slowest first), or (None, error message) on failure
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+
+    times = []
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        seconds = int(cumulative) / 1e6
+        times.append((seconds, name.strip()))
+        if name.strip() == module:
+            total = seconds
+    return total, sorted(times, reverse=True)
+
+def app_ready_seconds(port, timeout=30.0):
+    """
+    Start app.py and time how long until /api/health answers.
+
+    Returns:
+        float: Seconds until ready, or None if it did not become ready
+    """
+    env = dict(os.environ, PORT=str(port))
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'app.py')], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - start < timeout and server.poll() is None:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1):
+                    return time.monotonic() - start
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    """Measure import and readiness times."""
+    parser = argparse.ArgumentParser(description="Benchmark entry point startup time.")
+    parser.add_argument('--modules', default=','.join(ENTRY_POINTS),
+                        help="Comma separated modules to import")
+    parser.add_argument('--top', type=int, default=5, help="Slowest imports listed per module")
+    parser.add_argument('--port', type=int, default=18080, help="Port for the app readiness check")
+    parser.add_argument('--max-ready', type=float, default=None,
+                        help="Exit with status 1 if app.py takes longer to become ready")
+    parser.add_argument('--output', default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    results = {}
+    for module in [m for m in args.modules.split(',') if m.strip()]:
+        total, times = import_times(module)
+        if total is None:
+            print(f"{module:16s} failed: {times}")
+            results[module] = {'error': times}
+            continue
+        print(f"{module:16s} {total:7.3f}s")
+        # The module itself is the slowest entry; list what it pulls in
+        slowest = [(s, name) for s, name in times if name != module][:args.top]
+        for seconds, name in slowest:
+            print(f"    {seconds:7.3f}s {name}")
+        results[module] = {'import_seconds': round(total, 4),
+                           'slowest': [{'module': n, 'seconds': round(s, 4)} for s, n in slowest]}
+
+    ready = app_ready_seconds(args.port)
+    print(f"app.py ready in {ready:.3f}s" if ready is not None else "app.py did not become ready")
+    results['app_ready_seconds'] = round(ready, 4) if ready is not None else None
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.max_ready is not None and (ready is None or ready > args.max_ready):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
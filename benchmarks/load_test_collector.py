@@ -0,0 +1,135 @@
+"""
+Load test of the collector (main.py) against a local fake Home Assistant.
+
+Replays simulated days of synthetic data at high speed, runs the collector
+in a subprocess pointed at the fake instance and reports sample throughput,
+the delay between a state change in Home Assistant and its observation by
+the collector, and the collector's peak memory.
+
+Example:
+    python benchmarks/load_test_collector.py --days 2 --speed 2880 --interval 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from synthetic import generate_household
+from fake_ha import FakeHomeAssistant, DEFAULT_ENTITY_ID, DEFAULT_TOKEN
+from data_loader import load_power_data
+
+def run_load_test(days, speed, interval, latency=0.0, error_rate=0.0, save_interval=100, seed=0):
+    """
+    Run the collector against a fake Home Assistant until the trace ends.
+
+    Args:
+        days (float): Simulated days to replay
+        speed (float): Simulated seconds per wall-clock second
+        interval (float): Collector polling interval in seconds
+        latency (float): Added Home Assistant response latency in seconds
+        error_rate (float): Fraction of failing Home Assistant requests
+        save_interval (int): Collector flush interval in samples
+        seed (int): Random seed of the synthetic trace
+
+    Returns:
+        dict: Throughput, observation delay and memory statistics
+    """
+    data, truth = generate_household(days=days, seed=seed)
+    fake = FakeHomeAssistant(data, speed=speed, latency=latency, error_rate=error_rate).start()
+    wall_seconds = days * 86400 / speed
+
+    workdir = tempfile.mkdtemp(prefix='nilm_load_')
+    try:
+        shutil.copy(os.path.join(ROOT, 'config.yaml'), workdir)
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            HA_URL=fake.url,
+            HA_TOKEN=DEFAULT_TOKEN,
+            HA_ENTITY_ID=DEFAULT_ENTITY_ID,
+            EVENT_THRESHOLD='20',
+            MIN_PEAK_DISTANCE='10',
+            WINDOW_SIZE='30',
+            N_APPLIANCES='5',
+            SAVE_INTERVAL=str(save_interval),
+            COLLECTION_INTERVAL=str(interval),
+            MAX_SAMPLES=str(10 ** 9),
+        )
+
+        start = time.monotonic()
+        collector = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'main.py')],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while not fake.finished and collector.poll() is None:
+                time.sleep(0.5)
+        finally:
+            # SIGINT lets the collector save its final data
+            collector.send_signal(signal.SIGINT)
+            try:
+                collector.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                collector.kill()
+                collector.wait()
+        elapsed = time.monotonic() - start
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+        try:
+            samples = len(load_power_data(os.path.join(workdir, 'data', 'raw'), cache_dir=None))
+        except Exception:
+            samples = 0
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    delays = fake.observation_delays()
+    return {
+        'simulated_days': days,
+        'speed': speed,
+        'wall_seconds': round(elapsed, 1),
+        'expected_wall_seconds': round(wall_seconds, 1),
+        'samples': samples,
+        'samples_per_second': round(samples / elapsed, 1) if elapsed else None,
+        'ha_requests': fake.requests,
+        'ha_errors': fake.errors,
+        'state_changes': int(len(fake.changes)),
+        'state_changes_observed': int(len(delays)),
+        'true_events': int(len(truth)),
+        'observation_delay_p50_ms': round(float(np.percentile(delays, 50)) * 1000, 1) if len(delays) else None,
+        'observation_delay_p99_ms': round(float(np.percentile(delays, 99)) * 1000, 1) if len(delays) else None,
+        'collector_peak_rss_mb': round(peak_rss_mb, 1),
+    }
+
+def main():
+    """Run the load test and print the results."""
+    parser = argparse.ArgumentParser(description="Load test the collector against a fake Home Assistant.")
+    parser.add_argument('--days', type=float, default=1.0, help="Simulated days")
+    parser.add_argument('--speed', type=float, default=1440.0, help="Simulated seconds per second")
+    parser.add_argument('--interval', type=float, default=0.05, help="Collector polling interval")
+    parser.add_argument('--latency', type=float, default=0.0, help="Home Assistant latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--save-interval', type=int, default=100)
+    parser.add_argument('--output', default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    results = run_load_test(args.days, args.speed, args.interval, args.latency,
+                            args.error_rate, args.save_interval)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
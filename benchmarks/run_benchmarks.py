@@ -0,0 +1,243 @@
+"""
+Benchmark suite for the NILM pipeline on synthetic household data.
+
+Measures wall time, throughput and peak traced memory of each pipeline
+stage for several trace lengths and stores the results as JSON, so that runs
+can be compared against a previous result for regressions.
+
+Each stage runs twice: untraced for the timings, as tracemalloc slows
+allocating code down several times over, then under tracemalloc for the
+peak memory. In-process caches are cleared before each run so that both
+runs start from the same cold state.
+
+Example:
+    python benchmarks/run_benchmarks.py --sizes 1e4,1e5,1e6
+    python benchmarks/run_benchmarks.py --sizes 1e6 --compare benchmarks/results/previous.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+from synthetic import generate_household, write_dataset
+import chunked_training
+import data_loader
+import model_store
+from data_loader import load_power_data
+from features import detect_change_points, extract_event_features
+from settings import load_config
+
+STAGES = ['load', 'detect', 'features', 'train', 'predict', 'api', 'plot']
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Detection parameters used for every run, so results stay comparable
+THRESHOLD = 20
+MIN_PEAK_DISTANCE = 10
+WINDOW_SIZE = 30
+N_APPLIANCES = 5
+
+def clear_caches():
+    """Drop the in-process caches so every run starts cold."""
+    data_loader.clear_cache()
+    model_store.clear_cache()
+
+def measure(fn, *args, reset=clear_caches, **kwargs):
+    """
+    Run a function twice: untraced for its duration, then under tracemalloc
+    for its peak memory.
+
+    Args:
+        fn (callable): Function to measure
+        reset (callable): Called before each run, None to run without reset
+
+    Returns:
+        tuple: (function result of the timed run, seconds, peak memory in MB)
+    """
+    if reset is not None:
+        reset()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+def bench_config(plot_dir):
+    """Configuration for the benchmarked stages."""
+    config = load_config(os.path.join(ROOT, 'config.yaml'))
+    config['event_detection'].update(
+        threshold=THRESHOLD, min_peak_distance=MIN_PEAK_DISTANCE, window_size=WINDOW_SIZE
+    )
+    config['nilm_model']['n_appliances'] = N_APPLIANCES
+    config['visualization']['plot_dir'] = plot_dir
+    return config
+
+def run_size(n_samples, stages, workdir):
+    """
+    Benchmark all stages for one trace length.
+
+    Args:
+        n_samples (int): Number of 1 s samples
+        stages (list): Stages to run
+        workdir (str): Empty working directory for generated files
+
+    Returns:
+        dict: Stage name -> seconds, peak_mb and samples_per_second
+    """
+    results = {}
+
+    def record(stage, elapsed, peak_mb):
+        results[stage] = {
+            'seconds': round(elapsed, 4),
+            'peak_mb': round(peak_mb, 1),
+            'samples_per_second': round(n_samples / elapsed) if elapsed > 0 else None,
+        }
+        print(f"  {stage:10s} {elapsed:9.3f}s {peak_mb:9.1f}MB")
+
+    data, truth = generate_household(days=n_samples / 86400, interval=1.0, seed=0)
+    data_dir = os.path.join(workdir, 'data', 'raw')
+    config = bench_config(os.path.join(workdir, 'plots'))
+
+    # Loading, training and the API read the collector's files
+    if {'load', 'train', 'predict', 'api'} & set(stages):
+        write_dataset(data, truth, data_dir)
+    if 'load' in stages:
+        _, elapsed, peak = measure(load_power_data, data_dir, cache_dir=None)
+        record('load', elapsed, peak)
+
+    power = data['power'].to_numpy()
+    indices, elapsed, peak = measure(detect_change_points, power, THRESHOLD, MIN_PEAK_DISTANCE)
+    if 'detect' in stages:
+        record('detect', elapsed, peak)
+    if 'features' in stages:
+        _, elapsed, peak = measure(extract_event_features, power, indices, WINDOW_SIZE)
+        record('features', elapsed, peak)
+
+    if 'train' in stages or 'predict' in stages:
+        feature_dir = os.path.join(workdir, 'features')
+        trained, elapsed, peak = measure(chunked_training.train, data_dir, config, feature_dir=feature_dir)
+        if 'train' in stages:
+            record('train', elapsed, peak)
+        if 'predict' in stages:
+            series = pd.Series(power, index=pd.DatetimeIndex(data['timestamp']), name='watts')
+            events = pd.DataFrame({
+                'timestamp': series.index[indices],
+                'magnitude': power[indices] - power[indices - 1],
+                'power_before': power[indices - 1],
+                'power_after': power[indices],
+            })
+            _, elapsed, peak = measure(trained['model'].predict, series, events)
+            record('predict', elapsed, peak)
+
+    if 'api' in stages:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            import app as web_app
+            client = web_app.app.test_client()
+
+            def reset():
+                # The endpoints also keep parsed files on disk
+                clear_caches()
+                shutil.rmtree(os.path.join(workdir, 'data', 'cache'), ignore_errors=True)
+
+            for endpoint in ['/api/status', '/api/data/power', '/api/events/statistics']:
+                response, elapsed, peak = measure(client.get, endpoint, reset=reset)
+                record(f"api {endpoint}", elapsed, peak)
+                if response.status_code != 200:
+                    print(f"    {endpoint} returned {response.status_code}")
+        finally:
+            os.chdir(cwd)
+
+    if 'plot' in stages:
+        from visualize import detect_events, create_plots
+        events = detect_events(data, config)
+        _, elapsed, peak = measure(create_plots, data, events, config)
+        record('plot', elapsed, peak)
+
+    return results
+
+def compare(current, baseline_path, tolerance):
+    """Print stages that got slower than the baseline by more than tolerance."""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)['results']
+
+    regressions = 0
+    for size, stages in current.items():
+        for stage, result in stages.items():
+            before = baseline.get(size, {}).get(stage, {})
+            if 'seconds' not in result or 'seconds' not in before or not before['seconds']:
+                continue
+            ratio = result['seconds'] / before['seconds']
+            flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+            regressions += bool(flag)
+            print(f"{size:>12s} {stage:28s} {before['seconds']:9.3f}s -> {result['seconds']:9.3f}s "
+                  f"({ratio:5.2f}x) {flag}")
+    return regressions
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description="Benchmark the NILM pipeline.")
+    parser.add_argument('--sizes', default='1e4,1e5,1e6',
+                        help="Comma separated numbers of samples (up to 1e8)")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"Comma separated stages out of {','.join(STAGES)}")
+    parser.add_argument('--output', default=None, help="Result JSON file")
+    parser.add_argument('--compare', default=None, help="Previous result JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    sizes = [int(float(s)) for s in args.sizes.split(',') if s.strip()]
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages {', '.join(unknown)}, expected some of {','.join(STAGES)}")
+
+    results = {}
+    for n_samples in sizes:
+        print(f"{n_samples} samples:")
+        with tempfile.TemporaryDirectory() as workdir:
+            results[str(n_samples)] = run_size(n_samples, stages, workdir)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'results': results,
+        }, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Live data channel between the collector and the web app.
+
+The collector publishes every sample and event to a SQLite database in WAL
+mode (``data/live.db``). WAL lets the web app read concurrently with the
+collector's writes, so the dashboard sees new samples as soon as they are
+collected instead of after the next CSV flush, and reads only rows newer than
+the last id it has seen. Rows older than the retention period are pruned; the
+CSV files in ``data/raw`` stay the permanent record.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PATH = "data/live.db"
+RETENTION_SECONDS = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    power REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+"""
+
+class ChannelError(Exception):
+    """Raised when the live channel cannot be opened or read."""
+    pass
+
+def _epoch(timestamp):
+    """Seconds since the epoch of an ISO string, datetime or number."""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if hasattr(timestamp, 'timestamp'):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+class LivePublisher:
+    """
+    Write side of the channel, used by the collector.
+
+    Args:
+        path (str): Database file
+        retention (float): Seconds of data kept in the channel
+    """
+
+    def __init__(self, path=CHANNEL_PATH, retention=RETENTION_SECONDS):
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL with synchronous=NORMAL commits without an fsync per sample
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            raise ChannelError(f"Error opening live channel {path}: {e}")
+
+    def publish_sample(self, timestamp, power):
+        """Publish one power sample."""
+        with self._lock:
+            self._conn.execute("INSERT INTO samples (ts, power) VALUES (?, ?)",
+                               (_epoch(timestamp), float(power)))
+
+    def publish_event(self, event):
+        """Publish one detected event (a dict with an ISO 'timestamp')."""
+        ts = _epoch(event['timestamp'])
+        with self._lock:
+            self._conn.execute("INSERT INTO events (ts, data) VALUES (?, ?)",
+                               (ts, json.dumps(event, default=str)))
+
+    def prune(self, now=None):
+        """Delete rows older than the retention period."""
+        cutoff = (now if now is not None else time.time()) - self.retention
+        with self._lock:
+            self._conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+            self._conn.execute("DELETE FROM events WHERE ts < ?", (cutoff,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class LiveReader:
+    """
+    Read side of the channel, used by the web app.
+
+    Each thread gets its own read-only connection.
+
+    Args:
+        path (str): Database file
+    """
+
+    def __init__(self, path=CHANNEL_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if not os.path.exists(self.path):
+                raise ChannelError(f"Live channel {self.path} not found, is the collector running?")
+            try:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            except sqlite3.Error as e:
+                raise ChannelError(f"Error opening live channel {self.path}: {e}")
+            self._local.conn = conn
+        return conn
+
+    def samples_since(self, after_id=0, limit=1000):
+        """
+        Samples published after a given id.
+
+        Args:
+            after_id (int): Last sample id already seen
+            limit (int): Maximum number of samples returned
+
+        Returns:
+            list: Dicts with id, timestamp and power in publishing order
+        """
+        try:
+            rows = self._connection().execute(
+                "SELECT id, ts, power FROM samples WHERE id > ? ORDER BY id LIMIT ?",
+                (int(after_id), int(limit))
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise ChannelError(f"Error reading live samples: {e}")
+        return [{'id': row[0], 'timestamp': _iso(row[1]), 'power': row[2]} for row in rows]
+
+    def events_since(self, after_id=0, limit=100):
+        """
+        Events published after a given id.
+
+        Returns:
+            list: Event dicts as published, with an added id
+        """
+        try:
+            rows = self._connection().execute(
+                "SELECT id, data FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                (int(after_id), int(limit))
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise ChannelError(f"Error reading live events: {e}")
+        return [dict(json.loads(data), id=row_id) for row_id, data in rows]
+
+    def latest_samples(self, count=300):
+        """The most recent samples in publishing order."""
+        try:
+            rows = self._connection().execute(
+                "SELECT id, ts, power FROM samples ORDER BY id DESC LIMIT ?", (int(count),)
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise ChannelError(f"Error reading live samples: {e}")
+        return [{'id': row[0], 'timestamp': _iso(row[1]), 'power': row[2]} for row in reversed(rows)]
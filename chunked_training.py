@@ -0,0 +1,301 @@
+"""
+Out-of-core training over the full power history.
+
+The history is walked one ``power_data_*.csv`` file at a time, so memory is
+bounded by the largest file rather than by the length of the history. The
+collector starts a new file every ``data_collection.max_samples`` samples,
+so that is the bound; files from other sources should be split by time to
+the same size before training.
+
+1. Each partition is read together with the last and first ``context``
+   samples of its neighbours (read without loading the rest of those
+   files), events are detected on the joined series and
+   kept only if they fall in the partition itself, so steps at a file
+   boundary are found exactly once and feature windows see both sides.
+   Partitions are independent and can be processed by worker processes.
+2. Event features are spilled to one ``.npy`` file per partition while the
+   feature scaler is fitted incrementally (``StandardScaler.partial_fit``).
+3. ``MiniBatchKMeans.partial_fit`` clusters the scaled features in batches
+   of ``batch_size`` events, over a few passes of the spilled files. The
+   centres are initialised once, with k-means++ on the first batch;
+   ``partial_fit`` makes no restarts.
+4. A last pass assigns every event to an appliance and accumulates the
+   appliance profiles stored with the model.
+
+The trained :class:`EventClusterModel` has the ``predict(power_data, events)``
+interface used by live inference and is saved with :func:`model_store.save_model`.
+"""
+
+import os
+import glob
+import shutil
+import logging
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+from data_loader import read_power_file, DataLoadError, POWER_PATTERN
+from features import detect_change_points, extract_event_features, FEATURE_COLUMNS
+import resample
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIR = "data/cache/features"
+BATCH_SIZE = 4096
+PASSES = 3
+
+class ChunkedTrainingError(Exception):
+    """Raised when the out-of-core training cannot be run."""
+    pass
+
+class EventClusterModel:
+    """
+    Appliance model assigning events to clusters of event features.
+
+    Args:
+        scaler (StandardScaler): Fitted feature scaler
+        kmeans (MiniBatchKMeans): Fitted clustering, one cluster per appliance
+        window_size (int): Samples averaged on each side of a step
+    """
+
+    def __init__(self, scaler, kmeans, window_size):
+        self.scaler = scaler
+        self.kmeans = kmeans
+        self.window_size = window_size
+
+    def features(self, power_data, events):
+        """
+        Feature matrix of events, with steady-state levels from the power
+        readings around them when available.
+
+        Args:
+            power_data (pd.Series): Power readings indexed by timestamp
+            events (pd.DataFrame): Events with timestamp, magnitude,
+                power_before and power_after columns
+
+        Returns:
+            np.ndarray: Array of shape (n_events, len(FEATURE_COLUMNS))
+        """
+        before = events['power_before'].to_numpy(dtype=float)
+        after = events['power_after'].to_numpy(dtype=float)
+        result = np.column_stack([events['magnitude'].to_numpy(dtype=float), before, after, before, after])
+        if len(power_data) and len(events):
+            timestamps = resample.nanoseconds(power_data.index)
+            # First reading at or after each event is the first sample after the step
+            indices = np.searchsorted(timestamps, resample.nanoseconds(events['timestamp']))
+            found = (indices >= 1) & (indices < len(timestamps))
+            if found.any():
+                steady = extract_event_features(power_data.to_numpy(dtype=float), indices[found], self.window_size)
+                result[found, 3:] = steady[:, 3:]
+        return result
+
+    def predict(self, power_data, events):
+        """
+        Assign events to appliances.
+
+        Args:
+            power_data (pd.Series): Power readings indexed by timestamp
+            events (pd.DataFrame): Events to classify
+
+        Returns:
+            pd.DataFrame: The events with an 'appliance' column
+        """
+        predictions = events.copy()
+        if events.empty:
+            predictions['appliance'] = pd.Series(dtype=np.int64)
+            return predictions
+        features = self.scaler.transform(self.features(power_data, events))
+        predictions['appliance'] = self.kmeans.predict(features)
+        return predictions
+
+def partition_files(data_dir):
+    """
+    Partitions of the history in time order.
+
+    Args:
+        data_dir (str): Directory containing power_data_*.csv files
+
+    Returns:
+        list: File paths
+    """
+    files = sorted(glob.glob(os.path.join(data_dir, POWER_PATTERN)))
+    if not files:
+        raise ChunkedTrainingError(f"No power data files found in {data_dir}")
+    return files
+
+def context_size(config):
+    """Samples borrowed from each neighbouring partition."""
+    detection = config['event_detection']
+    return 2 * max(int(detection.get('window_size') or 1), int(detection['min_peak_distance']))
+
+def partition_events(files, index, config):
+    """
+    Detect the events of one partition and compute their features.
+
+    Args:
+        files (list): All partitions from :func:`partition_files`
+        index (int): Partition to process
+        config (dict): Configuration dictionary
+
+    Returns:
+        dict: Event timestamps (int64 ns) and feature matrix, and the
+            partition's sample count and time range
+    """
+    context = context_size(config)
+    detection = config['event_detection']
+    try:
+        current = read_power_file(files[index])
+        before = read_power_file(files[index - 1], tail=context) if index > 0 else current.iloc[:0]
+        after = read_power_file(files[index + 1], head=context) if index + 1 < len(files) else current.iloc[:0]
+    except (OSError, ValueError, DataLoadError) as e:
+        raise ChunkedTrainingError(f"Error reading partition {files[index]}: {e}")
+
+    data = resample.prepare(pd.concat([before, current, after], ignore_index=True), config)
+    power = data['power'].to_numpy(dtype=float)
+    breaks = data['gap'].to_numpy(dtype=bool)
+    timestamps = resample.nanoseconds(data['timestamp'])
+
+    current_timestamps = resample.nanoseconds(current['timestamp'])
+    indices = detect_change_points(power, detection['threshold'], detection['min_peak_distance'], breaks)
+    # Events belong to the partition holding the first sample after the step
+    own = np.zeros(len(indices), dtype=bool)
+    if len(current):
+        own = timestamps[indices] >= current_timestamps.min()
+    if len(after):
+        own &= timestamps[indices] < resample.nanoseconds(after['timestamp']).min()
+    indices = indices[own]
+    features = extract_event_features(power, indices, detection.get('window_size'), breaks)
+
+    return {
+        'timestamps': timestamps[indices],
+        'features': features,
+        'n_samples': len(current),
+        'start': int(current_timestamps.min()) if len(current) else None,
+        'end': int(current_timestamps.max()) if len(current) else None,
+    }
+
+def _partition_results(files, config, workers):
+    """Yield the result of each partition, in order."""
+    if workers and workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(partial(partition_events, files, config=config), range(len(files)))
+    else:
+        for i in range(len(files)):
+            yield partition_events(files, i, config)
+
+def _batches(paths, batch_size):
+    """Yield feature matrices of ``batch_size`` rows from the spilled files."""
+    pending = []
+    size = 0
+    for path in paths:
+        features = np.load(path)
+        while len(features):
+            take = features[:batch_size - size]
+            features = features[len(take):]
+            pending.append(take)
+            size += len(take)
+            if size == batch_size:
+                yield np.concatenate(pending)
+                pending, size = [], 0
+    if size:
+        yield np.concatenate(pending)
+
+def train(data_dir, config, workers=None, batch_size=BATCH_SIZE, passes=PASSES, feature_dir=FEATURE_DIR):
+    """
+    Train an :class:`EventClusterModel` over all partitions of a data directory.
+
+    Args:
+        data_dir (str): Directory containing power_data_*.csv files
+        config (dict): Configuration dictionary
+        workers (int): Worker processes detecting events, None to detect in
+            this process
+        batch_size (int): Events per clustering batch
+        passes (int): Passes of the clustering over the events
+        feature_dir (str): Directory for the spilled features
+
+    Returns:
+        dict: model, scaler, profiles, data_range and metrics for
+            :func:`model_store.save_model`
+    """
+    files = partition_files(data_dir)
+    n_appliances = int(config['nilm_model']['n_appliances'])
+    os.makedirs(feature_dir, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix='train_', dir=feature_dir)
+    try:
+        # Detect events and fit the scaler one partition at a time
+        scaler = StandardScaler()
+        spilled = []
+        n_samples = n_events = 0
+        start = end = None
+        for i, result in enumerate(_partition_results(files, config, workers)):
+            n_samples += result['n_samples']
+            if result['start'] is not None:
+                start = result['start'] if start is None else min(start, result['start'])
+                end = result['end'] if end is None else max(end, result['end'])
+            features = result['features']
+            if len(features):
+                scaler.partial_fit(features)
+                path = os.path.join(spill_dir, f"{i:06d}.npy")
+                np.save(path, features)
+                spilled.append(path)
+                n_events += len(features)
+            logger.info(f"Partition {i + 1}/{len(files)}: {result['n_samples']} samples, "
+                        f"{len(features)} events")
+
+        if n_events < n_appliances:
+            raise ChunkedTrainingError(f"Only {n_events} events detected, need at least {n_appliances}")
+
+        # Cluster in batches, each at least as large as the number of clusters
+        batch_size = max(int(batch_size), n_appliances)
+        kmeans = MiniBatchKMeans(n_clusters=n_appliances, batch_size=batch_size, random_state=0)
+        for _ in range(max(int(passes), 1)):
+            for batch in _batches(spilled, batch_size):
+                kmeans.partial_fit(scaler.transform(batch))
+
+        # Assign events to appliances and accumulate their profiles
+        columns = [FEATURE_COLUMNS.index('magnitude'), FEATURE_COLUMNS.index('power_after')]
+        counts = np.zeros(n_appliances)
+        sums = np.zeros((n_appliances, 2))
+        squares = np.zeros((n_appliances, 2))
+        for batch in _batches(spilled, batch_size):
+            labels = kmeans.predict(scaler.transform(batch))
+            values = batch[:, columns]
+            counts += np.bincount(labels, minlength=n_appliances)
+            for j in range(2):
+                sums[:, j] += np.bincount(labels, weights=values[:, j], minlength=n_appliances)
+                squares[:, j] += np.bincount(labels, weights=values[:, j] ** 2, minlength=n_appliances)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    profiles = {}
+    for appliance in np.flatnonzero(counts):
+        count = counts[appliance]
+        mean = sums[appliance] / count
+        std = np.sqrt(np.maximum(squares[appliance] / count - mean ** 2, 0.0))
+        profiles[str(appliance)] = {
+            'count': int(count),
+            'magnitude_mean': float(mean[0]),
+            'magnitude_std': float(std[0]),
+            'power_after_mean': float(mean[1]),
+            'power_after_std': float(std[1]),
+        }
+
+    return {
+        'model': EventClusterModel(scaler, kmeans, config['event_detection'].get('window_size')),
+        'scaler': scaler,
+        'profiles': profiles,
+        'data_range': {
+            'start': pd.Timestamp(start, tz='UTC').isoformat() if start is not None else None,
+            'end': pd.Timestamp(end, tz='UTC').isoformat() if end is not None else None,
+            'n_samples': int(n_samples),
+            'n_partitions': len(files),
+        },
+        'metrics': {
+            'n_events': int(n_events),
+            'events_per_appliance': {name: profile['count'] for name, profile in profiles.items()},
+            'inertia': float(kmeans.inertia_) if hasattr(kmeans, 'inertia_') else None,
+        },
+    }
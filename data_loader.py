@@ -0,0 +1,292 @@
+"""
+Loading of collected power data files.
+
+All entry points read ``power_data_*.csv`` through this module. Files are
+parsed in parallel with explicit column types, and parsed files are cached
+on disk keyed by their modification time and size, so repeated runs only
+parse files that changed since the last run. Recently used files are also
+kept in memory, least recently used first out once ``MEMORY_CACHE_BYTES``
+is exceeded.
+"""
+
+import io
+import os
+import glob
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "data/cache/parsed"
+POWER_PATTERN = "power_data_*.csv"
+ACTIVE_PATTERN = "collecting_*.json"
+POWER_COLUMNS = {'timestamp', 'power', 'watts', 'power_change', 'gap'}
+POWER_DTYPES = {'power': 'float64', 'watts': 'float64', 'power_change': 'float64'}
+
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+MEMORY_CACHE_BYTES = 256 * 1024 * 1024
+
+# In-process LRU cache: path -> ((mtime_ns, size), DataFrame, bytes), oldest first
+_memory_cache = OrderedDict()
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+
+class DataLoadError(Exception):
+    """Raised when power data cannot be loaded."""
+    pass
+
+def parse_timestamps(values):
+    """
+    Parse ISO 8601 timestamps to UTC.
+
+    Args:
+        values (pd.Series): Timestamp strings as written by the collector
+
+    Returns:
+        pd.Series: Timezone-aware (UTC) timestamps
+    """
+    try:
+        return pd.to_datetime(values, format='ISO8601', utc=True)
+    except (TypeError, ValueError):
+        # pandas < 2.0 has no ISO8601 format shortcut
+        return pd.to_datetime(values, utc=True)
+
+def _tail_lines(path, n, block_size=65536):
+    """Last ``n`` lines of a text file, read backwards from its end."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= n:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode().splitlines()
+    if position == 0:
+        lines = lines[1:]  # The header
+    return lines[-n:] if n else []
+
+def read_power_file(path, head=None, tail=None):
+    """
+    Parse one power data file, or only its first or last rows.
+
+    Legacy files with a ``watts`` column are returned with a ``power`` column.
+
+    Args:
+        path (str): CSV file path
+        head (int): Read only this many rows from the start
+        tail (int): Read only this many rows from the end, without reading
+            the rest of the file
+
+    Returns:
+        pd.DataFrame: timestamp, power and (if present) power_change and gap columns
+    """
+    # Read the header first, the pyarrow engine only accepts column lists
+    with open(path, 'r') as f:
+        header_line = f.readline()
+    header = header_line.strip().split(',')
+    columns = [c for c in header if c in POWER_COLUMNS]
+    source, engine = path, CSV_ENGINE
+    if tail is not None:
+        source = io.StringIO(header_line + ''.join(f"{line}\n" for line in _tail_lines(path, tail)))
+    if head is not None or tail is not None:
+        engine = 'c'  # pyarrow reads whole files only
+    df = pd.read_csv(
+        source,
+        usecols=columns,
+        dtype={c: POWER_DTYPES[c] for c in columns if c in POWER_DTYPES},
+        engine=engine,
+        nrows=head,
+    )
+    if 'watts' in df.columns and 'power' not in df.columns:
+        df.rename(columns={'watts': 'power'}, inplace=True)
+    if 'timestamp' not in df.columns or 'power' not in df.columns:
+        raise DataLoadError(f"{path} has no timestamp and power columns")
+    df['timestamp'] = parse_timestamps(df['timestamp'])
+    return df[[c for c in ('timestamp', 'power', 'power_change', 'gap') if c in df.columns]]
+
+def _cache_name(path):
+    """Cache file prefix, unique per directory so site shards do not collide."""
+    directory = hashlib.sha1(os.path.abspath(os.path.dirname(path)).encode()).hexdigest()[:8]
+    return f"{directory}_{os.path.basename(path)}"
+
+def _cache_path(path, key, cache_dir):
+    """Location of the parsed copy of a file for a given version key."""
+    return os.path.join(cache_dir, f"{_cache_name(path)}.{key[0]}.{key[1]}.pkl")
+
+def load_file_cached(path, cache_dir=CACHE_DIR):
+    """
+    Parse a file, reusing a cached parse while the file is unchanged.
+
+    Args:
+        path (str): CSV file path
+        cache_dir (str): Directory for parsed copies, None to disable
+
+    Returns:
+        pd.DataFrame: Parsed file contents
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _memory_lock:
+        cached = _memory_cache.get(path)
+        if cached is not None and cached[0] == key:
+            _memory_cache.move_to_end(path)
+    if cached is not None and cached[0] == key:
+        CACHE_REQUESTS.labels('parsed_files', 'hit').inc()
+        return cached[1]
+
+    df = None
+    cached_path = _cache_path(path, key, cache_dir) if cache_dir else None
+    if cached_path and os.path.exists(cached_path):
+        try:
+            df = pd.read_pickle(cached_path)
+            CACHE_REQUESTS.labels('parsed_files', 'disk_hit').inc()
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache file {cached_path}: {e}")
+
+    if df is None:
+        CACHE_REQUESTS.labels('parsed_files', 'miss').inc()
+        df = read_power_file(path)
+        if cached_path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Drop parsed copies of older versions of this file
+                for stale in glob.glob(os.path.join(cache_dir, f"{glob.escape(_cache_name(path))}.*.pkl")):
+                    os.remove(stale)
+                df.to_pickle(f"{cached_path}.tmp", compression=None)
+                os.replace(f"{cached_path}.tmp", cached_path)
+            except OSError as e:
+                logger.warning(f"Could not cache {path}: {e}")
+
+    _remember(path, key, df)
+    return df
+
+def _remember(path, key, df):
+    """Keep a parsed file in memory, evicting the least recently used ones over the budget."""
+    global _memory_bytes
+    nbytes = int(df.memory_usage(index=True).sum())
+    with _memory_lock:
+        previous = _memory_cache.pop(path, None)
+        if previous is not None:
+            _memory_bytes -= previous[2]
+        if nbytes > MEMORY_CACHE_BYTES:
+            return
+        _memory_cache[path] = (key, df, nbytes)
+        _memory_bytes += nbytes
+        while _memory_bytes > MEMORY_CACHE_BYTES:
+            _, (_, _, evicted) = _memory_cache.popitem(last=False)
+            _memory_bytes -= evicted
+
+def clear_cache():
+    """Drop all parsed files kept in memory."""
+    global _memory_bytes
+    with _memory_lock:
+        _memory_cache.clear()
+        _memory_bytes = 0
+
+def load_power_data(data_dir="data/raw", max_workers=None, cache_dir=CACHE_DIR, modified_after=None):
+    """
+    Load and combine all power data files.
+
+    Args:
+        data_dir (str): Directory containing power_data_*.csv files
+        max_workers (int): Threads used to parse files
+        cache_dir (str): Directory for parsed copies, None to disable
+        modified_after (int): Skip files last modified before this time
+            (ns since the epoch); they cannot hold newer samples
+
+    Returns:
+        pd.DataFrame: timestamp, power and power_change columns sorted by time
+    """
+    files = sorted(glob.glob(os.path.join(data_dir, POWER_PATTERN)))
+    if not files:
+        raise DataLoadError(f"No power data files found in {data_dir}")
+    if modified_after is not None:
+        files = [path for path in files if os.stat(path).st_mtime_ns >= modified_after]
+        if not files:
+            return pd.DataFrame({'timestamp': pd.to_datetime([], utc=True), 'power': pd.Series(dtype=float)})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        dfs = list(pool.map(lambda path: load_file_cached(path, cache_dir), files))
+
+    data = pd.concat(dfs, ignore_index=True)
+    data = data.sort_values('timestamp', kind='stable', ignore_index=True)
+
+    logger.info(f"Loaded {len(data)} data points from {len(files)} files")
+    if not data.empty:
+        logger.info(f"Time range: {data['timestamp'].iloc[0]} to {data['timestamp'].iloc[-1]}")
+        logger.info(f"Power range: {data['power'].min():.2f}W to {data['power'].max():.2f}W")
+    return data
+
+def load_power_series(data_dir="data/raw", **kwargs):
+    """
+    Load all power data as a Series of watts indexed by timestamp.
+
+    Args:
+        data_dir (str): Directory containing power_data_*.csv files
+        **kwargs: Passed on to :func:`load_power_data`
+
+    Returns:
+        pd.Series: Power readings named 'watts'
+    """
+    data = load_power_data(data_dir, **kwargs)
+    return pd.Series(data['power'].to_numpy(), index=pd.DatetimeIndex(data['timestamp']), name='watts')
+
+def mark_active(data_dir, suffix, ttl):
+    """
+    Record that a collector is still rewriting the files of a run.
+
+    Args:
+        data_dir (str): Directory of the run's files
+        suffix (str): Timestamp suffix of the run
+        ttl (float): Seconds after which the mark lapses unless renewed
+    """
+    path = os.path.join(data_dir, f"collecting_{suffix}.json")
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({'suffix': suffix, 'expires': time.time() + ttl}, f)
+    os.replace(f"{path}.tmp", path)
+
+def clear_active(data_dir, suffix):
+    """Remove the mark of a run once its collector stopped."""
+    try:
+        os.remove(os.path.join(data_dir, f"collecting_{suffix}.json"))
+    except FileNotFoundError:
+        pass
+
+def active_runs(data_dir="data/raw"):
+    """
+    Suffixes of the runs whose files a collector is still rewriting.
+
+    Marks left behind by a collector that died lapse after their ttl.
+
+    Args:
+        data_dir (str): Directory containing the data files
+
+    Returns:
+        set: Run suffixes
+    """
+    runs = set()
+    now = time.time()
+    for path in glob.glob(os.path.join(data_dir, ACTIVE_PATTERN)):
+        try:
+            with open(path, 'r') as f:
+                mark = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if mark.get('expires', 0) > now:
+            runs.add(mark.get('suffix'))
+    return runs
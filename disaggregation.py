@@ -0,0 +1,596 @@
+"""
+Per-appliance power and energy reconstruction from classified events.
+
+Each classified event is a step change in the power drawn by one appliance.
+The power of an appliance is the running sum of its step changes, and its
+energy over any interval is the integral of that step function. Event
+detection misses some steps, so the running sum is re-anchored rather than
+carried over the whole history:
+
+- it never drops below zero, an unmatched 'off' event starts from zero;
+- each collector run is reconstructed on its own, every appliance is off at
+  the start and end of a run (a run starts after a gap in the data);
+- an appliance without an event for ``MAX_ON_SECONDS`` is taken to be off,
+  as with unpaired 'on' events in :mod:`pairing`.
+
+Because runs are independent, each run has its own step series and hourly
+and daily rollups under ``rollups/runs/<run>``. Every file is split into
+monthly partitions (``power/2024-01.csv``, ``energy_hour/2024-01.csv``...).
+The collector updates the partitions of its run that changed on the writer
+thread at every save and recombines only those months with the other runs
+into the partitions the dashboard reads, so a save costs the same whatever
+the length of the history and queries never touch the raw events.
+:func:`build_rollups` rebuilds every run but the active ones, e.g. after
+labelling.
+"""
+
+import os
+import glob
+import shutil
+import tempfile
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from metrics import CACHE_REQUESTS
+from data_loader import parse_timestamps, active_runs
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_DIR = "data/processed/rollups"
+RUNS_DIR = "runs"
+RESOLUTIONS = {'hour': 'h', 'day': 'D'}
+HOURS = {'hour': 1, 'day': 24}
+UNLABELED_NAMES = {'unlabeled', 'unknown', ''}
+MAX_ON_SECONDS = 86400
+EVENTS_PATTERN = "device_events_*.csv"
+ROLLUP_COLUMNS = ['period_start', 'appliance', 'energy_kwh', 'mean_power']
+POWER_COLUMNS = ['timestamp', 'appliance', 'power']
+# Combined and per-run files, partitioned by month of their time column
+TIME_COLUMNS = {'power': 'timestamp', 'energy_hour': 'period_start', 'energy_day': 'period_start'}
+PARTITION_FORMAT = '%Y-%m'
+
+# Partition cache: path -> (mtime, DataFrame)
+_rollup_cache = {}
+_rollup_lock = threading.Lock()
+
+# Rollup directories with a rebuild in progress
+_builds = set()
+_builds_lock = threading.Lock()
+
+class DisaggregationError(Exception):
+    """Raised when appliance energy cannot be reconstructed."""
+    pass
+
+def classified_events(df):
+    """
+    Events of a frame that have a labelled or predicted appliance.
+
+    A manual label takes precedence over the live model prediction.
+
+    Args:
+        df (pd.DataFrame): Events as recorded by the collector
+
+    Returns:
+        pd.DataFrame: Columns timestamp (UTC), appliance and power_change, sorted by time
+    """
+    if df.empty or 'device_name' not in df.columns:
+        return pd.DataFrame(columns=['timestamp', 'appliance', 'power_change'])
+    appliance = df['device_name'].where(
+        ~df['device_name'].fillna('').astype(str).str.lower().isin(UNLABELED_NAMES)
+    )
+    if 'predicted_appliance' in df.columns:
+        appliance = appliance.fillna(df['predicted_appliance'])
+    events = pd.DataFrame({
+        'timestamp': parse_timestamps(df['timestamp']),
+        'appliance': appliance,
+        'power_change': df['power_change'].astype(float),
+    }).dropna(subset=['appliance'])
+    events['appliance'] = events['appliance'].astype(str)
+    return events.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+def load_classified_events(data_dir="data/raw"):
+    """
+    Load the classified events of all runs.
+
+    Args:
+        data_dir (str): Directory containing device_events_*.csv files
+
+    Returns:
+        pd.DataFrame: Columns timestamp, appliance and power_change, sorted by time
+    """
+    frames = []
+    for file in glob.glob(os.path.join(data_dir, EVENTS_PATTERN)):
+        try:
+            frames.append(classified_events(pd.read_csv(file)))
+        except Exception as e:
+            logger.warning(f"Error reading {file}: {e}")
+    if not frames:
+        return pd.DataFrame(columns=['timestamp', 'appliance', 'power_change'])
+    events = pd.concat(frames, ignore_index=True)
+    return events.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+def run_name(path):
+    """Run suffix of a collector file such as device_events_<run>.csv."""
+    return os.path.splitext(os.path.basename(path))[0].split('_', 2)[-1]
+
+def _floored_sum(changes):
+    """Running sum of step changes re-anchored at zero whenever it would go negative."""
+    total = np.cumsum(changes)
+    return total - np.minimum(np.minimum.accumulate(total), 0.0)
+
+def appliance_power(events, end=None, max_on=MAX_ON_SECONDS):
+    """
+    Power step function of each appliance over one collector run.
+
+    Args:
+        events (pd.DataFrame): Classified events of one run
+        end (pd.Timestamp): End of the run, when every appliance is off
+            (defaults to the last event)
+        max_on (float): Seconds after an appliance's last event when it is
+            taken to be off
+
+    Returns:
+        pd.DataFrame: Columns timestamp, appliance and power; each row holds
+            until the next row of the same appliance, and the last row of an
+            appliance is zero
+    """
+    if events.empty:
+        return pd.DataFrame(columns=POWER_COLUMNS)
+    max_on_ns = int(max_on * 1e9)
+    end_ns = pd.Timestamp(end).value if end is not None else None
+
+    frames = []
+    for appliance, group in events.groupby('appliance', sort=True):
+        times = group['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        changes = group['power_change'].to_numpy(dtype=float)
+        last = max(end_ns, times[-1]) if end_ns is not None else times[-1]
+
+        # Idle periods longer than max_on split the run; each part starts from zero
+        idle = np.flatnonzero(np.diff(times) > max_on_ns) + 1
+        levels = np.concatenate([_floored_sum(part) for part in np.split(changes, idle)])
+
+        # Each level holds until the next event, max_on or the end of the run
+        hold = np.minimum(np.append(times[1:], last), times + max_on_ns)
+        knot_times = np.column_stack([times, hold]).ravel()
+        knot_levels = np.column_stack([levels, np.zeros(len(levels))]).ravel()
+        # Drop the zero between two steps that follow each other directly
+        keep = np.ones(len(knot_times), dtype=bool)
+        keep[1:-1:2] = hold[:-1] < times[1:]
+        frames.append(pd.DataFrame({
+            'timestamp': pd.to_datetime(knot_times[keep], utc=True),
+            'appliance': appliance,
+            'power': knot_levels[keep],
+        }))
+    return pd.concat(frames, ignore_index=True)[POWER_COLUMNS]
+
+def appliance_energy(power, boundaries):
+    """
+    Integrate the power of each appliance over consecutive intervals.
+
+    Args:
+        power (pd.DataFrame): Step functions from :func:`appliance_power`
+        boundaries (pd.DatetimeIndex): Interval boundaries, sorted
+
+    Returns:
+        pd.DataFrame: Energy in kWh per interval (rows, labelled by interval
+            start) and appliance (columns)
+    """
+    boundaries = pd.DatetimeIndex(boundaries)
+    if len(boundaries) < 2:
+        raise DisaggregationError("At least two interval boundaries are required")
+    bounds_s = boundaries.to_numpy(dtype='datetime64[ns]').view(np.int64) / 1e9
+
+    result = {}
+    for appliance, group in power.groupby('appliance', sort=True):
+        knots = group['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64) / 1e9
+        levels = group['power'].to_numpy(dtype=float)
+        # Cumulative energy (Ws) is piecewise linear, so interpolation is exact
+        cumulative = np.concatenate(([0.0], np.cumsum(levels[:-1] * np.diff(knots))))
+        at_bounds = np.interp(np.clip(bounds_s, knots[0], knots[-1]), knots, cumulative)
+        result[appliance] = np.diff(at_bounds) / 3.6e6
+
+    return pd.DataFrame(result, index=boundaries[:-1])
+
+def energy_rollup(power, resolution):
+    """
+    Energy and mean power per appliance and period.
+
+    Args:
+        power (pd.DataFrame): Step functions from :func:`appliance_power`
+        resolution (str): 'hour' or 'day'
+
+    Returns:
+        pd.DataFrame: period_start, appliance, energy_kwh and mean_power rows
+            with non-zero energy
+    """
+    if power.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    freq = RESOLUTIONS[resolution]
+    start = power['timestamp'].min().floor(freq)
+    end = power['timestamp'].max().floor(freq) + pd.tseries.frequencies.to_offset(freq)
+    boundaries = pd.date_range(start, end, freq=freq)
+    energy = appliance_energy(power, boundaries)
+    rollup = (energy.rename_axis('period_start')
+              .reset_index()
+              .melt(id_vars='period_start', var_name='appliance', value_name='energy_kwh'))
+    rollup = rollup[rollup['energy_kwh'] > 0]
+    rollup['mean_power'] = np.round(rollup['energy_kwh'] * 1000 / HOURS[resolution], 3)
+    return rollup[ROLLUP_COLUMNS].reset_index(drop=True)
+
+def _write_csv(df, path):
+    """Write a CSV atomically, under a temporary name no other writer uses."""
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp",
+                                    dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            df.to_csv(f, index=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _partitions(df, kind):
+    """Rows of a file grouped by month, month -> DataFrame."""
+    if df.empty:
+        return {}
+    months = pd.DatetimeIndex(df[TIME_COLUMNS[kind]]).strftime(PARTITION_FORMAT)
+    return {month: rows.reset_index(drop=True) for month, rows in df.groupby(np.asarray(months), sort=True)}
+
+def _months(directory):
+    """Months of the partition files in a directory."""
+    if not os.path.isdir(directory):
+        return set()
+    return {name[:-4] for name in os.listdir(directory) if name.endswith('.csv')}
+
+def save_run(rollup_dir, run, events, end=None, previous=None):
+    """
+    Write the monthly partitions of one run's step functions and rollups.
+
+    Only the partitions that differ from ``previous`` are written, so a run
+    that grows by a few events rewrites its current month only.
+
+    Args:
+        rollup_dir (str): Directory for the rollup files
+        run (str): Run suffix of the collector files
+        events (pd.DataFrame): Classified events of the run
+        end (pd.Timestamp): End of the run
+        previous (dict): Partitions written by the last call for this run,
+            updated in place; None to compare against the files on disk
+
+    Returns:
+        set: (kind, month) of every partition written or removed
+    """
+    power = appliance_power(events, end)
+    files = {'power': power}
+    for resolution in RESOLUTIONS:
+        files[f"energy_{resolution}"] = energy_rollup(power, resolution)
+
+    changed = set()
+    for kind, df in files.items():
+        kind_dir = os.path.join(rollup_dir, RUNS_DIR, run, kind)
+        os.makedirs(kind_dir, exist_ok=True)
+        old = previous.get(kind, {}) if previous is not None else {}
+        new = _partitions(df, kind)
+        for month, rows in new.items():
+            if month in old and old[month].equals(rows):
+                continue
+            _write_csv(rows, os.path.join(kind_dir, f"{month}.csv"))
+            changed.add((kind, month))
+        gone = (set(old) if previous is not None else _months(kind_dir)) - set(new)
+        for month in gone:
+            path = os.path.join(kind_dir, f"{month}.csv")
+            if os.path.exists(path):
+                os.remove(path)
+            changed.add((kind, month))
+        if previous is not None:
+            previous[kind] = new
+    return changed
+
+def _read_part(path, parts, **kwargs):
+    """Read a run's file, reusing the copy in ``parts`` while it is unchanged."""
+    mtime = os.path.getmtime(path)
+    cached = parts.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, pd.read_csv(path, **kwargs))
+        parts[path] = cached
+    return cached[1]
+
+def combine_partition(rollup_dir, kind, month, parts=None):
+    """
+    Recombine one month of a combined file from the partitions of every run.
+
+    Args:
+        rollup_dir (str): Directory for the rollup files
+        kind (str): 'power', 'energy_hour' or 'energy_day'
+        month (str): Partition month, YYYY-MM
+        parts (dict): Cache of run partitions kept between calls
+    """
+    parts = {} if parts is None else parts
+    frames = []
+    for path in sorted(glob.glob(os.path.join(rollup_dir, RUNS_DIR, '*', kind, f"{month}.csv"))):
+        try:
+            frame = _read_part(path, parts, dtype={'appliance': str})
+        except OSError:
+            # Removed by a rebuild since it was listed
+            parts.pop(path, None)
+            continue
+        if not frame.empty:
+            frames.append(frame)
+
+    kind_dir = os.path.join(rollup_dir, kind)
+    os.makedirs(kind_dir, exist_ok=True)
+    path = os.path.join(kind_dir, f"{month}.csv")
+    if not frames:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    combined = pd.concat(frames, ignore_index=True)
+    if kind == 'power':
+        combined = combined.sort_values('timestamp', kind='stable')[POWER_COLUMNS]
+    else:
+        combined = combined.groupby(['period_start', 'appliance'], as_index=False)['energy_kwh'].sum()
+        combined['mean_power'] = np.round(combined['energy_kwh'] * 1000 / HOURS[kind[len('energy_'):]], 3)
+        combined = combined[ROLLUP_COLUMNS]
+    _write_csv(combined, path)
+
+def rollups_built(rollup_dir=ROLLUP_DIR):
+    """True once the combined files have been built for a rollup directory."""
+    return all(os.path.isdir(os.path.join(rollup_dir, kind)) for kind in TIME_COLUMNS)
+
+class RollupUpdater:
+    """
+    Keeps the rollups of a running collector up to date.
+
+    Each update writes the partitions of the run that changed and
+    recombines those months only, so its cost does not grow with the
+    history.
+
+    Args:
+        rollup_dir (str): Directory for the rollup files
+        run (str): Run suffix of the collector's files
+    """
+
+    def __init__(self, rollup_dir, run):
+        self.rollup_dir = rollup_dir
+        self.run = run
+        self._previous = {}  # This run's partitions as last written
+        self._parts = {}  # Partitions of the other runs, read once while unchanged
+
+    def update(self, device_events, end=None):
+        """
+        Rebuild this run's changed partitions and recombine their months.
+
+        Args:
+            device_events (list): Event records of the run
+            end: Timestamp of the run's last sample
+        """
+        events = classified_events(pd.DataFrame(device_events))
+        for kind, month in sorted(save_run(self.rollup_dir, self.run, events, end, self._previous)):
+            combine_partition(self.rollup_dir, kind, month, self._parts)
+
+def _run_end(data_dir, run):
+    """Timestamp of the last sample of a run, read from the end of its power file."""
+    path = os.path.join(data_dir, f"power_data_{run}.csv")
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 4096, 0))
+            last = f.read().decode(errors='ignore').strip().splitlines()[-1]
+        return pd.Timestamp(last.split(',')[0])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def build_rollups(data_dir="data/raw", rollup_dir=ROLLUP_DIR):
+    """
+    Rebuild the files of every run and combine them.
+
+    Runs with an active collector are left to its :class:`RollupUpdater`.
+
+    Args:
+        data_dir (str): Directory containing device_events_*.csv files
+        rollup_dir (str): Directory for the rollup files
+
+    Returns:
+        dict: Directory of the rollup partitions per resolution
+    """
+    files = glob.glob(os.path.join(data_dir, EVENTS_PATTERN))
+    active = active_runs(data_dir)
+    runs = set(active)
+    n_events = 0
+    for file in files:
+        run = run_name(file)
+        if run in active:
+            continue
+        try:
+            events = classified_events(pd.read_csv(file))
+        except Exception as e:
+            logger.warning(f"Error reading {file}: {e}")
+            continue
+        save_run(rollup_dir, run, events, _run_end(data_dir, run))
+        runs.add(run)
+        n_events += len(events)
+
+    # Runs whose events file is gone
+    for run_dir in glob.glob(os.path.join(rollup_dir, RUNS_DIR, '*')):
+        if os.path.basename(run_dir) not in runs:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    for kind in TIME_COLUMNS:
+        months = _months(os.path.join(rollup_dir, kind))
+        for run_dir in glob.glob(os.path.join(rollup_dir, RUNS_DIR, '*')):
+            months |= _months(os.path.join(run_dir, kind))
+        os.makedirs(os.path.join(rollup_dir, kind), exist_ok=True)
+        for month in sorted(months):
+            combine_partition(rollup_dir, kind, month)
+
+    logger.info(f"Energy rollups built from {n_events} classified events in {len(runs)} runs")
+    return {resolution: os.path.join(rollup_dir, f"energy_{resolution}") for resolution in RESOLUTIONS}
+
+def start_build(data_dir="data/raw", rollup_dir=ROLLUP_DIR):
+    """
+    Rebuild the rollups on a background thread unless a rebuild is running.
+
+    Returns:
+        bool: True if a rebuild was started
+    """
+    key = os.path.abspath(rollup_dir)
+    with _builds_lock:
+        if key in _builds:
+            return False
+        _builds.add(key)
+
+    def run():
+        try:
+            build_rollups(data_dir, rollup_dir)
+        except Exception as e:
+            logger.error(f"Error building energy rollups: {e}")
+        finally:
+            with _builds_lock:
+                _builds.discard(key)
+
+    threading.Thread(target=run, name="rollup-build", daemon=True).start()
+    return True
+
+def _load_cached(path, **kwargs):
+    """Read a partition, reusing the cached copy while it is unchanged."""
+    mtime = os.path.getmtime(path)
+    with _rollup_lock:
+        cached = _rollup_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            CACHE_REQUESTS.labels('rollups', 'hit').inc()
+            return cached[1]
+    CACHE_REQUESTS.labels('rollups', 'miss').inc()
+
+    df = pd.read_csv(path, **kwargs)
+    with _rollup_lock:
+        _rollup_cache[path] = (mtime, df)
+    return df
+
+def _load_combined(rollup_dir, kind, columns, **kwargs):
+    """All partitions of a combined file, None if it was never built."""
+    kind_dir = os.path.join(rollup_dir, kind)
+    if not os.path.isdir(kind_dir):
+        return None
+    frames = []
+    for month in sorted(_months(kind_dir)):
+        try:
+            frames.append(_load_cached(os.path.join(kind_dir, f"{month}.csv"), **kwargs))
+        except OSError:
+            continue
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+def load_rollup(resolution, rollup_dir=ROLLUP_DIR):
+    """
+    Load a rollup, reusing the cached copy of each unchanged partition.
+
+    Args:
+        resolution (str): 'hour' or 'day'
+        rollup_dir (str): Directory for the rollup files
+
+    Returns:
+        pd.DataFrame: Rollup rows
+    """
+    if resolution not in RESOLUTIONS:
+        raise DisaggregationError(f"Unknown resolution '{resolution}', use one of {list(RESOLUTIONS)}")
+    rollup = _load_combined(rollup_dir, f"energy_{resolution}", ROLLUP_COLUMNS, parse_dates=['period_start'],
+                            dtype={'appliance': str, 'energy_kwh': float, 'mean_power': float})
+    if rollup is None:
+        raise DisaggregationError(f"No {resolution} rollup found, run disaggregation first")
+    return rollup
+
+def load_power(rollup_dir=ROLLUP_DIR):
+    """
+    Load the step functions of all runs.
+
+    Args:
+        rollup_dir (str): Directory for the rollup files
+
+    Returns:
+        pd.DataFrame: Columns timestamp, appliance and power
+    """
+    power = _load_combined(rollup_dir, 'power', POWER_COLUMNS, parse_dates=['timestamp'],
+                           dtype={'appliance': str, 'power': float})
+    if power is None:
+        raise DisaggregationError("No appliance power found, run disaggregation first")
+    return power
+
+def _range_bound(value, column):
+    """Convert a range bound to a timestamp comparable with a column."""
+    bound = pd.Timestamp(value)
+    tz = getattr(getattr(column, 'dt', None), 'tz', None)
+    if tz is not None and bound.tzinfo is None:
+        return bound.tz_localize(tz)
+    if tz is None and bound.tzinfo is not None:
+        return bound.tz_convert(None)
+    return bound
+
+def query_energy(start=None, end=None, resolution='hour', rollup_dir=ROLLUP_DIR):
+    """
+    Get per-appliance energy over a time range from the rollups.
+
+    Args:
+        start (str): Range start (inclusive), any format pandas accepts
+        end (str): Range end (exclusive)
+        resolution (str): 'hour' or 'day'
+        rollup_dir (str): Directory for the rollup files
+
+    Returns:
+        tuple: (series DataFrame of the selected rollup rows, dict of kWh totals per appliance)
+    """
+    rollup = load_rollup(resolution, rollup_dir)
+    mask = np.ones(len(rollup), dtype=bool)
+    if start is not None:
+        mask &= (rollup['period_start'] >= _range_bound(start, rollup['period_start'])).to_numpy()
+    if end is not None:
+        mask &= (rollup['period_start'] < _range_bound(end, rollup['period_start'])).to_numpy()
+    selected = rollup[mask]
+    totals = selected.groupby('appliance')['energy_kwh'].sum().round(4).to_dict()
+    return selected, totals
+
+def query_power(start=None, end=None, appliance=None, rollup_dir=ROLLUP_DIR):
+    """
+    Get the power step functions of the appliances over a time range.
+
+    Args:
+        start (str): Range start (inclusive), any format pandas accepts
+        end (str): Range end (exclusive)
+        appliance (str): Only this appliance
+        rollup_dir (str): Directory for the rollup files
+
+    Returns:
+        pd.DataFrame: Columns timestamp, appliance and power, sorted by time;
+            the power of each appliance at ``start`` is included as a row
+    """
+    power = load_power(rollup_dir)
+    if appliance is not None:
+        power = power[power['appliance'] == str(appliance)]
+    mask = np.ones(len(power), dtype=bool)
+    initial = power.iloc[:0]
+    if start is not None:
+        bound = _range_bound(start, power['timestamp'])
+        mask &= (power['timestamp'] >= bound).to_numpy()
+        # Level in effect at the start of the range
+        initial = power[~mask].groupby('appliance', sort=False).tail(1)
+        initial = initial[initial['power'] > 0].assign(timestamp=bound)
+    if end is not None:
+        mask &= (power['timestamp'] < _range_bound(end, power['timestamp'])).to_numpy()
+    selected = pd.concat([initial, power[mask]], ignore_index=True)
+    return selected.sort_values('timestamp', kind='stable').reset_index(drop=True)[POWER_COLUMNS]
+
+def main():
+    """Rebuild the energy rollups from the collected events."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    paths = build_rollups()
+    for resolution, path in paths.items():
+        logger.info(f"{resolution} rollup saved to {path}")
+
+if __name__ == "__main__":
+    main()
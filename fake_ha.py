@@ -0,0 +1,345 @@
+"""
+Local stand-in for a Home Assistant instance, driven by a synthetic trace.
+
+Serves the REST endpoints the collector uses (``/api/states``,
+``/api/states/<entity_id>``, ``/api/history/period``) and the
+``state_changed`` subscription of the WebSocket API. Time runs ``speed``
+times faster than the wall clock, so days of data can be replayed in
+minutes. Response latency and error rate are configurable.
+
+Example:
+    python fake_ha.py --days 2 --speed 600 --port 8123
+"""
+
+import json
+import time
+import base64
+import socket
+import struct
+import random
+import hashlib
+import argparse
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+import numpy as np
+import pandas as pd
+from synthetic import generate_household
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENTITY_ID = "sensor.power_current_power"
+DEFAULT_TOKEN = "fake-token"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Unrelated entities, so entity listing has something to filter
+OTHER_STATES = [
+    {'entity_id': 'light.kitchen', 'state': 'off', 'attributes': {'friendly_name': 'Kitchen'}},
+    {'entity_id': 'sensor.outdoor_temperature', 'state': '12.5',
+     'attributes': {'friendly_name': 'Outdoor Temperature', 'unit_of_measurement': '°C'}},
+]
+
+class FakeHomeAssistant:
+    """
+    Replays a power trace as a Home Assistant sensor.
+
+    The trace starts when :meth:`start` is called. Every served sample is
+    recorded with the wall time it was first served, which gives the delay
+    between a state change and its observation by a client.
+    """
+
+    def __init__(self, data, entity_id=DEFAULT_ENTITY_ID, token=DEFAULT_TOKEN, speed=1.0,
+                 latency=0.0, latency_jitter=0.0, error_rate=0.0, update_rate=10.0,
+                 host='127.0.0.1', port=0):
+        """
+        Args:
+            data (pd.DataFrame): Trace with timestamp and power columns
+            entity_id (str): Entity ID of the power sensor
+            token (str): Accepted bearer token
+            speed (float): Simulated seconds per wall-clock second
+            latency (float): Mean added response latency in seconds
+            latency_jitter (float): Standard deviation of the latency
+            error_rate (float): Fraction of REST requests answered with HTTP 500
+            update_rate (float): Maximum WebSocket state events per second
+            host (str): Listen address
+            port (int): Listen port (0 picks a free port)
+        """
+        self.entity_id = entity_id
+        self.token = token
+        self.speed = speed
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.update_rate = update_rate
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(data['timestamp'], utc=True))
+        self.timestamps_ns = timestamps.asi8
+        self.power = data['power'].to_numpy(dtype=float)
+        # A state only changes when the displayed value changes
+        self.changes = np.flatnonzero(np.r_[True, np.round(np.diff(self.power), 1) != 0])
+        self.change_times_ns = self.timestamps_ns[self.changes]
+        self.first_served = np.full(len(self.power), np.nan)
+
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._started = None
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-ha', daemon=True)
+
+    @property
+    def url(self):
+        """Base URL of the server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def finished(self):
+        """Whether the whole trace has been replayed."""
+        return self.current_index() >= len(self.power) - 1
+
+    def start(self):
+        """Start serving and replaying the trace."""
+        self._started = time.monotonic()
+        self._thread.start()
+        logger.info(f"Fake Home Assistant serving {self.entity_id} at {self.url} ({self.speed}x)")
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def current_index(self):
+        """Index of the latest state change at the current simulated time."""
+        elapsed_ns = (time.monotonic() - self._started) * self.speed * 1e9
+        now_ns = self.timestamps_ns[0] + elapsed_ns
+        position = np.searchsorted(self.change_times_ns, now_ns, side='right') - 1
+        return int(self.changes[max(position, 0)])
+
+    def became_current(self, index):
+        """Wall time (monotonic) at which a sample became the current state."""
+        return self._started + (self.timestamps_ns[index] - self.timestamps_ns[0]) / 1e9 / self.speed
+
+    def state(self, index=None, record=True):
+        """Home Assistant state object of a sample."""
+        index = self.current_index() if index is None else index
+        if record:
+            with self._lock:
+                if np.isnan(self.first_served[index]):
+                    self.first_served[index] = time.monotonic()
+        timestamp = pd.Timestamp(self.timestamps_ns[index], tz='UTC').isoformat()
+        return {
+            'entity_id': self.entity_id,
+            'state': f"{self.power[index]:.1f}",
+            'attributes': {
+                'friendly_name': 'Current Power',
+                'unit_of_measurement': 'W',
+                'device_class': 'power',
+                'state_class': 'measurement',
+            },
+            'last_changed': timestamp,
+            'last_updated': timestamp,
+        }
+
+    def observation_delays(self):
+        """
+        Delay between each state change and the first time it was served.
+
+        Returns:
+            np.ndarray: Delays in seconds of the state changes that were served
+        """
+        served = self.changes[~np.isnan(self.first_served[self.changes])]
+        return self.first_served[served] - np.array([self.became_current(i) for i in served])
+
+    def history(self, start=None, end=None):
+        """States of the sensor between two timestamps."""
+        start_ns = _utc_ns(start) if start else self.timestamps_ns[0]
+        end_ns = _utc_ns(end) if end else self.timestamps_ns[self.current_index()]
+        lo = np.searchsorted(self.change_times_ns, start_ns, side='left')
+        hi = np.searchsorted(self.change_times_ns, end_ns, side='right')
+        return [self.state(i, record=False) for i in self.changes[lo:hi]]
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send_json(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                path = urlparse(self.path)
+                if path.path == '/api/websocket':
+                    return fake._websocket(self)
+
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency or fake.latency_jitter:
+                    time.sleep(max(random.gauss(fake.latency, fake.latency_jitter), 0))
+                if self.headers.get('Authorization') != f"Bearer {fake.token}":
+                    return self._send_json(401, {'message': 'Unauthorized'})
+                if random.random() < fake.error_rate:
+                    with fake._lock:
+                        fake.errors += 1
+                    return self._send_json(500, {'message': 'Simulated error'})
+
+                if path.path == '/api/states':
+                    return self._send_json(200, [fake.state()] + OTHER_STATES)
+                if path.path == f'/api/states/{fake.entity_id}':
+                    return self._send_json(200, fake.state())
+                if path.path.startswith('/api/states/'):
+                    return self._send_json(404, {'message': 'Entity not found.'})
+                if path.path.startswith('/api/history/period'):
+                    query = parse_qs(path.query)
+                    start = unquote(path.path[len('/api/history/period/'):]) or None
+                    end = query.get('end_time', [None])[0]
+                    entities = query.get('filter_entity_id', [fake.entity_id])[0].split(',')
+                    states = fake.history(start, end) if fake.entity_id in entities else []
+                    return self._send_json(200, [states] if states else [])
+                return self._send_json(404, {'message': 'Not found'})
+
+        return Handler
+
+    def _websocket(self, handler):
+        """Serve the state_changed subscription of the WebSocket API."""
+        key = handler.headers.get('Sec-WebSocket-Key')
+        if not key:
+            handler.send_error(400, 'Expected WebSocket upgrade')
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        handler.send_response(101, 'Switching Protocols')
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        handler.close_connection = True
+        conn = handler.connection
+
+        try:
+            _ws_send(conn, {'type': 'auth_required', 'ha_version': 'fake'})
+            message = _ws_receive(conn)
+            if message.get('type') != 'auth' or message.get('access_token') != self.token:
+                _ws_send(conn, {'type': 'auth_invalid', 'message': 'Invalid access token'})
+                return
+            _ws_send(conn, {'type': 'auth_ok', 'ha_version': 'fake'})
+
+            message = _ws_receive(conn)
+            subscription = message.get('id')
+            _ws_send(conn, {'id': subscription, 'type': 'result', 'success': True, 'result': None})
+
+            last_index = self.current_index()
+            min_gap = 1.0 / self.update_rate if self.update_rate else 0
+            while not self.finished:
+                time.sleep(min_gap or 0.01)
+                index = self.current_index()
+                if index == last_index:
+                    continue
+                old_state = self.state(last_index, record=False)
+                _ws_send(conn, {
+                    'id': subscription,
+                    'type': 'event',
+                    'event': {
+                        'event_type': 'state_changed',
+                        'data': {
+                            'entity_id': self.entity_id,
+                            'old_state': old_state,
+                            'new_state': self.state(index),
+                        },
+                        'time_fired': pd.Timestamp(self.timestamps_ns[index], tz='UTC').isoformat(),
+                    },
+                })
+                last_index = index
+        except (ConnectionError, socket.timeout, OSError):
+            pass
+
+def _utc_ns(value):
+    """Nanoseconds since the epoch of a timestamp, naive ones taken as UTC."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value
+
+def _ws_send(conn, message):
+    """Send a JSON message as an unmasked WebSocket text frame."""
+    payload = json.dumps(message).encode()
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x81, len(payload))
+    elif len(payload) < 2 ** 16:
+        header = struct.pack('!BBH', 0x81, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, len(payload))
+    conn.sendall(header + payload)
+
+def _recv_exact(conn, n):
+    data = b''
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("WebSocket closed")
+        data += chunk
+    return data
+
+def _ws_receive(conn):
+    """Receive one (masked) client text frame as JSON."""
+    first, second = _recv_exact(conn, 2)
+    if first & 0x0F == 0x8:
+        raise ConnectionError("WebSocket closed by client")
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', _recv_exact(conn, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', _recv_exact(conn, 8))[0]
+    mask = _recv_exact(conn, 4) if second & 0x80 else b'\x00\x00\x00\x00'
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(_recv_exact(conn, length)))
+    return json.loads(payload.decode())
+
+def main():
+    """Run a fake Home Assistant instance until interrupted."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Serve a synthetic trace as a Home Assistant sensor.")
+    parser.add_argument('--days', type=float, default=1.0)
+    parser.add_argument('--speed', type=float, default=60.0, help="Simulated seconds per second")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean response latency in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--update-rate', type=float, default=10.0, help="WebSocket events per second")
+    parser.add_argument('--entity-id', default=DEFAULT_ENTITY_ID)
+    parser.add_argument('--token', default=DEFAULT_TOKEN)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data, _ = generate_household(days=args.days, seed=args.seed)
+    fake = FakeHomeAssistant(
+        data, entity_id=args.entity_id, token=args.token, speed=args.speed,
+        latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+        update_rate=args.update_rate, host=args.host, port=args.port
+    ).start()
+    logger.info(f"Use HA_URL={fake.url} HA_TOKEN={args.token} HA_ENTITY_ID={args.entity_id}")
+    try:
+        while not fake.finished:
+            time.sleep(1)
+        logger.info("Trace finished")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+if __name__ == "__main__":
+    main()
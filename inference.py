@@ -0,0 +1,275 @@
+"""
+Live classification of detected power events with the latest trained model.
+"""
+
+import math
+import time
+import queue
+import logging
+import threading
+from collections import deque
+import pandas as pd
+from model_store import load_model, latest_version, ModelStoreError
+from resample import StreamResampler
+
+logger = logging.getLogger(__name__)
+
+# Smallest standard deviation used when scoring against an appliance profile
+MIN_PROFILE_STD = 5.0
+
+class InferenceError(Exception):
+    """Raised when events cannot be classified."""
+    pass
+
+def events_to_frame(events):
+    """
+    Convert collector event records to the event format used by the model.
+
+    Args:
+        events (list): Event dictionaries as recorded by the collector
+
+    Returns:
+        pd.DataFrame: Events with timestamp, type, magnitude, power_before
+            and power_after columns
+    """
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime([e['timestamp'] for e in events]),
+        'type': [e['change_type'] for e in events],
+        'magnitude': [e['power_change'] for e in events],
+        'power_before': [e['power_before'] for e in events],
+        'power_after': [e['power_after'] for e in events],
+    })
+
+def profile_confidence(appliance, magnitude, profiles):
+    """
+    Estimate how well an event matches the profile of its predicted appliance.
+
+    Args:
+        appliance: Predicted appliance
+        magnitude (float): Power change of the event
+        profiles (dict): Appliance profiles stored with the model
+
+    Returns:
+        float: Confidence between 0 and 1, or None without a profile
+    """
+    profile = profiles.get(str(appliance))
+    if not profile or 'magnitude_mean' not in profile:
+        return None
+    std = max(profile.get('magnitude_std') or 0.0, MIN_PROFILE_STD)
+    z = (magnitude - profile['magnitude_mean']) / std
+    return math.exp(-0.5 * z * z)
+
+def classify_events(artifact, power_data, events):
+    """
+    Classify a batch of events.
+
+    Args:
+        artifact (dict): Model artifact from :func:`model_store.load_model`
+        power_data (pd.Series): Recent power readings indexed by timestamp
+        events (pd.DataFrame): Events to classify
+
+    Returns:
+        pd.DataFrame: Columns 'appliance' and 'confidence', aligned with events
+    """
+    try:
+        predictions = artifact['model'].predict(power_data, events)
+    except Exception as e:
+        raise InferenceError(f"Error classifying events: {e}")
+
+    predictions = predictions.reset_index(drop=True)
+    if len(predictions) != len(events):
+        raise InferenceError(
+            f"Model returned {len(predictions)} predictions for {len(events)} events"
+        )
+
+    if 'confidence' in predictions:
+        confidence = predictions['confidence'].astype(float)
+    else:
+        profiles = artifact.get('profiles', {})
+        confidence = pd.Series([
+            profile_confidence(appliance, magnitude, profiles)
+            for appliance, magnitude in zip(predictions['appliance'], events['magnitude'])
+        ], dtype=float)
+
+    return pd.DataFrame({
+        'appliance': predictions['appliance'].astype(str),
+        'confidence': confidence.round(3),
+    })
+
+class LiveClassifier:
+    """
+    Classifies collector events on a background thread.
+
+    Events are queued by the polling loop and classified in batches, either
+    when a flush is requested, when ``batch_size`` events are pending, or at
+    the latest ``max_delay`` seconds after the first pending event arrived.
+    Predictions are written into the event dictionaries in place, so they are
+    persisted with the next save of the device events file.
+
+    The context of an event only holds samples collected since the last gap,
+    aligned to the grid used for training when a resampling step is set.
+    """
+
+    def __init__(self, model_dir, window_size=30, batch_size=32, max_delay=2.0, max_pending=1000,
+                 resampling=None):
+        """
+        Args:
+            model_dir (str): Directory with saved model versions
+            window_size (int): Samples of context kept around events
+            batch_size (int): Maximum events per classification batch
+            max_delay (float): Maximum seconds an event waits for classification
+            max_pending (int): Events queued before new ones are left unclassified
+            resampling (dict): The ``resampling`` configuration section
+        """
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.version = None
+        self.dropped = 0
+        self.out_of_order = 0
+        self._last_time = None
+        self._samples = deque(maxlen=max(4 * (window_size or 1), 100))
+        self._segment = 0  # Incremented at every gap
+        settings = resampling or {}
+        self._resampler = None
+        if settings.get('step'):
+            # Gaps come from the collector's markers, not from timestamp spacing
+            self._resampler = StreamResampler(settings['step'], settings.get('fill', 'ffill'), max_gap=None)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._flush = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='live-classifier', daemon=True)
+
+    def start(self):
+        """Start the classification thread."""
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Classify pending events and stop the classification thread."""
+        self._stop.set()
+        self._flush.set()
+        self._thread.join(timeout)
+
+    def add_sample(self, timestamp, power, gap=False):
+        """
+        Record a power reading as context for later events.
+
+        A reading older than the previous one is skipped: Home Assistant can
+        report an earlier ``last_updated`` after a restore, and the context
+        must stay in time order.
+
+        Args:
+            timestamp (datetime): Time of the reading
+            power (float): Power reading
+            gap (bool): True if the reading follows a gap in collection
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if self._last_time is not None and timestamp < self._last_time:
+            self.out_of_order += 1
+            logger.debug(f"Skipping context sample at {timestamp}, older than {self._last_time}")
+            return
+        self._last_time = timestamp
+        if self._resampler is None:
+            self._append(timestamp, power, gap)
+            return
+        for point, value, point_gap in self._resampler.add(timestamp.value, power, gap):
+            self._append(pd.Timestamp(point, tz='UTC'), value, point_gap)
+
+    def _append(self, timestamp, power, gap):
+        """Keep a sample, starting a new segment after a gap."""
+        if gap:
+            self._segment += 1
+        if not math.isnan(power):
+            self._samples.append((timestamp, power, self._segment))
+
+    def submit(self, event):
+        """
+        Queue an event for classification without blocking.
+
+        Args:
+            event (dict): Event record; 'predicted_appliance' and
+                'predicted_confidence' are filled in once classified
+
+        Returns:
+            bool: False if the queue is full and the event was not queued
+        """
+        try:
+            self._queue.put_nowait((time.monotonic(), event, self._segment))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Ask the classification thread to process pending events now."""
+        self._flush.set()
+
+    def _next_batch(self):
+        """Wait for pending events and return the next batch of (event, segment)."""
+        try:
+            queued_at, event, segment = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [(event, segment)]
+        deadline = queued_at + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait()[1:])
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._flush.is_set():
+                break
+            self._flush.wait(min(remaining, 0.1))
+        return batch
+
+    def _run(self):
+        """Classification thread main loop."""
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not self._queue.qsize():
+                self._flush.clear()
+            # Each event only sees the samples of its own gap-free segment
+            for segment in dict.fromkeys(segment for _, segment in batch):
+                self._classify([event for event, s in batch if s == segment], segment)
+
+    def _classify(self, batch, segment):
+        """Classify a batch of events of one segment and store the predictions."""
+        version = latest_version(self.model_dir)
+        if version is None:
+            return
+        try:
+            artifact = load_model(self.model_dir, version)
+        except ModelStoreError as e:
+            logger.warning(f"Cannot load model for live inference: {e}")
+            return
+        if version != self.version:
+            logger.info(f"Live inference using model version {version}")
+            self.version = version
+
+        samples = [(timestamp, power) for timestamp, power, s in list(self._samples) if s == segment]
+        power_data = pd.Series(
+            [power for _, power in samples],
+            index=pd.to_datetime([timestamp for timestamp, _ in samples], utc=True),
+            name='watts',
+        )
+
+        start = time.perf_counter()
+        try:
+            predictions = classify_events(artifact, power_data, events_to_frame(batch))
+        except InferenceError as e:
+            logger.warning(str(e))
+            return
+        elapsed = time.perf_counter() - start
+
+        for event, appliance, confidence in zip(batch, predictions['appliance'], predictions['confidence']):
+            event['predicted_appliance'] = appliance
+            event['predicted_confidence'] = None if pd.isna(confidence) else float(confidence)
+            logger.info(
+                f"Event at {event['timestamp']} classified as {appliance} "
+                f"(confidence {event['predicted_confidence']})"
+            )
+        logger.debug(f"Classified {len(batch)} events in {elapsed * 1000:.1f}ms")
@@ -1,12 +1,30 @@
 """
 Tool for labeling detected power events after data collection.
+
+Labeling runs as a resumable session over groups of similar events. When a
+session starts, the events files are streamed once into a group index
+(``groups.json``) holding per-group counts, power ranges, a few example
+events and the file and row of each event, so no events are kept in memory
+and exporting a group reads only its own rows. Groups are offered largest and least certain first, as in the web
+app's labeling queue.
+
+Every answer is appended to ``journal.jsonl`` and synced before the next
+prompt, and the labeled events of a group are exported to
+``data/processed/labeled_events_<session>.csv`` on a background thread.
+Quitting or crashing loses nothing: running the tool again resumes the
+session where it stopped, and ``--new`` starts over.
 """
 
 import os
+import json
+import argparse
 import pandas as pd
-import numpy as np
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import label_propagation
+from labeling_queue import cluster_keys, TOLERANCE
+from scheduler import BackgroundWriter
 
 # Configure logging
 logging.basicConfig(
@@ -15,115 +33,313 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def find_unlabeled_events(data_dir="data/raw"):
+SESSION_DIR = "data/processed/labeling_session"
+EXAMPLES_PER_GROUP = 3
+EVENT_COLUMNS = ['timestamp', 'power_change', 'change_type', 'power_before', 'power_after',
+                 'device_name', 'predicted_confidence']
+EXPORT_COLUMNS = ['timestamp', 'power_change', 'change_type', 'power_before', 'power_after',
+                  'device_name', 'confidence', 'source_file', 'label_group']
+
+class LabelingError(Exception):
+    """Raised when a labeling session cannot be created or resumed."""
+    pass
+
+def _unlabeled_rows(filepath, columns=None):
+    """Unlabeled events of one events file."""
+    df = pd.read_csv(filepath, usecols=columns)
+    return df[~label_propagation.is_labeled(df['device_name'])]
+
+def _read_rows(filepath, rows):
+    """Events at the given rows of one events file, parsing no other row."""
+    wanted = set(rows)
+    # Line 0 is the header, line i + 1 holds row i
+    return pd.read_csv(filepath, skiprows=lambda line: line > 0 and line - 1 not in wanted)
+
+def build_group_index(data_dir="data/raw", tolerance=TOLERANCE):
     """
-    Find all unlabeled events in the data directory.
+    Stream the events files into per-group summaries.
+
+    Each file is read once and reduced to per-group counts, power ranges,
+    certainty sums, the first example events and the rows of the group's
+    events in each file.
     
     Args:
-        data_dir (str): Directory containing event files
+        data_dir (str): Directory containing device_events_*.csv files
+        tolerance (float): Relative width of a group, see labeling_queue
         
     Returns:
-        pd.DataFrame: Combined DataFrame of all unlabeled events
+        list: Group dicts, highest labeling value first
     """
-    unlabeled_events = []
+    groups = {}
+    files = [name for name, _ in label_propagation.events_signature(data_dir)]
+    for filename in files:
+        try:
+            df = _unlabeled_rows(os.path.join(data_dir, filename), lambda c: c in EVENT_COLUMNS)
+        except Exception as e:
+            logger.warning(f"Error reading {filename}: {e}")
+            continue
+        if df.empty:
+            continue
+        certainty = (pd.to_numeric(df['predicted_confidence'], errors='coerce').fillna(0.0)
+                     if 'predicted_confidence' in df else pd.Series(0.0, index=df.index))
+        df = df.assign(group=cluster_keys(df['power_change'], tolerance), certainty=certainty)
     
-    # Find all device_events files
-    for filename in os.listdir(data_dir):
-        if filename.startswith("device_events_") and filename.endswith(".csv"):
-            filepath = os.path.join(data_dir, filename)
+        for key, rows in df.groupby('group', sort=False):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'group': key,
+                    'change_type': str(rows['change_type'].iat[0]),
+                    'count': 0,
+                    'power_min': float('inf'),
+                    'power_max': float('-inf'),
+                    'certainty_sum': 0.0,
+                    'rows': {},
+                    'examples': [],
+                }
+            group['count'] += len(rows)
+            group['power_min'] = min(group['power_min'], float(rows['power_change'].min()))
+            group['power_max'] = max(group['power_max'], float(rows['power_change'].max()))
+            group['certainty_sum'] += float(rows['certainty'].sum())
+            group['rows'][filename] = rows.index.tolist()
+            missing = EXAMPLES_PER_GROUP - len(group['examples'])
+            if missing > 0:
+                examples = rows[['timestamp', 'change_type', 'power_change', 'power_before', 'power_after']]
+                group['examples'].extend(examples.head(missing).to_dict('records'))
+
+    for group in groups.values():
+        group['score'] = group['count'] - group.pop('certainty_sum')
+    return sorted(groups.values(), key=lambda g: (g['score'], g['count']), reverse=True)
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, default=str)
+    os.replace(tmp_path, path)
+
+class LabelingSession:
+    """
+    Resumable labeling session over the group index of a data directory.
+
+    Args:
+        session_dir (str): Directory holding the group index and journal
+        data_dir (str): Directory containing device_events_*.csv files
+        output_dir (str): Directory of the labeled_events_*.csv export
+        tolerance (float): Relative width of a group
+        new (bool): Discard an existing session and index the events again
+    """
+
+    def __init__(self, session_dir=SESSION_DIR, data_dir="data/raw", output_dir="data/processed",
+                 tolerance=TOLERANCE, new=False):
+        self.session_dir = session_dir
+        self.index_path = os.path.join(session_dir, "groups.json")
+        self.journal_path = os.path.join(session_dir, "journal.jsonl")
+        os.makedirs(session_dir, exist_ok=True)
+
+        if new or not os.path.exists(self.index_path):
+            for path in (self.index_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info(f"Indexing unlabeled events in {data_dir}")
+            session = {
+                'session': datetime.now().strftime('%Y%m%d_%H%M%S'),
+                'data_dir': data_dir,
+                'tolerance': tolerance,
+                'groups': build_group_index(data_dir, tolerance),
+            }
+            _write_json_atomic(self.index_path, session)
+        else:
             try:
-                df = pd.read_csv(filepath)
-                # Filter for unlabeled events
-                unlabeled = df[df['device_name'] == 'unlabeled'].copy()
-                if not unlabeled.empty:
-                    unlabeled['source_file'] = filename
-                    unlabeled_events.append(unlabeled)
-                    logger.info(f"Found {len(unlabeled)} unlabeled events in {filename}")
+                with open(self.index_path, 'r') as f:
+                    session = json.load(f)
+            except (OSError, ValueError) as e:
+                raise LabelingError(f"Cannot resume session in {session_dir}: {e}, use --new")
+            logger.info(f"Resuming labeling session {session['session']}")
+
+        self.id = session['session']
+        self.data_dir = session['data_dir']
+        self.tolerance = session['tolerance']
+        self.groups = session['groups']
+        if any('rows' not in g for g in self.groups):
+            raise LabelingError(f"Session in {session_dir} has no event rows, use --new")
+        self.export_path = os.path.join(output_dir, f"labeled_events_{self.id}.csv")
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.answers = self._read_journal()
+        self._journal = open(self.journal_path, 'a')
+        self._writer = BackgroundWriter(max_pending=16).start()
+
+        # Labels answered but not exported when the last run stopped
+        exported = self._exported_groups()
+        by_key = {g['group']: g for g in self.groups}
+        for key, answer in self.answers.items():
+            if answer.get('device_name') and key not in exported and key in by_key:
+                self._writer.submit(self._export, by_key[key], answer['device_name'], answer['confidence'])
+
+    def _read_journal(self):
+        answers = {}
+        if not os.path.exists(self.journal_path):
+            return answers
+        with open(self.journal_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash can leave a partial last line
+                    continue
+                answers[entry['group']] = entry
+        return answers
+
+    def _exported_groups(self):
+        if not os.path.exists(self.export_path):
+            return set()
+        try:
+            return set(pd.read_csv(self.export_path, usecols=['label_group'])['label_group'])
+        except (ValueError, OSError) as e:
+            logger.warning(f"Error reading {self.export_path}: {e}")
+            return set()
+
+    def pending(self):
+        """Yield the groups without an answer, highest labeling value first."""
+        for group in self.groups:
+            if group['group'] not in self.answers:
+                yield group
+
+    def progress(self):
+        """Tuple of (answered groups, total groups, labeled events)."""
+        by_key = {g['group']: g['count'] for g in self.groups}
+        labeled = sum(by_key.get(k, 0) for k, a in self.answers.items() if a.get('device_name'))
+        return len(self.answers), len(self.groups), labeled
+
+    def _record(self, entry):
+        entry['time'] = datetime.now().isoformat()
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.answers[entry['group']] = entry
+
+    def label(self, group, device_name, confidence):
+        """Persist a label for a group and export its events in the background."""
+        self._record({'group': group['group'], 'device_name': device_name, 'confidence': confidence})
+        self._writer.submit(self._export, group, device_name, confidence)
+
+    def skip(self, group):
+        """Persist that a group was skipped."""
+        self._record({'group': group['group'], 'device_name': None, 'confidence': None})
+
+    def _export(self, group, device_name, confidence):
+        """Append the events of a labeled group to the export file."""
+        rows = []
+        for filename, indices in group['rows'].items():
+            filepath = os.path.join(self.data_dir, filename)
+            try:
+                df = _read_rows(filepath, indices)
             except Exception as e:
                 logger.warning(f"Error reading {filename}: {e}")
+                continue
+            rows.append(df.assign(source_file=filename))
+        if not rows:
+            return
+        events = pd.concat(rows, ignore_index=True).assign(
+            device_name=device_name, confidence=confidence, label_group=group['group'])
+        events = events.reindex(columns=EXPORT_COLUMNS)
+        header = not os.path.exists(self.export_path)
+        events.to_csv(self.export_path, mode='a', header=header, index=False)
     
-    if not unlabeled_events:
-        logger.info("No unlabeled events found")
-        return pd.DataFrame()
-    
-    # Combine all unlabeled events
-    combined = pd.concat(unlabeled_events, ignore_index=True)
-    combined = combined.sort_values('timestamp')
+    def close(self):
+        """Finish pending exports and close the journal."""
+        self._writer.stop()
+        self._journal.close()
+        if self._writer.failures:
+            logger.error(f"{self._writer.failures} label exports failed, run again to retry them")
     
-    logger.info(f"Total unlabeled events: {len(combined)}")
-    return combined
-
-def display_event_summary(events):
+def display_event_summary(session, top=10):
     """
-    Display a summary of events for labeling.
+    Display a summary of the session for labeling.
     
     Args:
-        events (pd.DataFrame): DataFrame of events to label
+        session (LabelingSession): Labeling session
+        top (int): Number of groups listed
     """
-    if events.empty:
+    answered, total, labeled = session.progress()
+    remaining = sum(g['count'] for g in session.pending())
+    if remaining == 0:
         print("No events to label")
         return
     
     print(f"\n=== UNLABELED EVENTS SUMMARY ===")
-    print(f"Total events: {len(events)}")
-    print(f"Date range: {events['timestamp'].min()} to {events['timestamp'].max()}")
+    print(f"Groups: {total} ({answered} answered), unlabeled events left: {remaining}")
+    if labeled:
+        print(f"Events labeled in this session: {labeled}")
     
-    # Group by power change magnitude
-    print(f"\nPower change distribution:")
-    print(events['power_change'].describe())
+    print(f"\nLargest groups still to label:")
+    for group, _ in zip(session.pending(), range(top)):
+        print(f"  {group['power_min']:8.1f}W to {group['power_max']:8.1f}W: {group['count']:6d} events")
     
-    # Show unique power changes
-    unique_changes = events['power_change'].value_counts().sort_index()
-    print(f"\nUnique power changes:")
-    for change, count in unique_changes.items():
-        print(f"  {change:8.1f}W: {count:3d} events")
-
-def label_events_interactive(events):
+def label_events_interactive(session, index_future=None):
     """
-    Interactive labeling of events.
+    Interactive labeling of the pending groups of a session.
+    
+    Each group is offered the label proposed by its nearest labeled
+    neighbours, and every label entered is added to the index so later
+    groups benefit from it. The index over previously labeled events loads
+    in the background; until it is ready only labels from this run are used.
     
     Args:
-        events (pd.DataFrame): DataFrame of events to label
+        session (LabelingSession): Labeling session
+        index_future (concurrent.futures.Future): Future of a
+            label_propagation.LabelIndex over already labeled events
         
     Returns:
-        pd.DataFrame: Events with labels added
+        int: Number of groups labeled
     """
-    if events.empty:
-        return events
-    
-    labeled_events = events.copy()
-    
-    # Group events by similar power changes for easier labeling
-    unique_changes = events['power_change'].value_counts().sort_index()
+    index = label_propagation.LabelIndex()
+    new_labels = []
+    labeled_groups = 0
     
     print(f"\n=== INTERACTIVE LABELING ===")
-    print("You can label events by power change magnitude.")
-    print("Enter 'skip' to skip a group, 'quit' to exit early.")
+    print("Events are grouped by similar power change, most useful groups first.")
+    print("Enter 'skip' to skip a group, 'quit' to stop; progress is saved after every answer.")
     
-    device_mapping = {}  # Store mappings for reuse
+    for group in session.pending():
+        if index_future is not None and index_future.done():
+            try:
+                index = index_future.result()
+                for vectors, name in new_labels:
+                    index.add(vectors, [name] * len(vectors))
+            except Exception as e:
+                logger.warning(f"Label suggestions from earlier labels unavailable: {e}")
+            index_future = None
     
-    for power_change, count in unique_changes.items():
-        if count == 0:
-            continue
+        power_range = (f"{group['power_min']:.1f}W" if group['power_min'] == group['power_max']
+                       else f"{group['power_min']:.1f} to {group['power_max']:.1f}W")
+        print(f"\n--- Power Change: {power_range} ({group['count']} events) ---")
             
-        print(f"\n--- Power Change: {power_change:8.1f}W ({count} events) ---")
-        
-        # Show some examples
-        examples = events[events['power_change'] == power_change].head(3)
+        # Examples were collected when the session was indexed
         print("Example events:")
-        for _, event in examples.iterrows():
+        for event in group['examples']:
             timestamp = pd.to_datetime(event['timestamp']).strftime('%H:%M:%S')
             print(f"  {timestamp} - {event['change_type']} - {event['power_before']:.1f}W → {event['power_after']:.1f}W")
         
+        # Suggest a label from similar labeled events
+        vectors = label_propagation.event_vectors(pd.DataFrame(group['examples']))
+        proposed, proposal_confidence, _ = index.propose(vectors[:1])
+        suggestion = proposed[0]
+        if suggestion is not None:
+            print(f"Suggested: {suggestion} (similarity {proposal_confidence[0]:.2f}), press Enter to accept")
+        
         # Get user input
         while True:
-            device_name = input(f"\nWhat device causes {power_change:8.1f}W change? (or 'skip', 'quit'): ").strip()
+            device_name = input(f"\nWhat device causes this change? (or 'skip', 'quit'): ").strip()
+            if not device_name and suggestion is not None:
+                device_name = suggestion
             
             if device_name.lower() == 'quit':
-                print("Labeling stopped by user")
-                return labeled_events
+                print("Labeling stopped by user, run again to continue")
+                return labeled_groups
             elif device_name.lower() == 'skip':
-                print(f"Skipped {count} events with {power_change:.1f}W change")
+                session.skip(group)
+                print(f"Skipped {group['count']} events")
                 break
             elif device_name:
                 # Get confidence
@@ -138,75 +354,63 @@ def label_events_interactive(events):
                     except ValueError:
                         print("Please enter a valid number")
                 
-                # Update all events with this power change
-                mask = labeled_events['power_change'] == power_change
-                labeled_events.loc[mask, 'device_name'] = device_name
-                labeled_events.loc[mask, 'confidence'] = confidence
+                session.label(group, device_name, confidence)
+                index.add(vectors, [device_name] * len(vectors))
+                new_labels.append((vectors, device_name))
+                labeled_groups += 1
                 
-                print(f"Labeled {count} events as '{device_name}' with confidence {confidence}")
+                print(f"Labeled {group['count']} events as '{device_name}' with confidence {confidence}")
                 break
             else:
                 print("Please enter a device name or 'skip'/'quit'")
     
-    return labeled_events
-
-def save_labeled_events(labeled_events, output_dir="data/processed"):
-    """
-    Save labeled events to processed directory.
-    
-    Args:
-        labeled_events (pd.DataFrame): Labeled events
-        output_dir (str): Output directory
-    """
-    os.makedirs(output_dir, exist_ok=True)
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_file = os.path.join(output_dir, f"labeled_events_{timestamp}.csv")
-    
-    labeled_events.to_csv(output_file, index=False)
-    logger.info(f"Saved {len(labeled_events)} labeled events to {output_file}")
-    
-    # Show summary
-    if not labeled_events.empty:
-        print(f"\n=== LABELING SUMMARY ===")
-        summary = labeled_events.groupby('device_name').agg({
-            'power_change': ['count', 'mean', 'std'],
-            'confidence': 'mean'
-        }).round(2)
-        print(summary)
+    return labeled_groups
 
 def main():
     """Main function for labeling events."""
+    parser = argparse.ArgumentParser(description="Label detected power events.")
+    parser.add_argument('--data-dir', default="data/raw", help="Directory containing the events files")
+    parser.add_argument('--new', action='store_true', help="Discard the current session and start over")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="Relative power change width of a group")
+    args = parser.parse_args()
+
+    session = None
     try:
-        # Find unlabeled events
-        unlabeled_events = find_unlabeled_events()
-        
-        if unlabeled_events.empty:
+        session = LabelingSession(data_dir=args.data_dir, tolerance=args.tolerance, new=args.new)
+        if not session.groups:
             print("No unlabeled events found. Run data collection first.")
             return
         
         # Display summary
-        display_event_summary(unlabeled_events)
+        display_event_summary(session)
+        if next(session.pending(), None) is None:
+            print("All groups of this session are answered, use --new to index new events.")
+            return
         
         # Ask if user wants to proceed
-        proceed = input(f"\nDo you want to label these {len(unlabeled_events)} events? (y/n): ").strip().lower()
+        proceed = input(f"\nDo you want to label these events? (y/n): ").strip().lower()
         if proceed != 'y':
             print("Labeling cancelled")
             return
         
-        # Label events
-        labeled_events = label_events_interactive(unlabeled_events)
-        
-        # Save results
-        if not labeled_events.empty:
-            save_labeled_events(labeled_events)
+        # Suggestions use the labels already in the data files once loaded
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            index_future = executor.submit(label_propagation.get_index, session.data_dir)
+            label_events_interactive(session, index_future)
         
+        answered, total, labeled = session.progress()
+        print(f"\n=== LABELING SUMMARY ===")
+        print(f"{answered} of {total} groups answered, {labeled} events labeled")
+        print(f"Labels are saved to {session.export_path}")
         print("\nLabeling completed!")
         
     except Exception as e:
         logger.error(f"Error in labeling: {e}")
         raise
+    finally:
+        if session is not None:
+            session.close()
 
 if __name__ == "__main__":
     main()
-
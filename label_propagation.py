@@ -0,0 +1,535 @@
+"""
+Label propagation from labelled events to their nearest unlabelled neighbours.
+
+A manual label in ``label_events.py`` or ``POST /api/events/label`` only
+applies to events with exactly the chosen ``power_change``. Events of the same
+appliance rarely repeat to the watt, so this module keeps a nearest-neighbour
+index (scikit-learn KD-tree) over the labelled events and proposes a label for
+each unlabelled event from its neighbours, weighted by distance.
+
+Event vectors are the signed logarithm of ``power_change``, ``power_before``
+and ``power_after``, so a distance of 0.1 is roughly a 10% difference at any
+power level. New labels are added to the index incrementally: they go to a
+small side tree until enough accumulate to rebuild the main one.
+
+Events are cached per data directory by :class:`EventStore`, which re-reads
+only the files that changed. The index follows the labelled rows of those
+files: rows that gained a label are added to it, and it is only rebuilt
+when an existing label changed or a file disappeared, so the collector
+appending unlabelled events never invalidates it.
+"""
+
+import os
+import glob
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+from disaggregation import UNLABELED_NAMES
+from data_loader import active_runs
+
+logger = logging.getLogger(__name__)
+
+EVENT_FEATURES = ['power_change', 'power_before', 'power_after']
+
+# Event cache: data directory -> EventStore
+_stores = {}
+_stores_lock = threading.Lock()
+
+class LabelPropagationError(Exception):
+    """Raised when labels cannot be proposed or applied."""
+    pass
+
+def event_vectors(events):
+    """
+    Feature vectors of events for the neighbour search.
+
+    Args:
+        events (pd.DataFrame): Events with the EVENT_FEATURES columns
+
+    Returns:
+        np.ndarray: Array of shape (n_events, len(EVENT_FEATURES))
+    """
+    missing = [column for column in EVENT_FEATURES if column not in events]
+    if missing:
+        raise LabelPropagationError(f"Events have no {', '.join(missing)} column")
+    values = events[EVENT_FEATURES].to_numpy(dtype=float)
+    values = np.nan_to_num(values)
+    return np.sign(values) * np.log1p(np.abs(values))
+
+def is_labeled(device_names):
+    """Boolean mask of events carrying a manual label."""
+    names = pd.Series(device_names).fillna('').astype(str).str.lower()
+    return ~names.isin(UNLABELED_NAMES).to_numpy()
+
+class LabelIndex:
+    """
+    Nearest-neighbour index over labelled events.
+
+    Args:
+        k (int): Neighbours consulted per proposal
+        max_distance (float): Neighbours further away are ignored
+        bandwidth (float): Distance at which a neighbour's weight drops to 1/e
+        rebuild_fraction (float): Rebuild the tree once the points added since
+            the last build exceed this fraction of the tree size
+        min_rebuild (int): Points added before a rebuild is considered
+    """
+
+    def __init__(self, k=5, max_distance=0.3, bandwidth=0.1, rebuild_fraction=0.1, min_rebuild=256):
+        self.k = k
+        self.max_distance = max_distance
+        self.bandwidth = bandwidth
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self._tree = None
+        self._tree_labels = np.empty(0, dtype=object)
+        self._pending = []
+        self._pending_labels = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tree_labels) + sum(len(p) for p in self._pending)
+
+    @property
+    def labels(self):
+        """Distinct labels in the index."""
+        with self._lock:
+            return sorted(set(self._tree_labels) | {l for ls in self._pending_labels for l in ls})
+
+    def add(self, vectors, labels):
+        """
+        Add labelled events.
+
+        Args:
+            vectors (np.ndarray): Event vectors from :func:`event_vectors`
+            labels (sequence): Label of each event
+        """
+        vectors = np.asarray(vectors, dtype=float).reshape(-1, len(EVENT_FEATURES))
+        labels = np.asarray(labels, dtype=object)
+        if len(vectors) != len(labels):
+            raise LabelPropagationError("Each vector needs exactly one label")
+        if len(vectors) == 0:
+            return
+        with self._lock:
+            self._pending.append(vectors)
+            self._pending_labels.append(labels)
+            pending = sum(len(p) for p in self._pending)
+            if pending >= max(self.min_rebuild, self.rebuild_fraction * len(self._tree_labels)):
+                self._rebuild()
+
+    def rebuild(self):
+        """Merge the points added since the last build into the tree."""
+        with self._lock:
+            if self._pending:
+                self._rebuild()
+
+    def _rebuild(self):
+        """Merge the pending points into a new tree (lock held)."""
+        points = ([np.asarray(self._tree.data)] if self._tree is not None else []) + self._pending
+        self._tree_labels = np.concatenate([self._tree_labels] + self._pending_labels)
+        self._tree = KDTree(np.concatenate(points))
+        self._pending = []
+        self._pending_labels = []
+
+    def _neighbours(self, vectors):
+        """Distances and labels of the k nearest indexed events of each vector."""
+        n = len(vectors)
+        distances = np.full((n, 0), np.inf)
+        labels = np.empty((n, 0), dtype=object)
+        with self._lock:
+            if self._tree is not None:
+                k = min(self.k, len(self._tree_labels))
+                dist, ind = self._tree.query(vectors, k=k)
+                distances = np.hstack([distances, dist])
+                labels = np.hstack([labels, self._tree_labels[ind]])
+            if self._pending:
+                # Points added since the last build are few, a throwaway tree is cheap
+                points = np.concatenate(self._pending)
+                point_labels = np.concatenate(self._pending_labels)
+                dist, ind = KDTree(points).query(vectors, k=min(self.k, len(points)))
+                distances = np.hstack([distances, dist])
+                labels = np.hstack([labels, point_labels[ind]])
+
+        order = np.argsort(distances, axis=1)[:, :self.k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def propose(self, vectors):
+        """
+        Propose a label for each event from its labelled neighbours.
+
+        Each neighbour within ``max_distance`` votes with weight
+        ``exp(-distance / bandwidth)``. The confidence is the winning label's
+        share of the votes times the weight of its closest neighbour, so it is
+        high only for an unambiguous and close match.
+
+        Args:
+            vectors (np.ndarray): Event vectors from :func:`event_vectors`
+
+        Returns:
+            tuple: (labels, confidences, distances to the nearest neighbour
+                with the proposed label); the label is None where no
+                labelled event is within range
+        """
+        vectors = np.asarray(vectors, dtype=float).reshape(-1, len(EVENT_FEATURES))
+        n = len(vectors)
+        proposed = np.full(n, None, dtype=object)
+        confidence = np.zeros(n)
+        nearest = np.full(n, np.inf)
+        if n == 0 or len(self) == 0:
+            return proposed, confidence, nearest
+
+        distances, labels = self._neighbours(vectors)
+        weights = np.where(distances <= self.max_distance, np.exp(-distances / self.bandwidth), 0.0)
+        for i in range(n):
+            votes = {}
+            for label, weight in zip(labels[i], weights[i]):
+                if weight > 0:
+                    votes[label] = votes.get(label, 0.0) + weight
+            if not votes:
+                continue
+            best = max(votes, key=votes.get)
+            closest = distances[i][labels[i] == best].min()
+            proposed[i] = best
+            nearest[i] = closest
+            confidence[i] = votes[best] / sum(votes.values()) * np.exp(-closest / self.bandwidth)
+        return proposed, confidence, nearest
+
+def _events_files(data_dir):
+    return sorted(glob.glob(os.path.join(data_dir, "device_events_*.csv")))
+
+def events_signature(data_dir):
+    """Names and modification times of the events files."""
+    signature = []
+    for file in _events_files(data_dir):
+        try:
+            signature.append((os.path.basename(file), os.path.getmtime(file)))
+        except OSError:
+            continue
+    return tuple(signature)
+
+def _read_events_file(path):
+    """Events of one file with the file and row they came from, None if unreadable."""
+    try:
+        df = pd.read_csv(path)
+    except Exception as e:
+        logger.warning(f"Error reading {path}: {e}")
+        return None
+    df['source_file'] = os.path.basename(path)
+    df['row'] = np.arange(len(df))
+    return df
+
+def _labeled_rows(df):
+    """Row, label and vector of the labelled events of one file."""
+    if df.empty or 'device_name' not in df:
+        return pd.DataFrame(columns=['row', 'label'] + EVENT_FEATURES)
+    labeled = df[is_labeled(df['device_name'])]
+    rows = pd.DataFrame(event_vectors(labeled), columns=EVENT_FEATURES)
+    rows.insert(0, 'label', labeled['device_name'].astype(str).to_numpy())
+    rows.insert(0, 'row', labeled['row'].to_numpy())
+    return rows
+
+def _new_labels(old, new):
+    """
+    Labelled rows of a file that are new since its previous version.
+
+    Returns:
+        pd.DataFrame: The added rows, or None if a label changed or vanished
+            and the index must be rebuilt
+    """
+    merged = old.merge(new, on='row', how='outer', suffixes=('_old', ''), indicator=True)
+    if (merged['_merge'] == 'left_only').any():
+        return None
+    both = merged[merged['_merge'] == 'both']
+    for column in ['label'] + EVENT_FEATURES:
+        if not (both[f"{column}_old"].to_numpy() == both[column].to_numpy()).all():
+            return None
+    return new[new['row'].isin(merged.loc[merged['_merge'] == 'right_only', 'row'])]
+
+class EventStore:
+    """
+    Events of a data directory and the label index over them, kept current
+    by re-reading only changed files.
+
+    Args:
+        data_dir (str): Directory containing device_events_*.csv files
+        **index_kwargs: Passed to :class:`LabelIndex`
+    """
+
+    def __init__(self, data_dir, **index_kwargs):
+        self.data_dir = data_dir
+        self.index_kwargs = index_kwargs
+        self.index = None
+        self.version = 0  # Incremented whenever the index changes
+        self._files = {}  # File name -> ((mtime_ns, size), events, labelled rows)
+        self._events = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Re-read the files that changed and bring the index up to date."""
+        with self._lock:
+            current = {}
+            for path in _events_files(self.data_dir):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                current[os.path.basename(path)] = (path, (stat.st_mtime_ns, stat.st_size))
+
+            rebuild = self.index is None or any(name not in current for name in self._files)
+            added = []
+            for name in [name for name in self._files if name not in current]:
+                del self._files[name]
+                self._events = None
+            for name, (path, key) in current.items():
+                cached = self._files.get(name)
+                if cached is not None and cached[0] == key:
+                    continue
+                df = _read_events_file(path)
+                if df is None:
+                    continue
+                labeled = _labeled_rows(df)
+                if cached is not None and not rebuild:
+                    new = _new_labels(cached[2], labeled)
+                    if new is None:
+                        rebuild = True
+                    elif len(new):
+                        added.append(new)
+                elif cached is None and len(labeled):
+                    added.append(labeled)
+                self._files[name] = (key, df, labeled)
+                self._events = None
+
+            if rebuild:
+                self.index = LabelIndex(**self.index_kwargs)
+                labeled = [entry[2] for entry in self._files.values() if len(entry[2])]
+                if labeled:
+                    labeled = pd.concat(labeled, ignore_index=True)
+                    self.index.add(labeled[EVENT_FEATURES].to_numpy(), labeled['label'].to_numpy(dtype=object))
+                    self.index.rebuild()
+                self.version += 1
+                logger.info(f"Label index built from {len(self.index)} labelled events in {self.data_dir}")
+            elif added:
+                added = pd.concat(added, ignore_index=True)
+                self.index.add(added[EVENT_FEATURES].to_numpy(), added['label'].to_numpy(dtype=object))
+                self.version += 1
+
+    def files(self):
+        """
+        Events of each file after a refresh.
+
+        Returns:
+            tuple: ({file name: ((mtime_ns, size), events)}, index version)
+        """
+        self.refresh()
+        with self._lock:
+            return {name: (entry[0], entry[1]) for name, entry in self._files.items()}, self.version
+
+    def events(self):
+        """All events after a refresh (shared, do not modify)."""
+        self.refresh()
+        with self._lock:
+            if self._events is None:
+                frames = [entry[1] for _, entry in sorted(self._files.items())]
+                if frames:
+                    self._events = pd.concat(frames, ignore_index=True)
+                else:
+                    self._events = pd.DataFrame(
+                        columns=['timestamp', 'device_name'] + EVENT_FEATURES + ['source_file', 'row'])
+            return self._events
+
+def event_store(data_dir="data/raw"):
+    """The cached :class:`EventStore` of a data directory."""
+    key = os.path.abspath(data_dir)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = EventStore(data_dir)
+    return store
+
+def load_events(data_dir="data/raw"):
+    """
+    Load all events with the file and row they came from.
+
+    Only files that changed since the last call are read again.
+
+    Args:
+        data_dir (str): Directory containing device_events_*.csv files
+
+    Returns:
+        pd.DataFrame: Events with added 'source_file' and 'row' columns
+    """
+    return event_store(data_dir).events()
+
+def build_index(events, **kwargs):
+    """
+    Build an index from the labelled rows of an events DataFrame.
+
+    Args:
+        events (pd.DataFrame): Events with 'device_name' and EVENT_FEATURES
+        **kwargs: Passed to :class:`LabelIndex`
+
+    Returns:
+        LabelIndex: Index over the labelled events
+    """
+    index = LabelIndex(**kwargs)
+    if not events.empty:
+        labeled = events[is_labeled(events['device_name'])]
+        if not labeled.empty:
+            index.add(event_vectors(labeled), labeled['device_name'].astype(str).to_numpy())
+            index.rebuild()
+    return index
+
+def get_index(data_dir="data/raw"):
+    """
+    Index over the labelled events of a data directory.
+
+    The index is cached per directory. Labels found in changed files are
+    added to it; it is rebuilt only when a label changed or was removed.
+
+    Args:
+        data_dir (str): Directory containing device_events_*.csv files
+
+    Returns:
+        LabelIndex: Cached index
+    """
+    store = event_store(data_dir)
+    store.refresh()
+    return store.index
+
+def add_labels(data_dir):
+    """
+    Bring the cached index of a data directory up to date after labels
+    were written to its files.
+
+    Args:
+        data_dir (str): Directory the labels were written to
+    """
+    event_store(data_dir).refresh()
+
+def collecting_files(data_dir="data/raw"):
+    """Names of the events files a collector is still rewriting."""
+    return {f"device_events_{suffix}.csv" for suffix in active_runs(data_dir)}
+
+def propose_labels(events, index, min_confidence=0.0):
+    """
+    Propose labels for unlabelled events.
+
+    Args:
+        events (pd.DataFrame): Events with EVENT_FEATURES columns
+        index (LabelIndex): Index over the labelled events
+        min_confidence (float): Proposals below this confidence are dropped
+
+    Returns:
+        pd.DataFrame: The events that received a proposal, with added
+            'proposed_label', 'proposal_confidence' and 'neighbour_distance'
+            columns, most confident first
+    """
+    if events.empty:
+        return events.assign(proposed_label=[], proposal_confidence=[], neighbour_distance=[])
+    labels, confidence, distance = index.propose(event_vectors(events))
+    proposals = events.assign(proposed_label=labels, proposal_confidence=confidence,
+                              neighbour_distance=distance)
+    keep = proposals['proposed_label'].notna() & (proposals['proposal_confidence'] >= min_confidence)
+    return proposals[keep].sort_values('proposal_confidence', ascending=False, kind='stable')
+
+def apply_proposals(proposals, data_dir="data/raw"):
+    """
+    Write proposed labels to the events files.
+
+    Only rows that are still unlabelled are changed. The 1-5 labelling
+    confidence is derived from the proposal confidence. Files of runs a
+    collector is still writing are skipped, as the collector would overwrite
+    the labels at its next save; apply the proposals again once it stopped.
+
+    Args:
+        proposals (pd.DataFrame): Output of :func:`propose_labels` over
+            events from :func:`load_events`
+        data_dir (str): Directory containing device_events_*.csv files
+
+    Returns:
+        int: Number of events labelled
+    """
+    if proposals.empty:
+        return 0
+    for column in ('source_file', 'row', 'proposed_label', 'proposal_confidence'):
+        if column not in proposals:
+            raise LabelPropagationError(f"Proposals have no {column} column")
+
+    active = collecting_files(data_dir)
+    applied = []
+    for source_file, group in proposals.groupby('source_file'):
+        if source_file in active:
+            logger.info(f"Deferring {len(group)} proposed labels in {source_file}, still being collected")
+            continue
+        filepath = os.path.join(data_dir, source_file)
+        try:
+            df = pd.read_csv(filepath)
+        except Exception as e:
+            logger.warning(f"Error reading {filepath}: {e}")
+            continue
+        rows = group['row'].to_numpy(dtype=int)
+        valid = (rows < len(df))
+        rows, group = rows[valid], group[valid]
+        still_unlabeled = ~is_labeled(df['device_name'].to_numpy()[rows])
+        rows, group = rows[still_unlabeled], group[still_unlabeled]
+        if len(rows) == 0:
+            continue
+        df.loc[rows, 'device_name'] = group['proposed_label'].to_numpy()
+        df.loc[rows, 'confidence'] = np.clip(np.ceil(group['proposal_confidence'].to_numpy() * 5), 1, 5)
+        tmp_path = f"{filepath}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, filepath)
+        applied.append(group)
+
+    if not applied:
+        return 0
+    applied = pd.concat(applied)
+    add_labels(data_dir)
+    logger.info(f"Applied {len(applied)} proposed labels in {data_dir}")
+    return len(applied)
+
+def label_power_changes(power_changes, device_name, confidence, data_dir="data/raw"):
+    """
+    Label every unlabelled event with one of the given power changes.
+
+    Files of runs a collector is still writing are skipped like in
+    :func:`apply_proposals`; their matching events are returned as deferred.
+
+    Args:
+        power_changes (list): Power changes to label, e.g. a queue group
+        device_name (str): Label
+        confidence (int): 1-5 labelling confidence
+        data_dir (str): Directory containing device_events_*.csv files
+
+    Returns:
+        tuple: (labelled events, deferred events) DataFrames, with a
+            source_file column
+    """
+    active = collecting_files(data_dir)
+    labeled, deferred = [], []
+    for filepath in _events_files(data_dir):
+        filename = os.path.basename(filepath)
+        try:
+            df = pd.read_csv(filepath)
+        except Exception as e:
+            logger.warning(f"Error reading {filepath}: {e}")
+            continue
+        mask = df['power_change'].isin(power_changes).to_numpy() & ~is_labeled(df['device_name'])
+        if not mask.any():
+            continue
+        if filename in active:
+            logger.info(f"Deferring {mask.sum()} labels in {filename}, still being collected")
+            deferred.append(df[mask].assign(source_file=filename))
+            continue
+        df.loc[mask, 'device_name'] = device_name
+        df.loc[mask, 'confidence'] = confidence
+        tmp_path = f"{filepath}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, filepath)
+        labeled.append(df[mask].assign(source_file=filename))
+
+    columns = ['timestamp'] + EVENT_FEATURES + ['source_file']
+    labeled = pd.concat(labeled, ignore_index=True) if labeled else pd.DataFrame(columns=columns)
+    deferred = pd.concat(deferred, ignore_index=True) if deferred else pd.DataFrame(columns=columns)
+    return labeled, deferred
@@ -0,0 +1,266 @@
+"""
+Ranked labelling queue of unlabelled event groups.
+
+Unlabelled events are grouped into clusters of similar power change (within
+a relative tolerance, separately for 'on' and 'off' events), and each cluster
+is scored by how much a single label would help: the number of events it
+covers times how uncertain the existing outputs are about them. Certainty
+comes from what is already stored, so building the queue never runs a model:
+the live classifier's ``predicted_confidence`` saved with each event and the
+proposal confidence of :mod:`label_propagation`.
+
+The queue is cached per data directory. When events files change, only their
+events are grouped and scored again, and all of them only when the label
+index changed. Every ranking is a snapshot with its own id; the web app
+serves pages of one snapshot, so groups do not shift between pages while
+the collector adds events.
+"""
+
+import os
+import math
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import label_propagation
+
+logger = logging.getLogger(__name__)
+
+TOLERANCE = 0.05
+MAX_SNAPSHOTS = 16
+
+QUEUE_COLUMNS = ['group', 'change_type', 'count', 'power_change', 'power_min', 'power_max',
+                 'power_changes', 'first_timestamp', 'last_timestamp', 'predicted_appliance',
+                 'predicted_confidence', 'proposed_label', 'proposal_confidence',
+                 'uncertainty', 'score']
+
+# Queue cache: (data directory, tolerance) -> (signature, {file: (file key, scored events)}, snapshot id)
+_queues = {}
+# Snapshot id -> ((data directory, tolerance), ranked queue), oldest first
+_snapshots = OrderedDict()
+_queues_lock = threading.Lock()
+
+class LabelingQueueError(Exception):
+    """Raised when a queue snapshot is requested for another queue."""
+    pass
+
+def _queue_key(data_dir, tolerance):
+    return (os.path.abspath(data_dir), float(tolerance))
+
+def cluster_keys(power_change, tolerance=TOLERANCE):
+    """
+    Cluster key of each power change.
+
+    Power changes fall into logarithmic bins ``tolerance`` wide, so a cluster
+    spans about the same relative range at any power level.
+
+    Args:
+        power_change (array-like): Power changes in Watts
+        tolerance (float): Relative width of a cluster
+
+    Returns:
+        np.ndarray: Keys such as 'on:134' or 'off:134'
+    """
+    power_change = np.nan_to_num(np.asarray(power_change, dtype=float))
+    bins = np.round(np.log1p(np.abs(power_change)) / math.log1p(tolerance)).astype(np.int64)
+    direction = np.where(power_change >= 0, 'on', 'off')
+    return np.char.add(np.char.add(direction, ':'), bins.astype(str))
+
+def _mode(values):
+    """Most common non-null value, or None."""
+    values = values.dropna()
+    if values.empty:
+        return None
+    return values.mode().iat[0]
+
+def score_events(events, index=None, tolerance=TOLERANCE):
+    """
+    Group and score the unlabelled events of a frame.
+
+    An event's certainty is the larger of its prediction and label proposal
+    confidences.
+
+    Args:
+        events (pd.DataFrame): Events from :func:`label_propagation.load_events`
+        index (label_propagation.LabelIndex): Index over the labelled events
+        tolerance (float): Relative width of a cluster
+
+    Returns:
+        pd.DataFrame: The unlabelled events with group, predicted_appliance,
+            predicted_confidence, proposed_label, proposal_confidence and
+            certainty columns
+    """
+    if events.empty:
+        return events.iloc[:0]
+    unlabeled = events[~label_propagation.is_labeled(events['device_name'])]
+    if unlabeled.empty:
+        return unlabeled
+
+    unlabeled = unlabeled.assign(group=cluster_keys(unlabeled['power_change'], tolerance))
+    if 'predicted_confidence' in unlabeled:
+        predicted = pd.to_numeric(unlabeled['predicted_confidence'], errors='coerce')
+    else:
+        predicted = pd.Series(np.nan, index=unlabeled.index)
+    if 'predicted_appliance' not in unlabeled:
+        unlabeled = unlabeled.assign(predicted_appliance=None)
+
+    if index is not None and len(index):
+        proposed, proposal_confidence, _ = index.propose(label_propagation.event_vectors(unlabeled))
+    else:
+        proposed = np.full(len(unlabeled), None, dtype=object)
+        proposal_confidence = np.zeros(len(unlabeled))
+    certainty = np.fmax(predicted.fillna(0.0).to_numpy(), proposal_confidence)
+    return unlabeled.assign(predicted_confidence=predicted, proposed_label=proposed,
+                            proposal_confidence=proposal_confidence, certainty=certainty)
+
+def rank_groups(scored):
+    """
+    Rank the groups of scored events by labelling value.
+
+    The score of a group is its size times its uncertainty, one minus the
+    mean certainty of its events.
+
+    Args:
+        scored (pd.DataFrame): Output of :func:`score_events`
+
+    Returns:
+        pd.DataFrame: One row per group, highest score first
+    """
+    if scored is None or scored.empty:
+        return pd.DataFrame(columns=QUEUE_COLUMNS)
+    grouped = scored.groupby('group', sort=False)
+    queue = grouped.agg(
+        change_type=('change_type', 'first'),
+        count=('power_change', 'size'),
+        power_change=('power_change', 'median'),
+        power_min=('power_change', 'min'),
+        power_max=('power_change', 'max'),
+        first_timestamp=('timestamp', 'min'),
+        last_timestamp=('timestamp', 'max'),
+        predicted_confidence=('predicted_confidence', 'mean'),
+        proposal_confidence=('proposal_confidence', 'mean'),
+        certainty=('certainty', 'mean'),
+    )
+    queue['power_changes'] = grouped['power_change'].unique().apply(lambda v: sorted(v.tolist()))
+    queue['predicted_appliance'] = grouped['predicted_appliance'].agg(_mode)
+    queue['proposed_label'] = grouped['proposed_label'].agg(_mode)
+    queue['uncertainty'] = 1.0 - queue['certainty']
+    queue['score'] = queue['count'] * queue['uncertainty']
+
+    # Ties are broken by the group key so equal groups keep their order
+    queue = queue.reset_index().sort_values(['score', 'count', 'group'], ascending=[False, False, True],
+                                            kind='stable')
+    return queue[QUEUE_COLUMNS].reset_index(drop=True)
+
+def build_queue(events, index=None, tolerance=TOLERANCE):
+    """
+    Group unlabelled events and rank the groups by labelling value.
+
+    Args:
+        events (pd.DataFrame): Events from :func:`label_propagation.load_events`
+        index (label_propagation.LabelIndex): Index over the labelled events
+        tolerance (float): Relative width of a cluster
+
+    Returns:
+        pd.DataFrame: One row per group, highest score first
+    """
+    return rank_groups(score_events(events, index, tolerance))
+
+def get_queue(data_dir="data/raw", tolerance=TOLERANCE):
+    """
+    Current ranked queue of a data directory.
+
+    Only the events of changed files are scored again, unless the label
+    index changed. Each new ranking is stored as a snapshot for
+    :func:`get_snapshot`.
+
+    Args:
+        data_dir (str): Directory containing device_events_*.csv files
+        tolerance (float): Relative width of a cluster
+
+    Returns:
+        tuple: (snapshot id, output of :func:`build_queue`)
+    """
+    key = _queue_key(data_dir, tolerance)
+    store = label_propagation.event_store(data_dir)
+    files, version = store.files()
+    signature = (version, tuple(sorted((name, file_key) for name, (file_key, _) in files.items())))
+    with _queues_lock:
+        cached = _queues.get(key)
+        if cached is not None and cached[0] == signature and cached[2] in _snapshots:
+            return cached[2], _snapshots[cached[2]][1]
+
+    # Scores stay valid for unchanged files while the index is the same
+    previous = cached[1] if cached is not None and cached[0][0] == version else {}
+    parts = {}
+    for name, (file_key, events) in files.items():
+        part = previous.get(name)
+        if part is None or part[0] != file_key:
+            part = (file_key, score_events(events, store.index, tolerance))
+        parts[name] = part
+    scored = [part[1] for part in parts.values() if len(part[1])]
+    queue = rank_groups(pd.concat(scored, ignore_index=True) if scored else None)
+    logger.info(f"Labelling queue of {len(queue)} groups ranked for {data_dir}")
+
+    snapshot = uuid.uuid4().hex[:12]
+    with _queues_lock:
+        _queues[key] = (signature, parts, snapshot)
+        _snapshots[snapshot] = (key, queue)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return snapshot, queue
+
+def get_snapshot(snapshot, data_dir="data/raw", tolerance=TOLERANCE):
+    """
+    A queue ranking returned earlier by :func:`get_queue`.
+
+    Args:
+        snapshot (str): Snapshot id
+        data_dir (str): Directory the snapshot must have been ranked for
+        tolerance (float): Cluster width the snapshot must have been ranked with
+
+    Returns:
+        pd.DataFrame: The ranked queue, or None if the snapshot expired
+
+    Raises:
+        LabelingQueueError: If the snapshot belongs to another directory or
+            tolerance
+    """
+    with _queues_lock:
+        entry = _snapshots.get(snapshot)
+    if entry is None:
+        return None
+    key, queue = entry
+    if key != _queue_key(data_dir, tolerance):
+        raise LabelingQueueError(f"Queue snapshot {snapshot} was ranked for another site or tolerance")
+    return queue
+
+def queue_page(queue, offset=0, limit=20, snapshot=None):
+    """
+    One page of the queue as JSON-ready records.
+
+    Args:
+        queue (pd.DataFrame): Output of :func:`build_queue`
+        offset (int): Groups skipped
+        limit (int): Maximum number of groups returned
+        snapshot (str): Snapshot id of the queue, passed back for later pages
+
+    Returns:
+        dict: groups, total groups, unlabelled events, the snapshot id and
+            the next offset (None on the last page)
+    """
+    offset = max(int(offset), 0)
+    limit = max(int(limit), 1)
+    page = queue.iloc[offset:offset + limit]
+    page = page.astype(object).where(page.notna(), None)
+    next_offset = offset + limit if offset + limit < len(queue) else None
+    return {
+        'groups': page.to_dict('records'),
+        'total': len(queue),
+        'unlabeled_events': int(queue['count'].sum()) if len(queue) else 0,
+        'offset': offset,
+        'next_offset': next_offset,
+        'snapshot': snapshot,
+    }
@@ -0,0 +1,57 @@
+"""
+Deferred imports of heavy modules.
+
+``pd = lazy_import('pandas')`` binds a placeholder that imports pandas on
+first attribute access, so entry points such as the web app start without
+paying for pandas, numpy, matplotlib or scipy until a code path needs them.
+"""
+
+import importlib
+import threading
+
+class LazyModule:
+    """
+    Placeholder that imports a module on first attribute access.
+
+    Args:
+        name (str): Module name, e.g. 'matplotlib.pyplot'
+        setup (callable): Called once before the import, e.g. to select a
+            matplotlib backend
+    """
+
+    def __init__(self, name, setup=None):
+        self.__dict__.update(_name=name, _setup=setup, _module=None, _lock=threading.Lock())
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    if self._setup:
+                        self._setup()
+                    self.__dict__['_module'] = importlib.import_module(self._name)
+                module = self._module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name, setup=None):
+    """
+    Import a module on first use.
+
+    Args:
+        name (str): Module name
+        setup (callable): Called once before the import
+
+    Returns:
+        LazyModule: Placeholder forwarding attribute access to the module
+    """
+    return LazyModule(name, setup)
@@ -5,11 +5,25 @@ Main module for collecting power consumption data from Home Assistant.
 import os
 import time
 import logging
-import yaml
+import threading
 import requests
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from inference import LiveClassifier
+from pairing import EventPairer
+from pyramid import PowerPyramid
+from sketches import SketchStore
+from disaggregation import RollupUpdater
+from data_loader import mark_active, clear_active
+from scheduler import TickScheduler, BackgroundWriter
+from channel import LivePublisher, ChannelError
+from baseload import start_baseload_monitor, save_state
+from resample import MAX_GAP, nanoseconds
+from sites import configured_sites, configured_paths
+import settings
+import metrics
+import profiling
 
 # Configure logging
 logging.basicConfig(
@@ -22,6 +36,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Settings the collector cannot run without
+COLLECTOR_SETTINGS = (
+    'data_collection.interval', 'data_collection.save_interval', 'data_collection.max_samples',
+    'event_detection.threshold',
+)
+# Required unless every site in the 'sites' section sets its own
+HOME_ASSISTANT_SETTINGS = ('home_assistant.url', 'home_assistant.token', 'home_assistant.entity_id')
+
+# Metric label of the single-site layout
+DEFAULT_SITE = 'default'
+
+# Seconds between attempts to reach Home Assistant at startup, doubling up to the maximum
+RETRY_INITIAL = 5
+RETRY_MAX = 300
+
+# Collector metrics, written to data/metrics/collector.prom at every flush
+HA_REQUEST_SECONDS = metrics.histogram(
+    'nilm_ha_request_seconds', 'Latency of Home Assistant state requests', ['site', 'outcome'])
+POLL_JITTER_SECONDS = metrics.histogram(
+    'nilm_poll_jitter_seconds', 'Lateness of each poll relative to its scheduled tick', ['site'],
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+MISSED_TICKS_TOTAL = metrics.counter(
+    'nilm_missed_ticks_total', 'Sampling ticks skipped because the loop fell behind', ['site'])
+SAMPLES_TOTAL = metrics.counter('nilm_samples_total', 'Power samples collected', ['site'])
+EVENTS_TOTAL = metrics.counter('nilm_events_total', 'Power change events detected', ['site', 'change_type'])
+ERRORS_TOTAL = metrics.counter('nilm_collection_errors_total', 'Errors in the collection loop', ['site'])
+FLUSH_SECONDS = metrics.histogram('nilm_flush_seconds', 'Duration of periodic data saves', ['site'])
+RAW_FILES = metrics.gauge('nilm_raw_files', 'Files in the raw data directory', ['site'])
+RAW_BYTES = metrics.gauge('nilm_raw_bytes', 'Total size of the raw data directory', ['site'])
+POWER_QUANTILE_WATTS = metrics.gauge(
+    'nilm_power_quantile_watts', 'Rolling quantiles of the power draw', ['site', 'quantile'])
+ANOMALY_ACTIVE = metrics.gauge(
+    'nilm_anomaly_active', 'Whether an unusual sustained power draw is in progress', ['site'])
+ANOMALIES_TOTAL = metrics.counter('nilm_anomalies_total', 'Unusual sustained power draws flagged', ['site'])
+GAPS_TOTAL = metrics.counter('nilm_gaps_total', 'Breaks in sampling longer than resampling.max_gap', ['site'])
+
 class HomeAssistantError(Exception):
     """Raised when there is an error connecting to Home Assistant."""
     pass
@@ -33,43 +83,37 @@ class DataCollectionError(Exception):
 def load_config():
     """Load configuration from config.yaml and environment variables."""
     try:
-        with open("config.yaml", "r") as f:
-            config = yaml.safe_load(f)
-        
-        # Override with environment variables if available
-        if 'HA_URL' in os.environ:
-            config['home_assistant']['url'] = os.environ['HA_URL']
-        if 'HA_TOKEN' in os.environ:
-            config['home_assistant']['token'] = os.environ['HA_TOKEN']
-        if 'HA_ENTITY_ID' in os.environ:
-            config['home_assistant']['entity_id'] = os.environ['HA_ENTITY_ID']
-        if 'EVENT_THRESHOLD' in os.environ:
-            config['event_detection']['threshold'] = int(os.environ['EVENT_THRESHOLD'])
-        if 'MIN_PEAK_DISTANCE' in os.environ:
-            config['event_detection']['min_peak_distance'] = int(os.environ['MIN_PEAK_DISTANCE'])
-        if 'WINDOW_SIZE' in os.environ:
-            config['event_detection']['window_size'] = int(os.environ['WINDOW_SIZE'])
-        if 'SAVE_INTERVAL' in os.environ:
-            config['data_collection']['save_interval'] = int(os.environ['SAVE_INTERVAL'])
-        if 'MAX_SAMPLES' in os.environ:
-            config['data_collection']['max_samples'] = int(os.environ['MAX_SAMPLES'])
-        if 'COLLECTION_INTERVAL' in os.environ:
-            config['data_collection']['interval'] = int(os.environ['COLLECTION_INTERVAL'])
-        if 'N_APPLIANCES' in os.environ:
-            config['nilm_model']['n_appliances'] = int(os.environ['N_APPLIANCES'])
-            
-        return config
-    except FileNotFoundError:
-        raise HomeAssistantError("config.yaml not found. Please create it first.")
-    except yaml.YAMLError as e:
-        raise HomeAssistantError(f"Error parsing config.yaml: {e}")
+        return settings.load_config(require=COLLECTOR_SETTINGS)
+    except settings.ConfigError as e:
+        raise HomeAssistantError(str(e))
 
-def list_power_entities(config):
+def apply_config_changes(config, new_config, changes, scheduler):
+    """
+    Apply settings changed in config.yaml to the running collector.
+    
+    Args:
+        config (dict): Configuration in use, updated in place
+        new_config (dict): Reloaded configuration
+        changes (list): Changed (section, key) pairs
+        scheduler (TickScheduler): Sampling scheduler
+    """
+    for section, key in changes:
+        if (section, key) in settings.HOT_RELOADABLE:
+            config[section][key] = new_config[section][key]
+            logger.info(f"Applied {section}.{key} = {new_config[section][key]}")
+            if (section, key) == ('data_collection', 'interval'):
+                scheduler.set_interval(new_config[section][key])
+        else:
+            name = f"{section}.{key}" if key else section
+            logger.warning(f"{name} changed in config.yaml, restart the collector to apply it")
+
+def list_power_entities(config, session=None):
     """
     List all power-related entities available in Home Assistant.
     
     Args:
         config (dict): Configuration dictionary containing Home Assistant connection details
+        session (requests.Session): Connection pool to use, if any
         
     Returns:
         list: List of dictionaries containing entity information
@@ -81,7 +125,7 @@ def list_power_entities(config):
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        response = (session or requests).get(url, headers=headers)
         response.raise_for_status()
         states = response.json()
         
@@ -106,26 +150,167 @@ def list_power_entities(config):
     except requests.exceptions.RequestException as e:
         raise HomeAssistantError(f"Error connecting to Home Assistant: {e}")
 
-def get_power_data(config):
-    """Get power data from Home Assistant."""
+def get_power_data(config, session=None, site=DEFAULT_SITE):
+    """
+    Get power data from Home Assistant.
+    
+    Args:
+        config (dict): Configuration dictionary
+        session (requests.Session): Connection pool to use, if any
+        site (str): Site name for metrics
+    """
     url = f"{config['home_assistant']['url']}/api/states/{config['home_assistant']['entity_id']}"
     headers = {
         "Authorization": f"Bearer {config['home_assistant']['token']}",
         "content-type": "application/json",
     }
     
+    start = time.perf_counter()
     try:
-        response = requests.get(url, headers=headers)
+        response = (session or requests).get(url, headers=headers)
         response.raise_for_status()
+        HA_REQUEST_SECONDS.labels(site, 'ok').observe(time.perf_counter() - start)
         return response.json()
     except requests.exceptions.RequestException as e:
+        HA_REQUEST_SECONDS.labels(site, 'error').observe(time.perf_counter() - start)
         raise HomeAssistantError(f"Error connecting to Home Assistant: {e}")
 
+def retry_home_assistant(call, stop_event=None, log=logger, initial=RETRY_INITIAL, maximum=RETRY_MAX):
+    """
+    Call Home Assistant until it answers, backing off exponentially.
+    
+    Args:
+        call (callable): Request to make, raising HomeAssistantError on failure
+        stop_event (threading.Event): Gives up when set
+        log (logging.Logger): Logger for the failed attempts
+        initial (float): Seconds before the first retry
+        maximum (float): Longest wait between attempts
+        
+    Returns:
+        The result of ``call``, or None if stopped first
+    """
+    delay = initial
+    while True:
+        try:
+            return call()
+        except HomeAssistantError as e:
+            log.warning(f"{e}; retrying in {delay:.0f}s")
+        if stop_event is None:
+            time.sleep(delay)
+        elif stop_event.wait(delay):
+            return None
+        delay = min(delay * 2, maximum)
+
 def save_data(df, filename):
     """Save data to CSV file."""
     df.to_csv(filename, index=False)
     logger.info(f"Data saved to {filename}")
 
+def update_directory_metrics(data_dir="data/raw", site=DEFAULT_SITE):
+    """Record the number and total size of files in the data directory."""
+    if not metrics.ENABLED:
+        return
+    count = size = 0
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                count += 1
+                size += entry.stat().st_size
+    RAW_FILES.labels(site).set(count)
+    RAW_BYTES.labels(site).set(size)
+
+def update_baseload_metrics(monitor, site=DEFAULT_SITE):
+    """Record the rolling power quantiles and whether an anomaly is in progress."""
+    for quantile in (monitor.baseload, monitor.median, monitor.upper):
+        if quantile.value is not None:
+            POWER_QUANTILE_WATTS.labels(site, quantile.p).set(quantile.value)
+    ANOMALY_ACTIVE.labels(site).set(1 if monitor.anomaly_active else 0)
+
+def save_collected(suffix, data, device_events, device_runs, data_dir="data/raw"):
+    """
+    Save collected samples, events and paired runs.
+    
+    Args:
+        suffix (str): Timestamp suffix of the file set
+        data (list): Power samples
+        device_events (list): Detected events
+        device_runs (list): Paired on/off runs
+        data_dir (str): Directory of the site's raw data
+    """
+    save_data(pd.DataFrame(data), os.path.join(data_dir, f"power_data_{suffix}.csv"))
+    if device_events:
+        save_data(pd.DataFrame(device_events), os.path.join(data_dir, f"device_events_{suffix}.csv"))
+    if device_runs:
+        save_data(pd.DataFrame(device_runs), os.path.join(data_dir, f"device_runs_{suffix}.csv"))
+    logger.info(f"Saved {len(data)} data points and {len(device_events)} device events")
+
+def active_ttl(config):
+    """Seconds a run stays marked active without a flush renewing the mark."""
+    collection = config['data_collection']
+    return 3 * collection['save_interval'] * collection['interval']
+
+def add_to_pyramid(pyramid, new_data):
+    """
+    Add samples not in the pyramid yet to the overview pyramid.
+    
+    Args:
+        pyramid (PowerPyramid): Overview pyramid to extend
+        new_data (list): Samples not yet added
+    """
+    pyramid.append(nanoseconds(pd.to_datetime([d['timestamp'] for d in new_data], utc=True)),
+                   np.array([d['power'] for d in new_data], dtype=float))
+
+def add_to_sketches(sketches, new_data, new_events):
+    """
+    Add samples and events not sketched yet to the distribution sketches.
+    
+    Args:
+        sketches (SketchStore): Distribution sketches to extend
+        new_data (list): Samples not yet added
+        new_events (list): Events not yet added
+    """
+    sketches.append('power', nanoseconds(pd.to_datetime([d['timestamp'] for d in new_data], utc=True)),
+                    np.array([d['power'] for d in new_data], dtype=float))
+    if new_events:
+        sketches.append('power_change', nanoseconds(pd.to_datetime([e['timestamp'] for e in new_events], utc=True)),
+                        np.array([e['power_change'] for e in new_events], dtype=float))
+
+def flush_collected(suffix, data, device_events, device_runs, pyramid, new_data, publisher=None,
+                    data_dir="data/raw", site=DEFAULT_SITE, baseload=None, sketches=None, rollups=None,
+                    new_events=()):
+    """
+    Periodic save run on the background writer thread.
+    
+    Args:
+        suffix (str): Timestamp suffix of the file set
+        data (list): Snapshot of all power samples
+        device_events (list): Snapshot of detected events
+        device_runs (list): Snapshot of paired runs
+        pyramid (PowerPyramid): Overview pyramid to extend
+        new_data (list): Samples not yet added to the pyramid
+        publisher (LivePublisher): Live channel to prune, if enabled
+        data_dir (str): Directory of the site's raw data
+        site (str): Site name for metrics
+        baseload (tuple): (snapshot, path) of the baseload monitor, if enabled
+        sketches (SketchStore): Distribution sketches to extend, if any
+        rollups (RollupUpdater): Energy rollups of the run to update, if any
+        new_events (list): Events not yet added to the sketches
+    """
+    flush_start = time.perf_counter()
+    save_collected(suffix, data, device_events, device_runs, data_dir)
+    add_to_pyramid(pyramid, new_data)
+    if sketches:
+        add_to_sketches(sketches, new_data, new_events)
+    if rollups and data:
+        rollups.update(device_events, data[-1]['timestamp'])
+    if publisher:
+        publisher.prune()
+    if baseload:
+        save_state(*baseload)
+    FLUSH_SECONDS.labels(site).observe(time.perf_counter() - flush_start)
+    update_directory_metrics(data_dir, site)
+    metrics.write_textfile('collector')
+
 def detect_power_change(current_power, previous_power, config):
     """
     Detect significant power changes that might indicate device state changes.
@@ -180,121 +365,311 @@ def get_user_feedback(power_change, change_type):
         'timestamp': datetime.now().isoformat()
     }
 
-def main():
-    """Main function for data collection."""
+def start_live_classifier(config):
+    """
+    Start live classification of detected events if it is enabled.
+    
+    Args:
+        config (dict): Configuration dictionary
+        
+    Returns:
+        LiveClassifier: Running classifier, or None if inference is disabled
+    """
+    inference = config.get('inference', {})
+    if not inference.get('enabled', True):
+        return None
+    
+    classifier = LiveClassifier(
+        config['nilm_model']['model_dir'],
+        window_size=config['event_detection'].get('window_size', 30),
+        batch_size=inference.get('batch_size', 32),
+        max_delay=inference.get('max_delay', 2.0),
+        resampling=config.get('resampling'),
+    )
+    logger.info("Live event classification enabled")
+    return classifier.start()
+
+def start_live_publisher(config, path):
+    """
+    Open the live channel to the web app if it is enabled.
+    
+    Args:
+        config (dict): Configuration dictionary
+        path (str): Live channel database of the site
+        
+    Returns:
+        LivePublisher: Open publisher, or None if disabled or unavailable
+    """
+    channel = config.get('live_channel', {})
+    if not channel.get('enabled', True):
+        return None
     try:
-        # Load configuration
-        config = load_config()
-        logger.info("Configuration loaded successfully")
+        publisher = LivePublisher(
+            path,
+            retention=channel.get('retention_hours', 24) * 3600,
+        )
+    except ChannelError as e:
+        logger.warning(f"Live channel disabled: {e}")
+        return None
+    logger.info(f"Publishing live data to {publisher.path}")
+    return publisher
 
+def collect(config, site=None, stop_event=None):
+    """
+    Collect data from one Home Assistant instance until stopped.
+    
+    Args:
+        config (dict): Configuration of the site
+        site (str): Site name, None for the single-site layout
+        stop_event (threading.Event): Stops collection when set
+    """
+    log = logger.getChild(site) if site else logger
+    label = site or DEFAULT_SITE
+    session = requests.Session()  # Keeps connections to this instance open
+    data_dir = suffix = None
+    try:
         # List available power entities
-        logger.info("Listing available power-related entities...")
-        power_entities = list_power_entities(config)
+        log.info("Listing available power-related entities...")
+        # Keep trying if Home Assistant is not up yet instead of ending this site
+        power_entities = retry_home_assistant(lambda: list_power_entities(config, session), stop_event, log)
+        if power_entities is None:
+            return
         
         if power_entities:
-            logger.info("\nAvailable power-related entities:")
+            log.info("\nAvailable power-related entities:")
             for entity in power_entities:
-                logger.info(f"- {entity['name']} ({entity['entity_id']})")
-                logger.info(f"  State: {entity['state']} {entity['unit']}")
-                logger.info(f"  Device Class: {entity['device_class']}")
+                log.info(f"- {entity['name']} ({entity['entity_id']})")
+                log.info(f"  State: {entity['state']} {entity['unit']}")
+                log.info(f"  Device Class: {entity['device_class']}")
         else:
-            logger.warning("No power-related entities found in Home Assistant")
+            log.warning("No power-related entities found in Home Assistant")
             return
 
-        # Create data directory
-        os.makedirs("data/raw", exist_ok=True)
-        os.makedirs("data/processed", exist_ok=True)
+        # Create the data directories of this site
+        paths = configured_paths(config, site)
+        data_dir = paths['raw']
+        os.makedirs(data_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(paths['baseload']), exist_ok=True)
+
+        # Get initial power reading
+        initial_data = retry_home_assistant(lambda: get_power_data(config, session, label), stop_event, log)
+        if initial_data is None:
+            return
+        previous_power = float(initial_data['state'])
+        sampled_at = time.monotonic()  # When previous_power was read
+        log.info(f"Initial power reading: {previous_power}W")
 
         # Initialize data collection
         data = []
         device_events = []  # Store device identification events
+        device_runs = []  # Store paired on/off events
+        pairer = EventPairer()
+        pyramid = PowerPyramid(paths['pyramid'])
+        sketches = SketchStore(paths['sketches'])
+        pyramid_index = 0  # Samples already added to the pyramid
+        event_index = 0  # Events already added to the sketches
+        classifier = start_live_classifier(config)
+        publisher = start_live_publisher(config, paths['live'])
+        monitor = start_baseload_monitor(config, paths['baseload'])
+        writer = BackgroundWriter().start()  # Saves files off the sampling thread
+        scheduler = TickScheduler(config['data_collection']['interval'])
+        max_gap = (config.get('resampling') or {}).get('max_gap', MAX_GAP)
+        watcher = settings.ConfigWatcher(settings.load_config(require=COLLECTOR_SETTINGS),
+                                         require=COLLECTOR_SETTINGS)
         start_time = datetime.now()
-        logger.info(f"Starting data collection at {start_time}")
+        suffix = start_time.strftime('%Y%m%d_%H%M%S')
+        rollups = RollupUpdater(paths['rollups'], suffix)
+        # The files of this run are rewritten at every flush; the mark lapses
+        # if the collector dies without clearing it
+        mark_active(data_dir, suffix, active_ttl(config))
+        log.info(f"Starting data collection at {start_time}")
         
-        # Get initial power reading
-        initial_data = get_power_data(config)
-        previous_power = float(initial_data['state'])
-        logger.info(f"Initial power reading: {previous_power}W")
-
-        # Collect data
-        while True:
-            try:
-                # Get power data
-                power_data = get_power_data(config)
-                
-                # Extract relevant information
-                timestamp = datetime.fromisoformat(power_data['last_updated'])
-                current_power = float(power_data['state'])
-                
-                # Detect power changes
-                is_change, power_change, change_type = detect_power_change(
-                    current_power, previous_power, config
-                )
-                
-                # If significant change detected, record event without user input
-                if is_change:
-                    # Record event for later labeling
-                    event = {
-                        'timestamp': timestamp.isoformat(),
+        # Collect data (profiled one save interval at a time when NILM_PROFILE is set)
+        with profiling.ProfileWindows(f'collector_{label}', config['data_collection']['save_interval']) as profiler:
+            while stop_event is None or not stop_event.is_set():
+                profiler.tick()
+                try:
+                    # Wait for the next absolute tick, skipping ticks already missed
+                    missed, lateness = scheduler.wait()
+                    POLL_JITTER_SECONDS.labels(label).observe(lateness)
+                    if missed:
+                        MISSED_TICKS_TOTAL.labels(label).inc(missed)
+                        log.warning(f"Missed {missed} sampling ticks")
+                    
+                    # Apply edits to config.yaml without restarting
+                    update = watcher.check()
+                    if update:
+                        apply_config_changes(config, *update, scheduler)
+                    
+                    # Get power data
+                    power_data = get_power_data(config, session, label)
+                    
+                    # Extract relevant information
+                    timestamp = datetime.fromisoformat(power_data['last_updated'])
+                    current_power = float(power_data['state'])
+                    
+                    # Polls that failed for longer than max_gap (never less than two
+                    # intervals) leave a gap; a change across it is not an event
+                    now = time.monotonic()
+                    elapsed, sampled_at = now - sampled_at, now
+                    gap = elapsed > max(max_gap, 2 * scheduler.interval)
+                    if gap:
+                        GAPS_TOTAL.labels(label).inc()
+                        log.warning(f"No samples for {elapsed:.0f}s, not detecting events across the gap")
+                    if classifier:
+                        classifier.add_sample(timestamp, current_power, gap)
+                    
+                    # Detect power changes
+                    is_change, power_change, change_type = detect_power_change(
+                        current_power, previous_power, config
+                    )
+                    is_change = is_change and not gap
+                    
+                    # If significant change detected, record event without user input
+                    if is_change:
+                        # Record event for later labeling
+                        event = {
+                            'timestamp': timestamp.isoformat(),
+                            'power_change': power_change,
+                            'change_type': change_type,
+                            'power_before': previous_power,
+                            'power_after': current_power,
+                            'device_name': 'unlabeled',  # Will be labeled later
+                            'confidence': 0,  # Will be set during labeling
+                            'predicted_appliance': None,  # Set by the live classifier
+                            'predicted_confidence': None
+                        }
+                        device_events.append(event)
+                        EVENTS_TOTAL.labels(label, change_type).inc()
+                        log.info(f"Event detected: {change_type} event with {power_change:.1f}W change (unlabeled)")
+                        if classifier:
+                            classifier.submit(event)
+                        if publisher:
+                            publisher.publish_event(event)
+                        
+                        # Match off events with the corresponding on event
+                        run = pairer.add(timestamp, power_change)
+                        if run:
+                            device_runs.append(run)
+                            log.info(f"Run completed: {run['magnitude']:.1f}W for {run['duration']:.0f}s")
+                    
+                    # Add to data list
+                    data.append({
+                        'timestamp': timestamp,
+                        'power': current_power,
                         'power_change': power_change,
-                        'change_type': change_type,
-                        'power_before': previous_power,
-                        'power_after': current_power,
-                        'device_name': 'unlabeled',  # Will be labeled later
-                        'confidence': 0  # Will be set during labeling
-                    }
-                    device_events.append(event)
-                    logger.info(f"Event detected: {change_type} event with {power_change:.1f}W change (unlabeled)")
-                
-                # Add to data list
-                data.append({
-                    'timestamp': timestamp,
-                    'power': current_power,
-                    'power_change': power_change
-                })
-                
-                # Save data periodically
-                if len(data) % config['data_collection']['save_interval'] == 0:
-                    # Save power data
-                    df = pd.DataFrame(data)
-                    save_data(df, f"data/raw/power_data_{start_time.strftime('%Y%m%d_%H%M%S')}.csv")
+                        'gap': gap or not data  # Each file starts after a gap
+                    })
+                    SAMPLES_TOTAL.labels(label).inc()
+                    if publisher:
+                        publisher.publish_sample(timestamp, current_power)
+                    
+                    # Track the baseload and flag unusual sustained draws
+                    if monitor:
+                        anomaly = monitor.add(timestamp, current_power)
+                        if anomaly and anomaly['active']:
+                            ANOMALIES_TOTAL.labels(label).inc()
+                            log.warning(f"Unusual draw of {anomaly['mean_power']:.0f}W above "
+                                        f"{anomaly['threshold']:.0f}W since {anomaly['start']}")
+                        elif anomaly:
+                            log.info(f"Unusual draw ended after {anomaly['duration_seconds']:.0f}s")
+                    
+                    # Save data periodically on the writer thread
+                    if len(data) % config['data_collection']['save_interval'] == 0:
+                        baseload = None
+                        if monitor:
+                            update_baseload_metrics(monitor, label)
+                            baseload = (monitor.snapshot(), paths['baseload'])
+                        mark_active(data_dir, suffix, active_ttl(config))
+                        writer.submit(flush_collected, suffix, list(data), list(device_events),
+                                      list(device_runs), pyramid, data[pyramid_index:], publisher,
+                                      data_dir, label, baseload, sketches, rollups,
+                                      new_events=device_events[event_index:])
+                        pyramid_index = len(data)
+                        event_index = len(device_events)
+                        
+                        # Classify events collected since the last flush
+                        if classifier:
+                            classifier.flush()
+                    
+                    # Update previous power
+                    previous_power = current_power
                     
-                    # Save device events
-                    if device_events:
-                        events_df = pd.DataFrame(device_events)
-                        save_data(events_df, f"data/raw/device_events_{start_time.strftime('%Y%m%d_%H%M%S')}.csv")
+                    # Check if we've reached max samples
+                    if len(data) >= config['data_collection']['max_samples']:
+                        break
                     
-                    logger.info(f"Saved {len(data)} data points and {len(device_events)} device events")
-                
-                # Update previous power
-                previous_power = current_power
-                
-                # Check if we've reached max samples
-                if len(data) >= config['data_collection']['max_samples']:
+                except KeyboardInterrupt:
+                    log.info("Data collection interrupted by user")
                     break
-                
-                # Wait for next interval
-                time.sleep(config['data_collection']['interval'])
-                
-            except KeyboardInterrupt:
-                logger.info("Data collection interrupted by user")
-                break
-            except Exception as e:
-                logger.error(f"Error during data collection: {e}")
-                time.sleep(5)  # Wait before retrying
+                except Exception as e:
+                    log.error(f"Error during data collection: {e}")
+                    ERRORS_TOTAL.labels(label).inc()
+                    # Wait before retrying
+                    if stop_event is None:
+                        time.sleep(5)
+                    else:
+                        stop_event.wait(5)
+        
+        # Classify remaining events and finish pending saves
+        if classifier:
+            classifier.stop()
+        writer.stop()
+        if publisher:
+            publisher.close()
         
         # Save final data
         if data:
-            # Save power data
-            df = pd.DataFrame(data)
-            save_data(df, f"data/raw/power_data_{start_time.strftime('%Y%m%d_%H%M%S')}.csv")
-            
-            # Save device events
-            if device_events:
-                events_df = pd.DataFrame(device_events)
-                save_data(events_df, f"data/raw/device_events_{start_time.strftime('%Y%m%d_%H%M%S')}.csv")
-            
-            logger.info(f"Data collection completed. Total points: {len(data)}, Device events: {len(device_events)}")
+            save_collected(suffix, data, device_events, device_runs, data_dir)
+            add_to_pyramid(pyramid, data[pyramid_index:])
+            add_to_sketches(sketches, data[pyramid_index:], device_events[event_index:])
+            rollups.update(device_events, data[-1]['timestamp'])
+            log.info(f"Data collection completed. Total points: {len(data)}, Device events: {len(device_events)}")
+            update_directory_metrics(data_dir, label)
+            metrics.write_textfile('collector')
+        
+    except Exception as e:
+        log.error(f"Collection failed: {e}")
+        raise
+    finally:
+        if suffix:
+            clear_active(data_dir, suffix)
+        session.close()
+
+def main():
+    """Main function for data collection."""
+    try:
+        # Load configuration
+        config = load_config()
+        logger.info("Configuration loaded successfully")
+        
+        sites = configured_sites(config)
+        if not sites:
+            try:
+                settings.validate(config, HOME_ASSISTANT_SETTINGS)
+            except settings.ConfigError as e:
+                raise HomeAssistantError(str(e))
+            collect(config)
+            return
+        
+        # Poll all sites concurrently from this process
+        stop_event = threading.Event()
+        threads = [
+            threading.Thread(target=collect, args=(site_config, name, stop_event), name=f"collector-{name}")
+            for name, site_config in sites
+        ]
+        logger.info(f"Collecting from {len(threads)} sites: {', '.join(name for name, _ in sites)}")
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            logger.info("Data collection interrupted by user")
+            stop_event.set()
+            for thread in threads:
+                thread.join()
         
     except Exception as e:
         logger.error(f"Fatal error: {e}")
@@ -0,0 +1,323 @@
+"""
+Minimal Prometheus-style metrics.
+
+Counters, gauges and histograms are registered in a process-wide registry
+and rendered in the Prometheus text exposition format. Set ``NILM_METRICS=0``
+to disable them: every metric then becomes a shared no-op object, so
+instrumented code costs a single method call that does nothing.
+
+The collector and the web app run in separate processes. The collector
+periodically writes its metrics to ``data/metrics/collector.prom`` with
+:func:`write_textfile`, labelled ``process="collector"``, and the web app
+merges that file into its own ``/metrics`` output with :func:`exposition`.
+"""
+
+import os
+import time
+import bisect
+import threading
+
+ENABLED = os.environ.get('NILM_METRICS', '1').lower() not in ('0', 'false', 'no')
+METRICS_DIR = "data/metrics"
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Base class of metrics with optional labels."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values, **kwargs):
+        """Get the child metric for a combination of label values."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        # Metrics without labels act as their own single child
+        return self.labels()
+
+    def render(self, extra=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key, extra or []))
+        return lines
+
+class _Value:
+    """Single counter or gauge value."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, key, extra):
+        return [f"{name}{_format_labels(labelnames, key, extra)} {_format_value(self.value)}"]
+
+class _HistogramValue:
+    """Bucket counts, sum and count of one histogram child."""
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the duration of a block."""
+        return _Timer(self)
+
+    def render(self, name, labelnames, key, extra):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, key, extra + [('le', _format_value(float(bound)))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key, extra + [('le', '+Inf')])
+        lines.append(f"{name}_bucket{labels} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key, extra)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key, extra)} {self.count}")
+        return lines
+
+class _Timer:
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+class _NullMetric:
+    """Stand-in for every metric when metrics are disabled."""
+
+    def labels(self, *values, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return _NULL_TIMER
+
+    def render(self, extra=None):
+        return []
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_METRIC = _NullMetric()
+_NULL_TIMER = _NullTimer()
+
+_registry = {}
+_registry_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+def _register(cls, name, documentation, labelnames=(), **kwargs):
+    if not ENABLED:
+        return _NULL_METRIC
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+
+def counter(name, documentation, labelnames=()):
+    """Create or get a registered counter."""
+    return _register(Counter, name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=()):
+    """Create or get a registered gauge."""
+    return _register(Gauge, name, documentation, labelnames)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Create or get a registered histogram."""
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+# Shared by every in-process cache, labelled with the cache name
+CACHE_REQUESTS = counter('nilm_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+
+def render(extra_labels=None):
+    """
+    Render all registered metrics in the Prometheus text format.
+
+    Args:
+        extra_labels (dict): Labels added to every sample
+    """
+    extra = list((extra_labels or {}).items())
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render(extra))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def write_textfile(name, metrics_dir=METRICS_DIR):
+    """
+    Write all registered metrics to ``<metrics_dir>/<name>.prom``.
+
+    Args:
+        name (str): File name without extension
+        metrics_dir (str): Target directory
+    """
+    if not ENABLED:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"{name}.prom")
+    # Collector threads of several sites may write at the same time
+    with _write_lock:
+        with open(f"{path}.tmp", 'w') as f:
+            f.write(render({'process': name}))
+        os.replace(f"{path}.tmp", path)
+
+def read_textfiles(metrics_dir=METRICS_DIR):
+    """Read the metric files written by other processes."""
+    if not os.path.isdir(metrics_dir):
+        return []
+    texts = []
+    for filename in sorted(os.listdir(metrics_dir)):
+        if filename.endswith('.prom'):
+            try:
+                with open(os.path.join(metrics_dir, filename), 'r') as f:
+                    texts.append(f.read())
+            except OSError:
+                pass
+    return texts
+
+def merge(texts):
+    """
+    Merge several expositions so every metric family appears once.
+
+    Samples of the same family from different processes are distinguished
+    by their ``process`` label.
+    """
+    headers, samples = {}, {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                parts = line.split(None, 3)
+                if len(parts) < 3:
+                    continue
+                name = parts[2]
+                headers.setdefault(name, {}).setdefault(parts[1], line)
+                samples.setdefault(name, [])
+            elif line.strip() and name:
+                samples[name].append(line)
+
+    lines = []
+    for name, header in headers.items():
+        lines.extend(header[kind] for kind in ('HELP', 'TYPE') if kind in header)
+        lines.extend(samples[name])
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def exposition(metrics_dir=METRICS_DIR):
+    """Metrics of this process merged with those of other processes."""
+    return merge([render()] + read_textfiles(metrics_dir))
@@ -0,0 +1,279 @@
+"""
+Versioned storage for trained NILM model artifacts.
+
+Each training run is written to its own directory below ``nilm_model.model_dir``::
+
+    models/
+    ├── LATEST                     # name of the most recent version
+    └── nilm_20250516_134338/
+        ├── model.joblib           # model, detector parameters, scalers, profiles
+        └── manifest.json          # data range, metrics and parameters
+
+Artifacts are dumped uncompressed so that numpy arrays inside them can be
+memory-mapped on load, and loaded artifacts are cached per process so that
+repeated lookups are free. The cache keeps the ``MAX_CACHED_MODELS`` most
+recently used artifacts, separately for each ``mmap_mode``.
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import joblib
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT = 1
+ARTIFACT_FILE = "model.joblib"
+MANIFEST_FILE = "manifest.json"
+LATEST_FILE = "LATEST"
+VERSION_PREFIX = "nilm_"
+# Artifacts kept loaded: the latest version and the one used before it
+MAX_CACHED_MODELS = 2
+
+# In-process LRU cache: (version directory, mmap_mode) -> (artifact mtime, artifact)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+class ModelStoreError(Exception):
+    """Raised when a model artifact cannot be saved or loaded."""
+    pass
+
+def detector_params(config):
+    """
+    Extract the event detection parameters a model was trained with.
+
+    Args:
+        config (dict): Configuration dictionary
+
+    Returns:
+        dict: Threshold, minimum peak distance and window size
+    """
+    detection = config['event_detection']
+    return {
+        'threshold': detection['threshold'],
+        'min_peak_distance': detection['min_peak_distance'],
+        'window_size': detection.get('window_size'),
+    }
+
+def appliance_profiles(predictions):
+    """
+    Summarise the events assigned to each appliance.
+
+    The profiles are stored with the model and used at inference time to
+    derive a confidence for each prediction.
+
+    Args:
+        predictions (pd.DataFrame): Predictions with 'appliance', 'magnitude'
+            and 'power_after' columns
+
+    Returns:
+        dict: Mapping of appliance to count, mean and std of each column
+    """
+    profiles = {}
+    for appliance, group in predictions.groupby('appliance'):
+        profile = {'count': int(len(group))}
+        for column in ('magnitude', 'power_after'):
+            if column in group:
+                profile[f'{column}_mean'] = float(group[column].mean())
+                profile[f'{column}_std'] = float(group[column].std(ddof=0))
+        profiles[str(appliance)] = profile
+    return profiles
+
+def _new_version(model_dir):
+    """Return an unused version name based on the current time."""
+    base = f"{VERSION_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    version = base
+    suffix = 1
+    while os.path.exists(os.path.join(model_dir, version)):
+        version = f"{base}_{suffix}"
+        suffix += 1
+    return version
+
+def _write_atomic(path, text):
+    """Write a small text file so that readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def save_model(model, config, data_range=None, metrics=None, scalers=None, profiles=None, model_dir=None):
+    """
+    Save a trained model as a new artifact version.
+
+    Args:
+        model: Trained NILM model (anything joblib can pickle)
+        config (dict): Configuration the model was trained with
+        data_range (dict): Start, end and sample count of the training data
+        metrics (dict): Training metrics to record in the manifest
+        scalers (dict): Fitted feature scalers by name
+        profiles (dict): Per-appliance profiles from :func:`appliance_profiles`
+        model_dir (str): Target directory (defaults to ``nilm_model.model_dir``)
+
+    Returns:
+        str: Path of the new version directory
+    """
+    model_dir = model_dir or config['nilm_model']['model_dir']
+    os.makedirs(model_dir, exist_ok=True)
+
+    version = _new_version(model_dir)
+    path = os.path.join(model_dir, version)
+    tmp_path = f"{path}.tmp"
+
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'version': version,
+        'model': model,
+        'detector': detector_params(config),
+        'n_appliances': config['nilm_model']['n_appliances'],
+        'scalers': scalers or {},
+        'profiles': profiles or {},
+    }
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'version': version,
+        'created': datetime.now().isoformat(),
+        'model_class': f"{type(model).__module__}.{type(model).__name__}",
+        'detector': artifact['detector'],
+        'n_appliances': artifact['n_appliances'],
+        'scalers': sorted(artifact['scalers']),
+        'appliances': sorted(artifact['profiles']),
+        'data_range': data_range or {},
+        'metrics': metrics or {},
+    }
+
+    try:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        # No compression, so numpy arrays can be memory-mapped on load
+        joblib.dump(artifact, os.path.join(tmp_path, ARTIFACT_FILE), compress=0)
+        with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+        os.replace(tmp_path, path)
+        _write_atomic(os.path.join(model_dir, LATEST_FILE), version)
+    except Exception as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise ModelStoreError(f"Error saving model to {path}: {e}")
+
+    logger.info(f"Model saved as version {version} in {model_dir}")
+    return path
+
+def list_versions(model_dir):
+    """
+    List all saved model versions, oldest first.
+
+    Args:
+        model_dir (str): Model directory
+
+    Returns:
+        list: Version names
+    """
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(model_dir)
+        if name.startswith(VERSION_PREFIX)
+        and os.path.isfile(os.path.join(model_dir, name, ARTIFACT_FILE))
+    )
+
+def latest_version(model_dir):
+    """
+    Get the most recent model version.
+
+    Args:
+        model_dir (str): Model directory
+
+    Returns:
+        str: Version name, or None if no model has been saved
+    """
+    try:
+        with open(os.path.join(model_dir, LATEST_FILE), 'r') as f:
+            version = f.read().strip()
+        if os.path.isfile(os.path.join(model_dir, version, ARTIFACT_FILE)):
+            return version
+    except FileNotFoundError:
+        pass
+
+    versions = list_versions(model_dir)
+    return versions[-1] if versions else None
+
+def load_manifest(model_dir, version=None):
+    """
+    Load the manifest of a model version without loading the model.
+
+    Args:
+        model_dir (str): Model directory
+        version (str): Version name (defaults to the latest version)
+
+    Returns:
+        dict: Manifest contents
+    """
+    version = version or latest_version(model_dir)
+    if version is None:
+        raise ModelStoreError(f"No saved models found in {model_dir}")
+    try:
+        with open(os.path.join(model_dir, version, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ModelStoreError(f"Error reading manifest of {version}: {e}")
+
+def load_model(model_dir, version=None, mmap_mode='r'):
+    """
+    Load a model artifact, reusing the in-process cache when possible.
+
+    Args:
+        model_dir (str): Model directory
+        version (str): Version name (defaults to the latest version)
+        mmap_mode (str): Memory-map mode for numpy arrays, None to read fully
+
+    Returns:
+        dict: Artifact with 'model', 'detector', 'scalers', 'profiles' and
+            'manifest' entries
+    """
+    version = version or latest_version(model_dir)
+    if version is None:
+        raise ModelStoreError(f"No saved models found in {model_dir}")
+
+    path = os.path.join(model_dir, version)
+    artifact_path = os.path.join(path, ARTIFACT_FILE)
+    try:
+        mtime = os.path.getmtime(artifact_path)
+    except OSError:
+        raise ModelStoreError(f"Model version {version} not found in {model_dir}")
+
+    key = (os.path.abspath(path), mmap_mode)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            _cache.move_to_end(key)
+            CACHE_REQUESTS.labels('models', 'hit').inc()
+            return cached[1]
+    CACHE_REQUESTS.labels('models', 'miss').inc()
+
+    try:
+        artifact = joblib.load(artifact_path, mmap_mode=mmap_mode)
+    except Exception as e:
+        raise ModelStoreError(f"Error loading model {version}: {e}")
+
+    if artifact.get('format') != ARTIFACT_FORMAT:
+        raise ModelStoreError(
+            f"Model {version} has format {artifact.get('format')}, expected {ARTIFACT_FORMAT}"
+        )
+    artifact['manifest'] = load_manifest(model_dir, version)
+
+    with _cache_lock:
+        _cache[key] = (mtime, artifact)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_MODELS:
+            _cache.popitem(last=False)
+    logger.info(f"Loaded model version {version}")
+    return artifact
+
+def clear_cache():
+    """Drop all cached model artifacts."""
+    with _cache_lock:
+        _cache.clear()
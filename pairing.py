@@ -0,0 +1,147 @@
+"""
+Pairing of 'on' and 'off' transitions into appliance runs.
+
+An 'off' transition is matched with the open 'on' transition whose magnitude
+is closest to its own, within a relative tolerance. Open transitions are kept
+in a list sorted by magnitude, so each match is a binary search instead of a
+scan over all open transitions.
+"""
+
+import bisect
+import logging
+from collections import deque
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RUN_COLUMNS = ['on_timestamp', 'off_timestamp', 'duration', 'magnitude',
+               'on_change', 'off_change', 'energy_kwh', 'appliance']
+
+class EventPairer:
+    """
+    Streaming matcher of opposite-sign power transitions.
+
+    Feed events in time order with :meth:`add`; every matched 'off' event
+    returns a completed run. 'On' events that stay unmatched for longer than
+    ``max_duration`` seconds are dropped, so memory stays bounded.
+    """
+
+    def __init__(self, tolerance=0.15, min_tolerance=10.0, max_duration=86400):
+        """
+        Args:
+            tolerance (float): Allowed relative magnitude difference
+            min_tolerance (float): Allowed absolute difference in Watts for
+                small transitions
+            max_duration (float): Seconds after which an open 'on' event expires
+        """
+        self.tolerance = tolerance
+        self.min_tolerance = min_tolerance
+        self.max_duration = max_duration
+        self.expired = 0
+        self._keys = []        # sorted (magnitude, seq) of open 'on' events
+        self._open = {}        # seq -> (timestamp, magnitude, event)
+        self._arrivals = deque()  # (timestamp, seq) in arrival order
+        self._seq = 0
+
+    def __len__(self):
+        """Number of open 'on' events."""
+        return len(self._open)
+
+    def _expire(self, now):
+        """Drop open 'on' events older than max_duration."""
+        while self._arrivals and (now - self._arrivals[0][0]).total_seconds() > self.max_duration:
+            _, seq = self._arrivals.popleft()
+            entry = self._open.pop(seq, None)
+            if entry is not None:
+                self._keys.remove((entry[1], seq))
+                self.expired += 1
+
+    def _remove(self, index):
+        """Remove the open event at a position of the sorted index."""
+        _, seq = self._keys.pop(index)
+        return self._open.pop(seq)
+
+    def add(self, timestamp, power_change, appliance=None):
+        """
+        Add a transition.
+
+        Args:
+            timestamp (pd.Timestamp): Time of the transition
+            power_change (float): Signed power change in Watts
+            appliance (str): Label or prediction of the transition, if any
+
+        Returns:
+            dict: Completed run if an 'off' transition was matched, else None
+        """
+        timestamp = pd.Timestamp(timestamp)
+        self._expire(timestamp)
+        magnitude = abs(float(power_change))
+
+        if power_change > 0:
+            self._seq += 1
+            bisect.insort(self._keys, (magnitude, self._seq))
+            self._open[self._seq] = (timestamp, magnitude, (power_change, appliance))
+            self._arrivals.append((timestamp, self._seq))
+            return None
+
+        # Closest open magnitude within tolerance, preferring the most recent
+        allowed = max(magnitude * self.tolerance, self.min_tolerance)
+        lo = bisect.bisect_left(self._keys, (magnitude - allowed, -1))
+        hi = bisect.bisect_right(self._keys, (magnitude + allowed, float('inf')))
+        if lo == hi:
+            return None
+        best = min(range(lo, hi), key=lambda i: (abs(self._keys[i][0] - magnitude), -self._keys[i][1]))
+        on_timestamp, on_magnitude, (on_change, on_appliance) = self._remove(best)
+
+        duration = (timestamp - on_timestamp).total_seconds()
+        run_magnitude = (on_magnitude + magnitude) / 2
+        return {
+            'on_timestamp': on_timestamp,
+            'off_timestamp': timestamp,
+            'duration': duration,
+            'magnitude': run_magnitude,
+            'on_change': on_change,
+            'off_change': float(power_change),
+            'energy_kwh': run_magnitude * duration / 3.6e6,
+            'appliance': on_appliance if on_appliance is not None else appliance,
+        }
+
+def pair_events(events, tolerance=0.15, min_tolerance=10.0, max_duration=86400):
+    """
+    Pair all transitions in a batch of events.
+
+    Accepts both the collector format (``power_change``) and the detector
+    format (``magnitude``); an ``appliance`` or ``device_name`` column is
+    carried over to the runs.
+
+    Args:
+        events (pd.DataFrame): Events with a timestamp column
+        tolerance (float): Allowed relative magnitude difference
+        min_tolerance (float): Allowed absolute difference in Watts
+        max_duration (float): Maximum run duration in seconds
+
+    Returns:
+        pd.DataFrame: One row per run
+    """
+    if events.empty:
+        return pd.DataFrame(columns=RUN_COLUMNS)
+
+    change_column = 'power_change' if 'power_change' in events.columns else 'magnitude'
+    label_column = next((c for c in ('appliance', 'device_name') if c in events.columns), None)
+    events = events.sort_values('timestamp', kind='stable')
+
+    pairer = EventPairer(tolerance, min_tolerance, max_duration)
+    timestamps = pd.to_datetime(events['timestamp'])
+    changes = events[change_column].to_numpy(dtype=float)
+    labels = events[label_column].tolist() if label_column else [None] * len(events)
+
+    runs = []
+    for timestamp, change, label in zip(timestamps, changes, labels):
+        if label == 'unlabeled':
+            label = None
+        run = pairer.add(timestamp, change, label)
+        if run is not None:
+            runs.append(run)
+
+    logger.info(f"Paired {2 * len(runs)} of {len(events)} events into {len(runs)} runs")
+    return pd.DataFrame(runs, columns=RUN_COLUMNS)
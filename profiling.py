@@ -0,0 +1,245 @@
+"""
+Opt-in profiling of the collector, training stages and web requests.
+
+Set ``NILM_PROFILE=1`` to profile every instrumented block. With
+``NILM_PROFILE=request`` only web requests carrying ``?profile=1`` are
+profiled; without the variable that parameter is ignored. Long-running loops
+are profiled in consecutive windows (:class:`ProfileWindows`), each written
+when it ends. Each profiled block writes to ``data/profiles``:
+
+- ``<name>_<time>.prof``: cProfile statistics (``python -m pstats``, snakeviz)
+- ``<name>_<time>.collapsed``: sampled stacks in the collapsed format read
+  by flamegraph.pl and speedscope
+- ``<name>_<time>.json``: wall time and the top hotspots
+
+The hotspots are also logged. When profiling is disabled, :func:`profile`
+returns a shared no-op context manager.
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "data/profiles"
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 15
+MAX_STACKS = 10000  # Distinct stacks kept by a sampler, rarer ones are merged
+WINDOW_TICKS = 1000
+OTHER_STACK = "(other)"
+
+# Only one cProfile profiler can be active at a time on Python 3.12+
+_cprofile_lock = threading.Lock()
+_timings = {}  # Block name -> total seconds, in order of first use
+_timings_lock = threading.Lock()
+
+def _setting():
+    return os.environ.get('NILM_PROFILE', '0').lower()
+
+def enabled():
+    """Whether profiling is switched on by the NILM_PROFILE environment variable."""
+    return _setting() in ('1', 'true', 'yes')
+
+def requests_enabled():
+    """Whether single web requests may ask to be profiled with ?profile=1."""
+    return enabled() or _setting() == 'request'
+
+class StackSampler(threading.Thread):
+    """Periodically record the call stack of one thread."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL, max_stacks=MAX_STACKS):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    key = OTHER_STACK
+                self.stacks[key] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class ProfileSession:
+    """
+    Context manager profiling a block with cProfile and a stack sampler.
+
+    Args:
+        name (str): Name used in the output file names
+        profile_dir (str): Output directory
+        top (int): Number of hotspots to log
+    """
+
+    def __init__(self, name, profile_dir=PROFILE_DIR, top=TOP_FUNCTIONS):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.top = top
+        self.profile = None
+        self.sampler = None
+        self.seconds = None
+
+    def __enter__(self):
+        # Concurrent blocks (e.g. parallel requests) fall back to sampling only
+        if _cprofile_lock.acquire(blocking=False):
+            self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident())
+        self.sampler.start()
+        self.start = time.perf_counter()
+        if self.profile:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile:
+            self.profile.disable()
+            _cprofile_lock.release()
+        self.seconds = time.perf_counter() - self.start
+        self.sampler.stop()
+        with _timings_lock:
+            _timings[self.name] = _timings.get(self.name, 0.0) + self.seconds
+        try:
+            self.write()
+        except Exception as e:
+            logger.warning(f"Could not write profile {self.name}: {e}")
+        return False
+
+    def hotspots(self):
+        """Functions with the highest own time, as a list of dicts."""
+        if not self.profile:
+            return []
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+        return [
+            {
+                'function': f"{func} ({os.path.basename(filename)}:{line})",
+                'calls': calls,
+                'own_seconds': round(own, 6),
+                'cumulative_seconds': round(cumulative, 6),
+            }
+            for (filename, line, func), (_, calls, own, cumulative, _) in rows
+        ]
+
+    def write(self):
+        """Write the profile, collapsed stacks and summary, and log hotspots."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in self.name)
+        base = os.path.join(self.profile_dir, f"{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+
+        if self.profile:
+            self.profile.dump_stats(f"{base}.prof")
+        with open(f"{base}.collapsed", 'w') as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        hotspots = self.hotspots()
+        with open(f"{base}.json", 'w') as f:
+            json.dump({
+                'name': self.name,
+                'seconds': round(self.seconds, 6),
+                'samples': sum(self.sampler.stacks.values()),
+                'hotspots': hotspots,
+            }, f, indent=2)
+
+        lines = [f"Profile {self.name}: {self.seconds:.3f}s, written to {base}.*"]
+        for spot in hotspots:
+            lines.append(f"  {spot['own_seconds']:9.4f}s own {spot['cumulative_seconds']:9.4f}s cum "
+                         f"{spot['calls']:8d}x {spot['function']}")
+        logger.info('\n'.join(lines))
+
+class _NullSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SESSION = _NullSession()
+
+def profile(name, force=False, profile_dir=PROFILE_DIR):
+    """
+    Profile a block if profiling is enabled.
+
+    Args:
+        name (str): Name of the profiled block
+        force (bool): Profile even if NILM_PROFILE is not set
+        profile_dir (str): Output directory
+
+    Returns:
+        Context manager
+    """
+    if force or enabled():
+        return ProfileSession(name, profile_dir)
+    return _NULL_SESSION
+
+class ProfileWindows:
+    """
+    Profile a long-running loop in consecutive windows of ``ticks`` iterations.
+
+    Each window is a separate :class:`ProfileSession`, written when the
+    window ends, so profiles appear while the loop runs and memory stays
+    bounded. Does nothing unless profiling is enabled.
+
+    Args:
+        name (str): Name of the profiled loop
+        ticks (int): Iterations per window
+        profile_dir (str): Output directory
+    """
+
+    def __init__(self, name, ticks=WINDOW_TICKS, profile_dir=PROFILE_DIR):
+        self.name = name
+        self.ticks = max(int(ticks), 1)
+        self.profile_dir = profile_dir
+        self.count = 0
+        self.session = None
+
+    def __enter__(self):
+        if enabled():
+            self.session = ProfileSession(self.name, self.profile_dir).__enter__()
+        return self
+
+    def tick(self):
+        """Count an iteration, ending the window after ``ticks`` of them."""
+        if self.session is None:
+            return
+        self.count += 1
+        if self.count >= self.ticks:
+            self.session.__exit__(None, None, None)
+            self.session = ProfileSession(self.name, self.profile_dir).__enter__()
+            self.count = 0
+
+    def __exit__(self, *exc):
+        if self.session is not None:
+            self.session.__exit__(*exc)
+            self.session = None
+        return False
+
+def log_timings(title):
+    """Log the wall time of all blocks profiled in this process."""
+    if not _timings:
+        return
+    total = sum(_timings.values())
+    lines = [f"{title} timing breakdown:"]
+    for name, seconds in list(_timings.items()):
+        lines.append(f"  {name:30s} {seconds:9.3f}s {100 * seconds / total if total else 0:5.1f}%")
+    logger.info('\n'.join(lines))
@@ -0,0 +1,310 @@
+"""
+Multi-resolution pyramid of aggregated power for zoomable overviews.
+
+Every level stores one record per time bucket with the sample count, sum,
+minimum and maximum power. Levels are flat binary files of fixed-size
+records, so new data is appended in place and range queries are a binary
+search on the memory-mapped bucket column followed by a slice. Each append
+is first written to a journal covering every level and ``state.json``, and
+replayed if it was interrupted, so they always change together.
+
+Example:
+    python pyramid.py            # add new samples from data/raw
+    python pyramid.py --rebuild  # rebuild from scratch
+"""
+
+import os
+import json
+import shutil
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from data_loader import load_power_data
+from resample import nanoseconds
+
+logger = logging.getLogger(__name__)
+
+PYRAMID_DIR = "data/processed/pyramid"
+STATE_FILE = "state.json"
+JOURNAL_FILE = "append.journal"
+
+# Level name -> bucket width in seconds, finest first
+LEVELS = {
+    '1s': 1,
+    '10s': 10,
+    '1min': 60,
+    '15min': 900,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+RECORD = np.dtype([
+    ('bucket', '<i8'),
+    ('count', '<i8'),
+    ('sum', '<f8'),
+    ('min', '<f8'),
+    ('max', '<f8'),
+])
+
+class PyramidError(Exception):
+    """Raised when the power pyramid cannot be built or queried."""
+    pass
+
+def aggregate(timestamps_ns, power, width_s):
+    """
+    Aggregate sorted samples into buckets of a fixed width.
+
+    Args:
+        timestamps_ns (np.ndarray): Sorted sample times in nanoseconds
+        power (np.ndarray): Power readings
+        width_s (int): Bucket width in seconds
+
+    Returns:
+        np.ndarray: Records of dtype RECORD, one per non-empty bucket
+    """
+    buckets = timestamps_ns // (width_s * 1_000_000_000)
+    if len(buckets) == 0:
+        return np.empty(0, dtype=RECORD)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+    records = np.empty(len(starts), dtype=RECORD)
+    records['bucket'] = buckets[starts]
+    records['count'] = np.diff(np.r_[starts, len(buckets)])
+    records['sum'] = np.add.reduceat(power, starts)
+    records['min'] = np.minimum.reduceat(power, starts)
+    records['max'] = np.maximum.reduceat(power, starts)
+    return records
+
+class PowerPyramid:
+    """Append-only multi-resolution store of aggregated power."""
+
+    def __init__(self, path=PYRAMID_DIR):
+        """
+        Args:
+            path (str): Directory holding one file per level
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _level_path(self, level):
+        return os.path.join(self.path, f"{level}.bin")
+
+    @property
+    def last_timestamp(self):
+        """Time (ns) of the newest sample in the pyramid, or None."""
+        try:
+            with open(os.path.join(self.path, STATE_FILE), 'r') as f:
+                return json.load(f)['last_timestamp']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _set_last_timestamp(self, value):
+        state_path = os.path.join(self.path, STATE_FILE)
+        with open(f"{state_path}.tmp", 'w') as f:
+            json.dump({'last_timestamp': int(value)}, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    def _write_journal(self, writes, last):
+        """Record pending writes, level -> (byte offset, records), and the new last time."""
+        journal_path = os.path.join(self.path, JOURNAL_FILE)
+        arrays = {'last': last}
+        for level, (offset, records) in writes.items():
+            arrays[f"{level}_offset"] = offset
+            arrays[f"{level}_records"] = records
+        with open(f"{journal_path}.tmp", 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{journal_path}.tmp", journal_path)
+
+    def _replay(self):
+        """Apply the pending writes, if any; safe to repeat."""
+        journal_path = os.path.join(self.path, JOURNAL_FILE)
+        try:
+            with np.load(journal_path) as journal:
+                last = int(journal['last'])
+                writes = {level: (int(journal[f"{level}_offset"]), journal[f"{level}_records"])
+                          for level in LEVELS if f"{level}_offset" in journal.files}
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            # Torn journal: the writes it describes never started
+            logger.warning(f"Discarding unreadable pyramid journal {journal_path}: {e}")
+            os.remove(journal_path)
+            return
+        for level, (offset, records) in writes.items():
+            path = self._level_path(level)
+            mode = 'r+b' if os.path.exists(path) else 'w+b'
+            with open(path, mode) as f:
+                f.seek(offset)
+                f.write(records.tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+        self._set_last_timestamp(last)
+        os.remove(journal_path)
+
+    def read_level(self, level):
+        """Memory-map all records of a level (read-only)."""
+        path = self._level_path(level)
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD.itemsize:
+            return np.empty(0, dtype=RECORD)
+        n_records = os.path.getsize(path) // RECORD.itemsize
+        return np.memmap(path, dtype=RECORD, mode='r', shape=(n_records,))
+
+    def append(self, timestamps_ns, power, newer_only=False):
+        """
+        Add samples to the pyramid.
+
+        The collector passes exactly the samples it has not added yet, which
+        may repeat the timestamp of the last one (Home Assistant keeps
+        ``last_updated`` while the reading is steady). Files read again
+        from disk use ``newer_only`` instead.
+
+        Args:
+            timestamps_ns (np.ndarray): Sample times in nanoseconds (UTC)
+            power (np.ndarray): Power readings
+            newer_only (bool): Skip samples at or before the last sample
+                already in the pyramid
+
+        Returns:
+            int: Number of samples added
+        """
+        self._replay()
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        power = np.asarray(power, dtype=np.float64)
+        order = np.argsort(timestamps_ns, kind='stable')
+        timestamps_ns, power = timestamps_ns[order], power[order]
+
+        last = self.last_timestamp
+        if newer_only and last is not None:
+            keep = timestamps_ns > last
+            timestamps_ns, power = timestamps_ns[keep], power[keep]
+        if len(timestamps_ns) == 0:
+            return 0
+
+        writes = {}
+        for level, width in LEVELS.items():
+            records = aggregate(timestamps_ns, power, width)
+            path = self._level_path(level)
+            size = 0
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(0, os.SEEK_END)
+                    size = f.tell() - f.tell() % RECORD.itemsize
+                    if size:
+                        # Merge into the last stored bucket if it continues
+                        f.seek(size - RECORD.itemsize)
+                        tail = np.frombuffer(f.read(RECORD.itemsize), dtype=RECORD).copy()
+                        if tail['bucket'][0] == records['bucket'][0]:
+                            records['count'][0] += tail['count'][0]
+                            records['sum'][0] += tail['sum'][0]
+                            records['min'][0] = min(records['min'][0], tail['min'][0])
+                            records['max'][0] = max(records['max'][0], tail['max'][0])
+                            size -= RECORD.itemsize
+            writes[level] = (size, records)
+
+        newest = int(timestamps_ns[-1]) if last is None else max(int(last), int(timestamps_ns[-1]))
+        self._write_journal(writes, newest)
+        self._replay()
+        return len(timestamps_ns)
+
+    def choose_level(self, start_ns, end_ns, points):
+        """
+        Pick the coarsest level that still gives the requested resolution.
+
+        Args:
+            start_ns (int): Range start in nanoseconds
+            end_ns (int): Range end in nanoseconds
+            points (int): Number of points the chart can show
+
+        Returns:
+            str: Level name
+        """
+        needed = (end_ns - start_ns) / 1e9 / max(points, 1)
+        chosen = next(iter(LEVELS))
+        for level, width in LEVELS.items():
+            if width <= needed:
+                chosen = level
+        return chosen
+
+    def query(self, start=None, end=None, points=1000, level=None):
+        """
+        Get min, mean and max power for a time range.
+
+        Args:
+            start: Range start (defaults to the first bucket)
+            end: Range end (defaults to the last bucket)
+            points (int): Number of points the chart can show
+            level (str): Force a level instead of choosing one
+
+        Returns:
+            tuple: (level name, DataFrame with timestamp, min, mean, max and count)
+        """
+        finest = self.read_level(next(iter(LEVELS)))
+        if len(finest) == 0:
+            raise PyramidError("Pyramid is empty, add data first")
+
+        start_ns = _to_ns(start) if start is not None else int(finest['bucket'][0]) * 1_000_000_000
+        end_ns = _to_ns(end) if end is not None else (int(finest['bucket'][-1]) + 1) * 1_000_000_000
+        if end_ns <= start_ns:
+            raise PyramidError("Range end must be after range start")
+
+        level = level or self.choose_level(start_ns, end_ns, points)
+        if level not in LEVELS:
+            raise PyramidError(f"Unknown level '{level}', use one of {list(LEVELS)}")
+        width_ns = LEVELS[level] * 1_000_000_000
+
+        records = self.read_level(level)
+        lo = np.searchsorted(records['bucket'], start_ns // width_ns, side='left')
+        hi = np.searchsorted(records['bucket'], (end_ns - 1) // width_ns, side='right')
+        selected = np.array(records[lo:hi])
+
+        return level, pd.DataFrame({
+            'timestamp': pd.to_datetime(selected['bucket'] * width_ns, utc=True),
+            'min': selected['min'],
+            'mean': selected['sum'] / selected['count'],
+            'max': selected['max'],
+            'count': selected['count'],
+        })
+
+def _to_ns(value):
+    """Convert a timestamp to nanoseconds since the epoch (UTC)."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return int(timestamp.value)
+
+def update_from_files(pyramid, data_dir="data/raw"):
+    """
+    Add samples from the power data files that are not in the pyramid yet.
+
+    Args:
+        pyramid (PowerPyramid): Target pyramid
+        data_dir (str): Directory containing power_data_*.csv files
+
+    Returns:
+        int: Number of samples added
+    """
+    # Files not modified since the last sample cannot contain newer ones
+    data = load_power_data(data_dir, modified_after=pyramid.last_timestamp)
+    return pyramid.append(nanoseconds(data['timestamp']), data['power'].to_numpy(dtype=float), newer_only=True)
+
+def main():
+    """Update or rebuild the pyramid from the collected power data."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Build the multi-resolution power pyramid.")
+    parser.add_argument('--rebuild', action='store_true', help="Discard the pyramid and rebuild it")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        shutil.rmtree(PYRAMID_DIR, ignore_errors=True)
+    added = update_from_files(PowerPyramid())
+    logger.info(f"Added {added} samples to the pyramid in {PYRAMID_DIR}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Gap detection and alignment of power samples to a fixed time grid.
+
+Samples are stored at Home Assistant's ``last_updated`` time, so they arrive
+at irregular intervals, and collector outages leave holes in the series.
+Event detection compares consecutive samples, so a difference taken across
+a hole is not an appliance switching but whatever happened during the outage.
+
+A gap is marked on the first sample after a break in continuity:
+
+- the collector writes a ``gap`` column, True on the first sample of a run
+  and after polls failed for longer than ``max_gap`` seconds;
+- samples of older files without the column break where consecutive
+  timestamps are more than ``max_gap`` seconds apart, unless the collector
+  kept polling through the quiet period. ``last_updated`` only moves when
+  the reading changes, so a steady load repeats the same timestamp (or the
+  same value) until the next change, which is not an outage.
+
+Aligned series hold one value per ``step`` seconds, filled from the samples
+with the configured policy ('ffill' holds the last reading, as Home Assistant
+does, 'linear' interpolates between readings). Grid points inside a gap are
+NaN, and points inside or just after a gap carry ``gap`` True, so the same
+detection code handles raw and aligned series.
+
+:class:`StreamResampler` aligns samples one at a time for consumers that see
+samples as they are collected, such as the context kept by
+:class:`inference.LiveClassifier`. Its results match :func:`resample` except
+that the points inside a gap are collapsed into one NaN point.
+"""
+
+import math
+import numpy as np
+import pandas as pd
+
+FILL_POLICIES = ('ffill', 'linear')
+MAX_GAP = 120
+
+class ResampleError(Exception):
+    """Raised when samples cannot be aligned."""
+    pass
+
+def _check_fill(fill):
+    if fill not in FILL_POLICIES:
+        raise ResampleError(f"Unknown fill policy {fill!r}, expected one of {', '.join(FILL_POLICIES)}")
+
+def nanoseconds(timestamps):
+    """Timestamps as int64 nanoseconds whatever the resolution of the column."""
+    return pd.DatetimeIndex(timestamps).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+def find_gaps(timestamps, max_gap=MAX_GAP, gap=None, power=None):
+    """
+    Mark the samples that follow a break in continuity.
+
+    The timestamp rule does not apply after a sample that repeats the
+    timestamp of the one before it, or when the reading did not change:
+    both mean the collector was polling a steady load.
+
+    Args:
+        timestamps (np.ndarray): Sorted sample timestamps (int64 ns)
+        max_gap (float): Seconds between samples that count as a gap, None
+            to rely on explicit markers only
+        gap (array-like): Explicit markers from the collector; samples with
+            a missing marker fall back to the timestamp rule
+        power (np.ndarray): Power readings of the samples, if known
+
+    Returns:
+        np.ndarray: Boolean mask, True on the first sample after each gap
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    breaks = np.zeros(len(timestamps), dtype=bool)
+    if max_gap is not None and len(timestamps) > 1:
+        spacing = np.diff(timestamps)
+        repeated = np.r_[False, spacing[:-1] == 0]
+        breaks[1:] = (spacing > max_gap * 1e9) & ~repeated
+        if power is not None:
+            breaks[1:] &= np.diff(np.asarray(power, dtype=float)) != 0
+    if gap is not None:
+        explicit = pd.Series(gap, dtype=object)
+        known = explicit.notna().to_numpy()
+        breaks[known] = explicit[known].astype(bool).to_numpy()
+    return breaks
+
+def data_gaps(data, max_gap=MAX_GAP):
+    """
+    :func:`find_gaps` on a power DataFrame.
+
+    Args:
+        data (pd.DataFrame): timestamp and power columns, optionally gap
+        max_gap (float): Seconds between samples that count as a gap
+
+    Returns:
+        np.ndarray: Boolean mask, True on the first sample after each gap
+    """
+    timestamps = nanoseconds(data['timestamp'])
+    return find_gaps(timestamps, max_gap, data['gap'] if 'gap' in data.columns else None,
+                     data['power'].to_numpy(dtype=float))
+
+def segment_bounds(breaks):
+    """
+    First and one-past-last index of the gap-free segment of each sample.
+
+    Args:
+        breaks (np.ndarray): Boolean mask from :func:`find_gaps`
+
+    Returns:
+        tuple: (start, end) index arrays, one entry per sample
+    """
+    breaks = np.asarray(breaks, dtype=bool)
+    n = len(breaks)
+    index = np.arange(n)
+    starts = breaks.copy()
+    if n:
+        starts[0] = True
+    start = np.maximum.accumulate(np.where(starts, index, 0))
+    # The end of a segment is the start of the next one
+    next_start = np.where(starts, index, n)
+    end = np.minimum.accumulate(np.r_[next_start[1:], n][::-1])[::-1]
+    return start, end
+
+def resample(timestamps, power, step, fill='ffill', max_gap=MAX_GAP, breaks=None):
+    """
+    Align samples to a grid of ``step`` seconds.
+
+    The grid starts at the first multiple of ``step`` at or after the first
+    sample and ends at the last sample. A grid point falls inside a gap when
+    the sample following it starts a gap; its value is NaN.
+
+    Args:
+        timestamps (np.ndarray): Sorted sample timestamps (int64 ns)
+        power (np.ndarray): Power readings
+        step (float): Seconds between grid points
+        fill (str): 'ffill' or 'linear'
+        max_gap (float): Seconds between samples that count as a gap
+        breaks (np.ndarray): Precomputed gap mask of the samples
+
+    Returns:
+        tuple: (grid timestamps as int64 ns, values, gap mask of the grid)
+    """
+    _check_fill(fill)
+    if step <= 0:
+        raise ResampleError(f"Resampling step must be positive, got {step}")
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    power = np.asarray(power, dtype=float)
+    if breaks is None:
+        breaks = find_gaps(timestamps, max_gap)
+    breaks = np.asarray(breaks, dtype=bool)
+    n = len(timestamps)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=bool)
+
+    step_ns = int(round(step * 1e9))
+    first = -(-int(timestamps[0]) // step_ns) * step_ns
+    grid = np.arange(first, int(timestamps[-1]) + 1, step_ns, dtype=np.int64)
+
+    # Last sample at or before each grid point, and the one after it
+    prev = np.searchsorted(timestamps, grid, side='right') - 1
+    following = np.minimum(prev + 1, n - 1)
+    inside = (grid > timestamps[prev]) & (prev + 1 < n) & breaks[following]
+
+    if fill == 'ffill':
+        values = power[prev]
+    else:
+        span = (timestamps[following] - timestamps[prev]).astype(float)
+        weight = np.divide((grid - timestamps[prev]).astype(float), span,
+                           out=np.zeros(len(grid)), where=span > 0)
+        values = power[prev] + weight * (power[following] - power[prev])
+    values = np.where(inside, np.nan, values)
+
+    # A grid point breaks continuity when it is inside a gap or a gap
+    # started among the samples since the previous grid point
+    seen = np.cumsum(breaks)[prev]
+    gap = inside | (np.diff(np.r_[0, seen]) > 0)
+    return grid, values, gap
+
+def align(data, step, fill='ffill', max_gap=MAX_GAP):
+    """
+    Align a power DataFrame to a grid of ``step`` seconds.
+
+    Args:
+        data (pd.DataFrame): timestamp and power columns, optionally gap
+        step (float): Seconds between grid points
+        fill (str): 'ffill' or 'linear'
+        max_gap (float): Seconds between samples that count as a gap
+
+    Returns:
+        pd.DataFrame: timestamp, power and gap columns on the grid
+    """
+    timestamps = nanoseconds(data['timestamp'])
+    grid, values, gap = resample(timestamps, data['power'].to_numpy(dtype=float), step, fill,
+                                 breaks=data_gaps(data, max_gap))
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(grid, utc=True),
+        'power': values,
+        'gap': gap,
+    })
+
+def prepare(data, config):
+    """
+    Power data ready for event detection under the configured resampling.
+
+    Args:
+        data (pd.DataFrame): Output of :func:`data_loader.load_power_data`
+        config (dict): Configuration dictionary
+
+    Returns:
+        pd.DataFrame: timestamp, power and gap columns, aligned to the grid
+            when a resampling step is configured
+    """
+    settings = config.get('resampling') or {}
+    max_gap = settings.get('max_gap', MAX_GAP)
+    step = settings.get('step')
+    if step:
+        return align(data, step, settings.get('fill', 'ffill'), max_gap)
+    return pd.DataFrame({
+        'timestamp': data['timestamp'].reset_index(drop=True),
+        'power': data['power'].to_numpy(dtype=float),
+        'gap': data_gaps(data, max_gap),
+    })
+
+class StreamResampler:
+    """
+    Incremental :func:`resample` for samples arriving in time order.
+
+    A grid point is emitted once the first sample after it has arrived, so
+    the output trails the input by at most one sample. Unlike
+    :func:`resample`, the grid points inside a gap are collapsed into the
+    first one (NaN, gap True), so a sample after a long outage costs one
+    step rather than one per missed grid point.
+
+    Args:
+        step (float): Seconds between grid points
+        fill (str): 'ffill' or 'linear'
+        max_gap (float): Seconds between samples that count as a gap, None
+            to rely on explicit markers only
+    """
+
+    def __init__(self, step, fill='ffill', max_gap=MAX_GAP):
+        _check_fill(fill)
+        if step <= 0:
+            raise ResampleError(f"Resampling step must be positive, got {step}")
+        self.step_ns = int(round(step * 1e9))
+        self.fill = fill
+        self.max_gap_ns = None if max_gap is None else max_gap * 1e9
+        self.previous = None  # (timestamp ns, power) of the last sample
+        self.next_point = None
+        self.pending_break = False  # A gap started since the last emitted point
+
+    def add(self, timestamp, power, gap=None):
+        """
+        Add a sample.
+
+        Args:
+            timestamp (int): Sample time (int64 ns)
+            power (float): Power reading
+            gap (bool): Explicit gap marker, None to use ``max_gap``
+
+        Returns:
+            list: (timestamp ns, value, gap) of each completed grid point
+        """
+        timestamp = int(timestamp)
+        if self.previous is None:
+            self.previous = (timestamp, float(power))
+            self.next_point = -(-timestamp // self.step_ns) * self.step_ns
+            self.pending_break = bool(gap)
+            return []
+
+        prev_time, prev_power = self.previous
+        if timestamp < prev_time:
+            raise ResampleError("Samples must arrive in time order")
+        if gap is None:
+            is_break = self.max_gap_ns is not None and timestamp - prev_time > self.max_gap_ns
+        else:
+            is_break = bool(gap)
+
+        points = []
+        while self.next_point < timestamp:
+            point = self.next_point
+            if point > prev_time and is_break:
+                # The rest of the grid up to this sample is inside the gap too
+                points.append((point, math.nan, True))
+                self.pending_break = False
+                self.next_point = -(-timestamp // self.step_ns) * self.step_ns
+                break
+            if self.fill == 'linear' and timestamp > prev_time:
+                value = prev_power + (point - prev_time) / (timestamp - prev_time) * (power - prev_power)
+            else:
+                value = prev_power
+            points.append((point, value, self.pending_break))
+            self.pending_break = False
+            self.next_point += self.step_ns
+
+        self.previous = (timestamp, float(power))
+        self.pending_break = self.pending_break or is_break
+        return points
@@ -0,0 +1,125 @@
+"""
+Drift-free sampling schedule and background file writing for the collector.
+
+:class:`TickScheduler` targets absolute tick times on the monotonic clock
+(``start + n * interval``), so request latency and processing time do not
+shift later samples. Ticks that have already passed when the loop gets back
+to the scheduler are skipped and counted instead of being sampled late in a
+burst. :class:`BackgroundWriter` runs file saves on a separate thread so a
+slow flush does not delay the next sample.
+"""
+
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class TickScheduler:
+    """
+    Wait for evenly spaced ticks on the monotonic clock.
+
+    Args:
+        interval (float): Seconds between ticks
+        clock (callable): Monotonic clock returning seconds
+        sleep (callable): Sleep function taking seconds
+    """
+
+    def __init__(self, interval, clock=time.monotonic, sleep=time.sleep):
+        if interval <= 0:
+            raise ValueError(f"Tick interval must be positive, got {interval}")
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.tick = 0
+        self.missed = 0
+
+    def next_time(self):
+        """Monotonic time of the next tick."""
+        return self.start + self.tick * self.interval
+
+    def wait(self):
+        """
+        Sleep until the next tick.
+
+        The first call returns immediately and starts the schedule. If more
+        than one tick has passed since the previous call, all but the most
+        recent are skipped and that one is served immediately.
+
+        Returns:
+            tuple: (ticks missed since the previous call, lateness of this
+                tick in seconds)
+        """
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+            self.tick = 1
+            return 0, 0.0
+
+        missed = 0
+        target = self.next_time()
+        if now >= target + self.interval:
+            # Skip every tick that can no longer be served on time
+            missed = int((now - target) // self.interval)
+            self.tick += missed
+            self.missed += missed
+            target = self.next_time()
+
+        if target > now:
+            self.sleep(target - now)
+        self.tick += 1
+        return missed, max(self.clock() - target, 0.0)
+
+    def set_interval(self, interval):
+        """Change the interval, keeping the phase of the current tick."""
+        if interval <= 0:
+            raise ValueError(f"Tick interval must be positive, got {interval}")
+        if self.start is not None:
+            self.start = self.next_time()
+            self.tick = 0
+        self.interval = interval
+
+class BackgroundWriter:
+    """
+    Run write jobs in order on a background thread.
+
+    Args:
+        max_pending (int): Maximum queued jobs before submit blocks
+    """
+
+    def __init__(self, max_pending=4):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="background-writer", daemon=True)
+        self.failures = 0
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread.start()
+        return self
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a job; blocks only if max_pending jobs are already waiting."""
+        self._queue.put((fn, args, kwargs))
+
+    def pending(self):
+        """Number of queued jobs."""
+        return self._queue.qsize()
+
+    def stop(self, timeout=None):
+        """Finish all queued jobs and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            fn, args, kwargs = job
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Background write failed: {e}")
@@ -0,0 +1,340 @@
+"""
+Configuration loading shared by all entry points.
+
+``config.yaml`` is read once per process and cached until the file changes.
+Values of the form ``${VAR}`` or ``${VAR:-default}`` are replaced by
+environment variables, the legacy overrides (``HA_URL``, ``MIN_PEAK_DISTANCE``,
+...) are applied, and every known setting is converted to its type and
+validated, so a typo fails at startup with a clear message instead of deep
+inside the pipeline.
+
+:class:`ConfigWatcher` lets a long-running process pick up edits to
+``config.yaml`` without a restart.
+"""
+
+import os
+import re
+import copy
+import time
+import logging
+import threading
+import yaml
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = "config.yaml"
+
+_VARIABLE = re.compile(r'\$\{(\w+)(?::-([^}]*))?\}')
+
+# Environment variables overriding a setting even if config.yaml sets it. A
+# hot-reloadable setting overridden this way is pinned: edits to config.yaml
+# do not change it, see pinned_settings()
+ENV_OVERRIDES = {
+    'HA_URL': ('home_assistant', 'url'),
+    'HA_TOKEN': ('home_assistant', 'token'),
+    'HA_ENTITY_ID': ('home_assistant', 'entity_id'),
+    'EVENT_THRESHOLD': ('event_detection', 'threshold'),
+    'MIN_PEAK_DISTANCE': ('event_detection', 'min_peak_distance'),
+    'WINDOW_SIZE': ('event_detection', 'window_size'),
+    'SAVE_INTERVAL': ('data_collection', 'save_interval'),
+    'MAX_SAMPLES': ('data_collection', 'max_samples'),
+    'COLLECTION_INTERVAL': ('data_collection', 'interval'),
+    'N_APPLIANCES': ('nilm_model', 'n_appliances'),
+}
+
+def _positive(value):
+    return value > 0
+
+def _at_least_one(value):
+    return value >= 1
+
+def _probability(value):
+    return 0 < value < 1
+
+def _fill_policy(value):
+    return value in ('ffill', 'linear')
+
+# (section, key) -> (type, check); checks must hold for non-null values
+SCHEMA = {
+    ('home_assistant', 'url'): (str, None),
+    ('home_assistant', 'token'): (str, None),
+    ('home_assistant', 'entity_id'): (str, None),
+    ('data_collection', 'save_interval'): (int, _at_least_one),
+    ('data_collection', 'data_dir'): (str, None),
+    ('data_collection', 'max_samples'): (int, _at_least_one),
+    ('data_collection', 'interval'): (float, _positive),
+    ('event_detection', 'threshold'): (float, _positive),
+    ('event_detection', 'min_peak_distance'): (int, _at_least_one),
+    ('event_detection', 'window_size'): (int, _at_least_one),
+    ('nilm_model', 'n_appliances'): (int, _at_least_one),
+    ('nilm_model', 'model_dir'): (str, None),
+    ('inference', 'enabled'): (bool, None),
+    ('inference', 'batch_size'): (int, _at_least_one),
+    ('inference', 'max_delay'): (float, _positive),
+    ('live_channel', 'enabled'): (bool, None),
+    ('live_channel', 'path'): (str, None),
+    ('live_channel', 'retention_hours'): (float, _positive),
+    ('baseload', 'enabled'): (bool, None),
+    ('baseload', 'window_hours'): (float, _positive),
+    ('baseload', 'quantile'): (float, _probability),
+    ('baseload', 'anomaly_quantile'): (float, _probability),
+    ('baseload', 'anomaly_minutes'): (float, _positive),
+    ('resampling', 'step'): (float, _positive),
+    ('resampling', 'fill'): (str, _fill_policy),
+    ('resampling', 'max_gap'): (float, _positive),
+    ('visualization', 'plot_dir'): (str, None),
+    ('visualization', 'dpi'): (int, _positive),
+}
+
+# Settings the collector applies while running; others need a restart
+HOT_RELOADABLE = {
+    ('event_detection', 'threshold'),
+    ('data_collection', 'interval'),
+    ('data_collection', 'save_interval'),
+    ('data_collection', 'max_samples'),
+}
+
+class ConfigError(Exception):
+    """Raised when the configuration cannot be loaded or is invalid."""
+    pass
+
+def _interpolate(value, missing):
+    """Replace ${VAR} and ${VAR:-default} in all strings of a parsed document."""
+    if isinstance(value, dict):
+        return {k: _interpolate(v, missing) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_interpolate(v, missing) for v in value]
+    if not isinstance(value, str) or '${' not in value:
+        return value
+
+    def substitute(match):
+        name, default = match.group(1), match.group(2)
+        if name in os.environ:
+            return os.environ[name]
+        if default is not None:
+            return default
+        missing.add(name)
+        return ''
+
+    whole = _VARIABLE.fullmatch(value.strip())
+    if whole:
+        name, default = whole.group(1), whole.group(2)
+        if name in os.environ:
+            # Environment values stay strings; the schema converts known settings
+            return os.environ[name] or None
+        if default is None:
+            missing.add(name)
+            return None
+        if not default.strip():
+            return None
+        # A default written in config.yaml gets its YAML type
+        try:
+            return yaml.safe_load(default)
+        except yaml.YAMLError:
+            return default
+    return _VARIABLE.sub(substitute, value)
+
+def _convert(value, kind):
+    """Convert a value to a schema type, accepting strings from the environment."""
+    if kind is bool:
+        if isinstance(value, str):
+            if value.lower() in ('1', 'true', 'yes', 'on'):
+                return True
+            if value.lower() in ('0', 'false', 'no', 'off'):
+                return False
+            raise ValueError(f"'{value}' is not a boolean")
+        return bool(value)
+    if kind is int:
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"{value} is not an integer")
+        return int(float(value)) if isinstance(value, str) else int(value)
+    if kind is float:
+        if isinstance(value, bool):
+            raise ValueError(f"{value} is not a number")
+        return float(value)
+    return str(value)
+
+def validate(config, require=()):
+    """
+    Convert known settings to their types and check their values.
+
+    Args:
+        config (dict): Parsed configuration, modified in place
+        require (iterable): 'section.key' names that must be set
+
+    Raises:
+        ConfigError: Listing every invalid or missing setting
+    """
+    problems = []
+    for (section, key), (kind, check) in SCHEMA.items():
+        values = config.get(section)
+        if not isinstance(values, dict) or values.get(key) is None:
+            continue
+        try:
+            values[key] = _convert(values[key], kind)
+        except (TypeError, ValueError) as e:
+            problems.append(f"{section}.{key}: {e}")
+            continue
+        if check and not check(values[key]):
+            problems.append(f"{section}.{key}: invalid value {values[key]!r}")
+
+    for name in require:
+        section, key = name.split('.', 1)
+        if (config.get(section) or {}).get(key) in (None, ''):
+            problems.append(f"{name}: required but not set")
+
+    if problems:
+        raise ConfigError("Invalid configuration:\n  " + "\n  ".join(problems))
+
+def read_config(path=CONFIG_PATH, require=()):
+    """
+    Read, interpolate and validate a configuration file without caching.
+
+    Args:
+        path (str): YAML file
+        require (iterable): 'section.key' names that must be set
+
+    Returns:
+        dict: Configuration
+    """
+    try:
+        with open(path, 'r') as f:
+            raw = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        raise ConfigError(f"{path} not found. Please create it first.")
+    except yaml.YAMLError as e:
+        raise ConfigError(f"Error parsing {path}: {e}")
+
+    missing = set()
+    config = _interpolate(raw, missing)
+    for variable, (section, key) in ENV_OVERRIDES.items():
+        if variable in os.environ:
+            config.setdefault(section, {})[key] = os.environ[variable]
+            missing.discard(variable)
+    if missing:
+        logger.debug(f"Unset configuration variables: {', '.join(sorted(missing))}")
+
+    validate(config, require)
+    return config
+
+# Cache: absolute path -> (mtime_ns, configuration)
+_cache = {}
+_cache_lock = threading.Lock()
+
+def load_config(path=CONFIG_PATH, require=()):
+    """
+    Load the configuration, reusing the parsed file while it is unchanged.
+
+    Args:
+        path (str): YAML file
+        require (iterable): 'section.key' names that must be set
+
+    Returns:
+        dict: A copy of the configuration that callers may modify
+    """
+    key = os.path.abspath(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise ConfigError(f"{path} not found. Please create it first.")
+
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, read_config(path))
+        with _cache_lock:
+            _cache[key] = cached
+
+    config = copy.deepcopy(cached[1])
+    validate(config, require)
+    return config
+
+def pinned_settings():
+    """
+    Hot-reloadable settings fixed by an environment override.
+
+    Returns:
+        dict: (section, key) -> name of the environment variable
+    """
+    return {
+        (section, key): variable
+        for variable, (section, key) in ENV_OVERRIDES.items()
+        if variable in os.environ and (section, key) in HOT_RELOADABLE
+    }
+
+def changed_settings(old, new):
+    """
+    List the (section, key) pairs whose values differ.
+
+    Returns:
+        list: Changed settings, sorted
+    """
+    changed = set()
+    for section in set(old) | set(new):
+        old_values, new_values = old.get(section), new.get(section)
+        if not isinstance(old_values, dict) or not isinstance(new_values, dict):
+            if old_values != new_values:
+                changed.add((section, None))
+            continue
+        for key in set(old_values) | set(new_values):
+            if old_values.get(key) != new_values.get(key):
+                changed.add((section, key))
+    return sorted(changed, key=lambda item: (item[0], item[1] or ''))
+
+class ConfigWatcher:
+    """
+    Detect edits to the configuration file from a long-running loop.
+
+    :meth:`check` is cheap enough to call on every iteration: it only stats
+    the file once per ``interval`` seconds and reloads it when its
+    modification time changes. Invalid edits are logged and ignored.
+
+    Args:
+        config (dict): Configuration currently in use
+        path (str): YAML file
+        interval (float): Minimum seconds between file checks
+        require (iterable): 'section.key' names that must be set
+    """
+
+    def __init__(self, config, path=CONFIG_PATH, interval=2.0, require=()):
+        self.config = config
+        self.path = path
+        self.interval = interval
+        self.require = tuple(require)
+        self._last_check = time.monotonic()
+        try:
+            self._mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._mtime = None
+        for (section, key), variable in sorted(pinned_settings().items()):
+            logger.warning(f"{section}.{key} is set by the {variable} environment variable, "
+                           f"edits to it in {path} are ignored until it is unset")
+
+    def check(self):
+        """
+        Reload the configuration if the file changed.
+
+        Returns:
+            tuple: (new configuration, list of changed (section, key)), or
+                None if nothing changed or the new file is invalid
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.interval:
+            return None
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+
+        try:
+            new_config = load_config(self.path, self.require)
+        except ConfigError as e:
+            logger.error(f"Ignoring changed {self.path}: {e}")
+            return None
+        changes = changed_settings(self.config, new_config)
+        self.config = new_config
+        return (new_config, changes) if changes else None
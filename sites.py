@@ -0,0 +1,131 @@
+"""
+Multi-site (multi-household) layout.
+
+Without a ``sites`` section in ``config.yaml`` everything works as a single
+site stored directly in ``data/raw``. With one, a single collector process
+polls every listed Home Assistant instance and each site gets its own
+storage shard::
+
+    data/raw/<site>/                   power, events and runs files
+    data/processed/<site>/pyramid/     overview pyramid
+    data/processed/<site>/rollups/     energy rollups
+    data/processed/<site>/baseload.json baseload estimates and anomalies
+    data/processed/<site>/sketches/    hourly distribution sketches
+    data/live_<site>.db                live channel
+
+The web app selects a shard with the ``site`` query parameter.
+"""
+
+import os
+import re
+import copy
+
+SITE_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+RAW_DIR = "data/raw"
+PROCESSED_DIR = "data/processed"
+LIVE_PATH = "data/live.db"
+
+class SiteError(Exception):
+    """Raised when a site name or site configuration is invalid."""
+    pass
+
+def check_site_name(site):
+    """Raise SiteError unless the name is safe to use as a directory name."""
+    if not isinstance(site, str) or not SITE_NAME.match(site):
+        raise SiteError(f"Invalid site name {site!r}, use letters, digits, '-' and '_'")
+    return site
+
+def site_paths(site=None, raw_dir=RAW_DIR, live_path=LIVE_PATH):
+    """
+    Storage locations of a site.
+
+    Args:
+        site (str): Site name, None for the single-site layout
+        raw_dir (str): Base directory of the raw data files
+        live_path (str): Live channel database of the single-site layout
+
+    Returns:
+        dict: raw, pyramid, rollups, baseload, sketches and live paths
+    """
+    if site is None:
+        return {
+            'raw': raw_dir,
+            'pyramid': os.path.join(PROCESSED_DIR, "pyramid"),
+            'rollups': os.path.join(PROCESSED_DIR, "rollups"),
+            'baseload': os.path.join(PROCESSED_DIR, "baseload.json"),
+            'sketches': os.path.join(PROCESSED_DIR, "sketches"),
+            'live': live_path,
+        }
+    check_site_name(site)
+    base, ext = os.path.splitext(live_path)
+    return {
+        'raw': os.path.join(raw_dir, site),
+        'pyramid': os.path.join(PROCESSED_DIR, site, "pyramid"),
+        'rollups': os.path.join(PROCESSED_DIR, site, "rollups"),
+        'baseload': os.path.join(PROCESSED_DIR, site, "baseload.json"),
+        'sketches': os.path.join(PROCESSED_DIR, site, "sketches"),
+        'live': f"{base}_{site}{ext}",
+    }
+
+def configured_paths(config, site=None):
+    """
+    :func:`site_paths` under the configured ``data_collection.data_dir`` and
+    ``live_channel.path``.
+
+    Args:
+        config (dict): Configuration
+        site (str): Site name, None for the single-site layout
+
+    Returns:
+        dict: raw, pyramid, rollups, baseload, sketches and live paths
+    """
+    return site_paths(site, (config.get('data_collection') or {}).get('data_dir') or RAW_DIR,
+                      (config.get('live_channel') or {}).get('path') or LIVE_PATH)
+
+def configured_sites(config):
+    """
+    Per-site configurations from the ``sites`` section.
+
+    Each entry needs a ``name`` and may override ``url``, ``token`` and
+    ``entity_id`` of the ``home_assistant`` section.
+
+    Args:
+        config (dict): Configuration
+
+    Returns:
+        list: (site name, site configuration) pairs; empty in single-site mode
+    """
+    entries = config.get('sites') or []
+    if not isinstance(entries, list):
+        raise SiteError("'sites' must be a list of sites")
+
+    result = []
+    seen = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise SiteError(f"Invalid site entry {entry!r}")
+        name = check_site_name(entry.get('name'))
+        if name in seen:
+            raise SiteError(f"Site {name} is listed twice")
+        seen.add(name)
+
+        site_config = copy.deepcopy(config)
+        site_config.pop('sites', None)
+        for key in ('url', 'token', 'entity_id'):
+            if entry.get(key):
+                site_config['home_assistant'][key] = entry[key]
+        missing = [key for key in ('url', 'token', 'entity_id') if not site_config['home_assistant'].get(key)]
+        if missing:
+            raise SiteError(f"Site {name} has no {', '.join(missing)}")
+
+        result.append((name, site_config))
+    return result
+
+def list_sites(raw_dir=RAW_DIR):
+    """Names of the site shards present in the raw data directory."""
+    if not os.path.isdir(raw_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(raw_dir)
+        if SITE_NAME.match(name) and os.path.isdir(os.path.join(raw_dir, name))
+    )
@@ -0,0 +1,423 @@
+"""
+Mergeable distribution sketches of power and event sizes per time partition.
+
+Each hour of data is summarised by a histogram over fixed, logarithmically
+spaced bins (the DDSketch layout): a value ``x`` with ``|x| >= 1`` falls into
+bin ``ceil(log(|x|) / log(GAMMA))`` on its side of zero, so every bin spans
+the same relative width and any quantile read back from the bins is within
+``RELATIVE_ACCURACY`` of the true value. Because the bins are fixed, sketches
+of different hours merge by adding their counts. A distribution over any time
+range therefore costs one pass over its partitions instead of over the
+samples, and a histogram with linear bins is derived from the merged sketch.
+
+Sketches are stored like the power pyramid: one flat binary file per series
+with one fixed-size record per hour, appended in place by the collector at
+every flush. Each append is first written to a journal next to the series
+file and replayed if it was interrupted, so the records and ``state.json``
+always change together.
+
+Example:
+    python sketches.py            # add new samples and events from data/raw
+    python sketches.py --rebuild  # rebuild from scratch
+"""
+
+import os
+import glob
+import json
+import math
+import shutil
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from data_loader import load_power_data, parse_timestamps
+from resample import nanoseconds
+
+logger = logging.getLogger(__name__)
+
+SKETCH_DIR = "data/processed/sketches"
+STATE_FILE = "state.json"
+JOURNAL_SUFFIX = ".journal"
+PARTITION_SECONDS = 3600
+
+# Series name -> what it summarises
+SERIES = {
+    'power': 'power samples',
+    'power_change': 'power change of detected events',
+}
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1.0  # Values closer to zero share the zero bin
+MAX_VALUE = 1e6
+SIDE_BINS = int(math.ceil(math.log(MAX_VALUE) / math.log(GAMMA))) + 1
+N_BINS = 2 * SIDE_BINS + 1
+ZERO_BIN = SIDE_BINS
+
+RECORD = np.dtype([
+    ('partition', '<i8'),
+    ('count', '<i8'),
+    ('sum', '<f8'),
+    ('min', '<f8'),
+    ('max', '<f8'),
+    ('bins', '<u4', (N_BINS,)),
+])
+
+class SketchError(Exception):
+    """Raised when sketches cannot be built or queried."""
+    pass
+
+def bin_index(values):
+    """Bin of each value in the fixed logarithmic layout."""
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    k = np.ceil(np.log(np.maximum(magnitude, MIN_VALUE)) / math.log(GAMMA)).astype(np.int64)
+    k = np.clip(k, 0, SIDE_BINS - 1)
+    index = np.where(values > 0, ZERO_BIN + 1 + k, ZERO_BIN - 1 - k)
+    return np.where(magnitude < MIN_VALUE, ZERO_BIN, index)
+
+def bin_values():
+    """Representative value of every bin, within RELATIVE_ACCURACY of its contents."""
+    k = np.arange(SIDE_BINS)
+    positive = 2 * GAMMA ** k / (GAMMA + 1)
+    return np.concatenate([-positive[::-1], [0.0], positive])
+
+_BIN_VALUES = bin_values()
+
+class Sketch:
+    """
+    Distribution summary merged from one or more partitions.
+
+    Args:
+        bins (np.ndarray): Count per bin, length N_BINS
+        count (int): Number of values
+        total (float): Sum of values
+        minimum (float): Smallest value
+        maximum (float): Largest value
+    """
+
+    def __init__(self, bins=None, count=0, total=0.0, minimum=math.inf, maximum=-math.inf):
+        self.bins = np.zeros(N_BINS, dtype=np.int64) if bins is None else np.asarray(bins, dtype=np.int64)
+        self.count = int(count)
+        self.total = float(total)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+
+    @classmethod
+    def from_values(cls, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return cls()
+        return cls(np.bincount(bin_index(values), minlength=N_BINS), len(values),
+                   values.sum(), values.min(), values.max())
+
+    @classmethod
+    def from_records(cls, records):
+        """Merge stored partition records."""
+        if len(records) == 0:
+            return cls()
+        return cls(records['bins'].sum(axis=0, dtype=np.int64), records['count'].sum(),
+                   records['sum'].sum(), records['min'].min(), records['max'].max())
+
+    def merge(self, other):
+        """Sketch of the values of both sketches."""
+        return Sketch(self.bins + other.bins, self.count + other.count, self.total + other.total,
+                      min(self.minimum, other.minimum), max(self.maximum, other.maximum))
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantiles(self, qs):
+        """
+        Approximate quantiles.
+
+        Args:
+            qs (sequence): Quantiles between 0 and 1
+
+        Returns:
+            list: One value per quantile (None if the sketch is empty)
+        """
+        if not self.count:
+            return [None for _ in qs]
+        cumulative = np.cumsum(self.bins)
+        ranks = np.asarray(qs, dtype=float) * (self.count - 1)
+        index = np.searchsorted(cumulative, ranks, side='right')
+        values = np.clip(_BIN_VALUES[np.minimum(index, N_BINS - 1)], self.minimum, self.maximum)
+        return [float(v) for v in values]
+
+    def histogram(self, bins=50, value_range=None):
+        """
+        Histogram with equal-width bins derived from the sketch.
+
+        Each sketch bin is counted at its representative value, so bin edges
+        are accurate to RELATIVE_ACCURACY.
+
+        Args:
+            bins (int): Number of equal-width bins
+            value_range (tuple): (low, high), defaults to (minimum, maximum)
+
+        Returns:
+            tuple: (counts, edges) as from np.histogram
+        """
+        if value_range is None:
+            value_range = (self.minimum, self.maximum) if self.count else (0.0, 1.0)
+        nonzero = np.flatnonzero(self.bins)
+        values = np.clip(_BIN_VALUES[nonzero], self.minimum, self.maximum) if self.count else []
+        return np.histogram(values, bins=bins, range=value_range, weights=self.bins[nonzero])
+
+    def value_counts(self, decimals=1):
+        """Count per representative value of the non-empty bins."""
+        nonzero = np.flatnonzero(self.bins)
+        return {round(float(v), decimals): int(c) for v, c in zip(_BIN_VALUES[nonzero], self.bins[nonzero])}
+
+def partition_records(timestamps_ns, values, width_s=PARTITION_SECONDS):
+    """
+    Sketch sorted values per time partition.
+
+    Args:
+        timestamps_ns (np.ndarray): Sorted times in nanoseconds
+        values (np.ndarray): Values
+        width_s (int): Partition width in seconds
+
+    Returns:
+        np.ndarray: Records of dtype RECORD, one per non-empty partition
+    """
+    partitions = np.asarray(timestamps_ns, dtype=np.int64) // (width_s * 1_000_000_000)
+    values = np.asarray(values, dtype=float)
+    if len(partitions) == 0:
+        return np.empty(0, dtype=RECORD)
+    starts = np.flatnonzero(np.r_[True, partitions[1:] != partitions[:-1]])
+    group = np.cumsum(np.r_[True, partitions[1:] != partitions[:-1]]) - 1
+
+    records = np.zeros(len(starts), dtype=RECORD)
+    records['partition'] = partitions[starts]
+    records['count'] = np.diff(np.r_[starts, len(partitions)])
+    records['sum'] = np.add.reduceat(values, starts)
+    records['min'] = np.minimum.reduceat(values, starts)
+    records['max'] = np.maximum.reduceat(values, starts)
+    np.add.at(records['bins'], (group, bin_index(values)), 1)
+    return records
+
+class SketchStore:
+    """Append-only store of hourly sketches, one file per series."""
+
+    def __init__(self, path=SKETCH_DIR):
+        """
+        Args:
+            path (str): Directory holding one file per series
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _series_path(self, series):
+        if series not in SERIES:
+            raise SketchError(f"Unknown series '{series}', use one of {list(SERIES)}")
+        return os.path.join(self.path, f"{series}.bin")
+
+    def _state(self):
+        try:
+            with open(os.path.join(self.path, STATE_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def last_timestamp(self, series):
+        """Time (ns) of the newest value of a series, or None."""
+        return self._state().get(series)
+
+    def _set_last_timestamp(self, series, value):
+        state = self._state()
+        state[series] = int(value)
+        state_path = os.path.join(self.path, STATE_FILE)
+        with open(f"{state_path}.tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    def _write_journal(self, series, offset, records, last):
+        """Record a pending write of ``records`` at byte ``offset`` of a series."""
+        journal_path = self._series_path(series) + JOURNAL_SUFFIX
+        with open(f"{journal_path}.tmp", 'wb') as f:
+            np.savez(f, offset=offset, last=last, records=records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{journal_path}.tmp", journal_path)
+
+    def _replay(self, series):
+        """Apply the pending write of a series, if any; safe to repeat."""
+        path = self._series_path(series)
+        journal_path = path + JOURNAL_SUFFIX
+        try:
+            with np.load(journal_path) as journal:
+                offset, last, records = int(journal['offset']), int(journal['last']), journal['records']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            # Torn journal: the write it describes never started
+            logger.warning(f"Discarding unreadable sketch journal {journal_path}: {e}")
+            os.remove(journal_path)
+            return
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as f:
+            f.seek(offset)
+            f.write(records.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        self._set_last_timestamp(series, last)
+        os.remove(journal_path)
+
+    def read(self, series):
+        """Memory-map all records of a series (read-only)."""
+        path = self._series_path(series)
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD.itemsize:
+            return np.empty(0, dtype=RECORD)
+        n_records = os.path.getsize(path) // RECORD.itemsize
+        return np.memmap(path, dtype=RECORD, mode='r', shape=(n_records,))
+
+    def append(self, series, timestamps_ns, values, newer_only=False):
+        """
+        Add values to a series.
+
+        The collector passes exactly the values it has not added yet, which
+        may repeat the timestamp of the last one (Home Assistant keeps
+        ``last_updated`` while the reading is steady). Files read again
+        from disk use ``newer_only`` instead.
+
+        Args:
+            series (str): Series name from SERIES
+            timestamps_ns (np.ndarray): Times in nanoseconds (UTC)
+            values (np.ndarray): Values
+            newer_only (bool): Skip values at or before the last value
+                already in the series
+
+        Returns:
+            int: Number of values added
+        """
+        self._replay(series)
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        order = np.argsort(timestamps_ns, kind='stable')
+        timestamps_ns, values = timestamps_ns[order], values[order]
+
+        last = self.last_timestamp(series)
+        keep = np.isfinite(values)
+        if newer_only and last is not None:
+            keep &= timestamps_ns > last
+        timestamps_ns, values = timestamps_ns[keep], values[keep]
+        if len(timestamps_ns) == 0:
+            return 0
+
+        records = partition_records(timestamps_ns, values)
+        path = self._series_path(series)
+        size = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell() - f.tell() % RECORD.itemsize
+                if size:
+                    # Merge into the last stored partition if it continues
+                    f.seek(size - RECORD.itemsize)
+                    tail = np.frombuffer(f.read(RECORD.itemsize), dtype=RECORD).copy()
+                    if tail['partition'][0] == records['partition'][0]:
+                        records['count'][0] += tail['count'][0]
+                        records['sum'][0] += tail['sum'][0]
+                        records['min'][0] = min(records['min'][0], tail['min'][0])
+                        records['max'][0] = max(records['max'][0], tail['max'][0])
+                        records['bins'][0] += tail['bins'][0]
+                        size -= RECORD.itemsize
+
+        newest = int(timestamps_ns[-1]) if last is None else max(int(last), int(timestamps_ns[-1]))
+        self._write_journal(series, size, records, newest)
+        self._replay(series)
+        return len(timestamps_ns)
+
+    def query(self, series, start=None, end=None):
+        """
+        Merge the partitions overlapping a time range.
+
+        Partitions are whole hours, so the range is widened to hour
+        boundaries.
+
+        Args:
+            series (str): Series name from SERIES
+            start: Range start (defaults to the first partition)
+            end: Range end, exclusive (defaults to the last partition)
+
+        Returns:
+            Sketch: Merged sketch, empty if nothing is stored in the range
+        """
+        records = self.read(series)
+        width_ns = PARTITION_SECONDS * 1_000_000_000
+        lo = np.searchsorted(records['partition'], _to_ns(start) // width_ns, side='left') if start is not None else 0
+        hi = (np.searchsorted(records['partition'], (_to_ns(end) - 1) // width_ns, side='right')
+              if end is not None else len(records))
+        return Sketch.from_records(records[lo:hi])
+
+def _to_ns(value):
+    """Convert a timestamp to nanoseconds since the epoch (UTC)."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return int(timestamp.value)
+
+def summary(sketch, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """JSON-ready count, mean, range and quantiles of a sketch."""
+    return {
+        'count': sketch.count,
+        'mean': sketch.mean,
+        'min': sketch.minimum if sketch.count else None,
+        'max': sketch.maximum if sketch.count else None,
+        'quantiles': {str(q): v for q, v in zip(quantiles, sketch.quantiles(quantiles))},
+    }
+
+def update_from_files(store, data_dir="data/raw"):
+    """
+    Add samples and events from the data files that are not in the store yet.
+
+    Args:
+        store (SketchStore): Target store
+        data_dir (str): Directory containing power_data_*.csv and
+            device_events_*.csv files
+
+    Returns:
+        dict: Number of values added per series
+    """
+    # Files not modified since the last sample cannot contain newer ones
+    data = load_power_data(data_dir, modified_after=store.last_timestamp('power'))
+    added = {'power': store.append('power', nanoseconds(data['timestamp']),
+                                   data['power'].to_numpy(dtype=float), newer_only=True)}
+
+    frames = []
+    for file in sorted(glob.glob(os.path.join(data_dir, "device_events_*.csv"))):
+        try:
+            frames.append(pd.read_csv(file, usecols=['timestamp', 'power_change']))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Skipping {file}: {e}")
+    if frames:
+        events = pd.concat(frames, ignore_index=True)
+        added['power_change'] = store.append(
+            'power_change', nanoseconds(parse_timestamps(events['timestamp'])),
+            events['power_change'].to_numpy(dtype=float), newer_only=True)
+    return added
+
+def main():
+    """Update or rebuild the sketches from the collected data."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Build the hourly distribution sketches.")
+    parser.add_argument('--rebuild', action='store_true', help="Discard the sketches and rebuild them")
+    parser.add_argument('--data-dir', default="data/raw", help="Directory containing the data files")
+    parser.add_argument('--sketch-dir', default=SKETCH_DIR, help="Directory of the sketches")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        shutil.rmtree(args.sketch_dir, ignore_errors=True)
+    added = update_from_files(SketchStore(args.sketch_dir), args.data_dir)
+    logger.info(f"Added {added} values to the sketches in {args.sketch_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Parameter sweep for event detection and appliance clustering.
+
+Evaluates every combination of threshold, minimum peak distance, window size
+and number of appliances against the labelled events in a process pool. The
+power series is loaded once and shared with the workers through shared memory.
+
+Example:
+    python sweep.py --threshold 10,20,40 --min-peak-distance 5,10 --n-appliances 3,5,8
+"""
+
+import os
+import glob
+import time
+import argparse
+import itertools
+import logging
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from features import detect_change_points, extract_event_features
+from data_loader import load_power_data, parse_timestamps, DataLoadError
+import resample
+from settings import load_config
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('nilm_ha.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Events whose device is unknown do not count as ground truth
+UNLABELED_NAMES = {'unlabeled', 'unknown', ''}
+
+# Largest sample used for the silhouette score
+SILHOUETTE_SAMPLE_SIZE = 5000
+
+# Shared series, attached once per worker process
+_shm = None
+_timestamps = None
+_power = None
+_labels = None
+_breaks = None
+
+class SweepError(Exception):
+    """Raised when the parameter sweep cannot be run."""
+    pass
+
+def load_power_series(data_dir, config=None):
+    """
+    Load all power data files as sorted timestamp and power arrays.
+
+    Args:
+        data_dir (str): Directory containing power_data_*.csv files
+        config (dict): Configuration with the resampling settings
+
+    Returns:
+        tuple: (timestamps as int64 nanoseconds, power as float64,
+            indices of the samples that follow a gap)
+    """
+    try:
+        data = resample.prepare(load_power_data(data_dir), config or {})
+    except DataLoadError as e:
+        raise SweepError(str(e))
+    timestamps = pd.DatetimeIndex(data['timestamp']).asi8
+    return timestamps, data['power'].to_numpy(dtype=np.float64), np.flatnonzero(data['gap'].to_numpy(dtype=bool))
+
+def load_labeled_timestamps(raw_dir="data/raw", processed_dir="data/processed"):
+    """
+    Collect the timestamps of all labelled events.
+
+    Args:
+        raw_dir (str): Directory containing device_events_*.csv files
+        processed_dir (str): Directory containing labeled_events_*.csv files
+
+    Returns:
+        np.ndarray: Sorted unique timestamps as int64 nanoseconds
+    """
+    files = (glob.glob(os.path.join(raw_dir, "device_events_*.csv"))
+             + glob.glob(os.path.join(processed_dir, "labeled_events_*.csv")))
+    timestamps = []
+    for file in files:
+        try:
+            df = pd.read_csv(file, usecols=['timestamp', 'device_name'])
+        except (ValueError, OSError) as e:
+            logger.warning(f"Skipping {file}: {e}")
+            continue
+        labeled = df[~df['device_name'].fillna('').str.lower().isin(UNLABELED_NAMES)]
+        timestamps.append(pd.DatetimeIndex(parse_timestamps(labeled['timestamp'])).asi8)
+
+    if not timestamps:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(timestamps))
+
+def match_events(detected, labeled, tolerance_ns):
+    """
+    Count detections that fall within a tolerance of a labelled event.
+
+    Args:
+        detected (np.ndarray): Sorted detection timestamps (int64 ns)
+        labeled (np.ndarray): Sorted labelled timestamps (int64 ns)
+        tolerance_ns (int): Matching tolerance in nanoseconds
+
+    Returns:
+        tuple: (matched detections, matched labelled events)
+    """
+    if len(detected) == 0 or len(labeled) == 0:
+        return 0, 0
+
+    def _within(a, b):
+        # Distance from each element of a to its nearest neighbour in b
+        pos = np.searchsorted(b, a)
+        left = b[np.clip(pos - 1, 0, len(b) - 1)]
+        right = b[np.clip(pos, 0, len(b) - 1)]
+        nearest = np.minimum(np.abs(a - left), np.abs(a - right))
+        return int(np.count_nonzero(nearest <= tolerance_ns))
+
+    return _within(detected, labeled), _within(labeled, detected)
+
+def _attach(shm_name, n_samples, n_labels, gaps=()):
+    """Worker initializer: map the shared series into this process."""
+    global _shm, _timestamps, _power, _labels, _breaks
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _timestamps = np.ndarray((n_samples,), dtype=np.int64, buffer=_shm.buf, offset=0)
+    _power = np.ndarray((n_samples,), dtype=np.float64, buffer=_shm.buf, offset=8 * n_samples)
+    _labels = np.ndarray((n_labels,), dtype=np.int64, buffer=_shm.buf, offset=16 * n_samples)
+    _breaks = np.zeros(n_samples, dtype=bool)
+    _breaks[np.asarray(gaps, dtype=np.int64)] = True
+
+def run_trial(params, tolerance_ns):
+    """
+    Evaluate one parameter combination on the shared series.
+
+    Args:
+        params (dict): threshold, min_peak_distance, window_size, n_appliances
+        tolerance_ns (int): Matching tolerance for labelled events
+
+    Returns:
+        dict: Parameters with detection and clustering metrics
+    """
+    start = time.perf_counter()
+    result = dict(params)
+
+    indices = detect_change_points(_power, params['threshold'], params['min_peak_distance'], _breaks)
+    matched_detected, matched_labeled = match_events(_timestamps[indices], _labels, tolerance_ns)
+    result['n_events'] = int(len(indices))
+    result['precision'] = matched_detected / len(indices) if len(indices) else None
+    result['recall'] = matched_labeled / len(_labels) if len(_labels) else None
+    if result['precision'] is None or result['recall'] is None:
+        result['f1'] = None
+    elif result['precision'] + result['recall'] == 0:
+        result['f1'] = 0.0
+    else:
+        result['f1'] = 2 * result['precision'] * result['recall'] / (result['precision'] + result['recall'])
+
+    result['inertia'] = None
+    result['silhouette'] = None
+    n_clusters = params['n_appliances']
+    if len(indices) > n_clusters >= 2:
+        features = StandardScaler().fit_transform(
+            extract_event_features(_power, indices, params['window_size'], _breaks)
+        )
+        kmeans = KMeans(n_clusters=n_clusters, n_init=4, random_state=0).fit(features)
+        result['inertia'] = float(kmeans.inertia_)
+        if len(np.unique(kmeans.labels_)) > 1:
+            result['silhouette'] = float(silhouette_score(
+                features, kmeans.labels_,
+                sample_size=min(len(features), SILHOUETTE_SAMPLE_SIZE),
+                random_state=0
+            ))
+
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+def parameter_grid(thresholds, min_peak_distances, window_sizes, n_appliances):
+    """Expand parameter value lists into a list of combinations."""
+    return [
+        {'threshold': t, 'min_peak_distance': d, 'window_size': w, 'n_appliances': k}
+        for t, d, w, k in itertools.product(thresholds, min_peak_distances, window_sizes, n_appliances)
+    ]
+
+def run_sweep(timestamps, power, labels, grid, tolerance_s=5.0, max_workers=None, gaps=()):
+    """
+    Evaluate a parameter grid in a process pool.
+
+    Args:
+        timestamps (np.ndarray): Sample timestamps (int64 ns)
+        power (np.ndarray): Power readings
+        labels (np.ndarray): Labelled event timestamps (int64 ns)
+        grid (list): Parameter combinations from :func:`parameter_grid`
+        tolerance_s (float): Matching tolerance in seconds
+        max_workers (int): Worker processes (defaults to CPU count)
+        gaps (np.ndarray): Indices of the samples that follow a gap
+
+    Returns:
+        pd.DataFrame: One row of metrics per combination
+    """
+    n_samples, n_labels = len(power), len(labels)
+    shm = shared_memory.SharedMemory(create=True, size=max(16 * n_samples + 8 * n_labels, 1))
+    try:
+        np.ndarray((n_samples,), dtype=np.int64, buffer=shm.buf, offset=0)[:] = timestamps
+        np.ndarray((n_samples,), dtype=np.float64, buffer=shm.buf, offset=8 * n_samples)[:] = power
+        np.ndarray((n_labels,), dtype=np.int64, buffer=shm.buf, offset=16 * n_samples)[:] = labels
+
+        tolerance_ns = int(tolerance_s * 1e9)
+        results = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach,
+                                 initargs=(shm.name, n_samples, n_labels, gaps)) as pool:
+            futures = {pool.submit(run_trial, params, tolerance_ns): params for params in grid}
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                logger.info(
+                    f"threshold={result['threshold']} min_peak_distance={result['min_peak_distance']} "
+                    f"window_size={result['window_size']} n_appliances={result['n_appliances']}: "
+                    f"{result['n_events']} events, precision={result['precision']}, "
+                    f"recall={result['recall']}, silhouette={result['silhouette']} "
+                    f"({result['seconds']:.2f}s)"
+                )
+    finally:
+        shm.close()
+        shm.unlink()
+
+    columns = ['threshold', 'min_peak_distance', 'window_size', 'n_appliances', 'n_events',
+               'precision', 'recall', 'f1', 'inertia', 'silhouette', 'seconds']
+    return pd.DataFrame(results, columns=columns).sort_values(
+        ['f1', 'silhouette'], ascending=False, na_position='last'
+    ).reset_index(drop=True)
+
+def _values(text, cast):
+    """Parse a comma separated list of values."""
+    return [cast(v) for v in text.split(',') if v.strip()]
+
+def parse_args(config):
+    """Parse command line arguments, defaulting to the configured values."""
+    detection = config['event_detection']
+    parser = argparse.ArgumentParser(description="Sweep event detection and clustering parameters.")
+    parser.add_argument('--threshold', default=str(detection['threshold']),
+                        help="Comma separated thresholds in Watts")
+    parser.add_argument('--min-peak-distance', default=str(detection['min_peak_distance']),
+                        help="Comma separated minimum peak distances in samples")
+    parser.add_argument('--window-size', default=str(detection['window_size']),
+                        help="Comma separated feature window sizes in samples")
+    parser.add_argument('--n-appliances', default=str(config['nilm_model']['n_appliances']),
+                        help="Comma separated numbers of appliances")
+    parser.add_argument('--tolerance', type=float, default=5.0,
+                        help="Seconds between a detection and a labelled event to count as a match")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes")
+    parser.add_argument('--output', default=None, help="CSV file for the results")
+    return parser.parse_args()
+
+def main():
+    """Main function for the parameter sweep."""
+    try:
+        config = load_config()
+        args = parse_args(config)
+
+        grid = parameter_grid(
+            _values(args.threshold, float),
+            _values(args.min_peak_distance, int),
+            _values(args.window_size, int),
+            _values(args.n_appliances, int),
+        )
+        data_dir = config['data_collection']['data_dir']
+        timestamps, power, gaps = load_power_series(data_dir, config)
+        labels = load_labeled_timestamps(data_dir)
+        logger.info(f"Sweeping {len(grid)} combinations over {len(power)} samples "
+                    f"({len(gaps)} gaps) and {len(labels)} labelled events")
+        if len(labels) == 0:
+            logger.warning("No labelled events found; precision and recall will be empty")
+
+        start = time.perf_counter()
+        results = run_sweep(timestamps, power, labels, grid, args.tolerance, args.workers, gaps)
+        logger.info(f"Sweep completed in {time.perf_counter() - start:.1f}s")
+
+        output = args.output or os.path.join(
+            "data/processed", f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        results.to_csv(output, index=False)
+        logger.info(f"Results saved to {output}")
+        logger.info("\nBest combinations:\n" + results.head(10).to_string())
+
+    except Exception as e:
+        logger.error(f"Fatal error: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Synthetic household load generator with ground-truth events.
+
+Produces aggregate power traces of several appliances switching on and off
+with random durations, plus base load and measurement noise. Used by the
+benchmarks and the local Home Assistant stand-in.
+
+Example:
+    python synthetic.py --days 7 --output data/raw
+"""
+
+import os
+import argparse
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Timestamps are generated in UTC and written like datetime.isoformat()
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%S.%f+00:00'
+
+# name, power (W), mean on duration (s), mean off duration (s)
+DEFAULT_APPLIANCES = [
+    {'name': 'fridge', 'power': 120.0, 'mean_on': 900, 'mean_off': 1800},
+    {'name': 'kettle', 'power': 2000.0, 'mean_on': 150, 'mean_off': 14400},
+    {'name': 'washing_machine', 'power': 500.0, 'mean_on': 5400, 'mean_off': 86400},
+    {'name': 'tv', 'power': 90.0, 'mean_on': 7200, 'mean_off': 36000},
+    {'name': 'microwave', 'power': 1100.0, 'mean_on': 180, 'mean_off': 28800},
+]
+
+def appliance_states(n_samples, mean_on, mean_off, interval, rng):
+    """
+    Simulate when one appliance is on.
+
+    Args:
+        n_samples (int): Number of samples
+        mean_on (float): Mean on duration in seconds
+        mean_off (float): Mean off duration in seconds
+        interval (float): Seconds between samples
+        rng (np.random.Generator): Random generator
+
+    Returns:
+        np.ndarray: Indices at which the appliance toggles, starting with
+            a switch-on
+    """
+    mean_cycle = (mean_on + mean_off) / interval
+    n_cycles = int(n_samples / max(mean_cycle, 1) * 1.5) + 4
+    durations = np.empty(2 * n_cycles)
+    durations[0::2] = rng.exponential(mean_off / interval, n_cycles)
+    durations[1::2] = rng.exponential(mean_on / interval, n_cycles)
+    toggles = np.cumsum(np.maximum(durations, 1)).astype(np.int64)
+    toggles = toggles[toggles < n_samples]
+    # Keep an even number so every switch-on has its switch-off in range
+    return toggles[:len(toggles) - len(toggles) % 2]
+
+def generate_household(days=1.0, interval=1.0, appliances=None, base_load=60.0,
+                       noise=2.0, start='2025-01-01', seed=0):
+    """
+    Generate an aggregate power trace with ground-truth events.
+
+    Args:
+        days (float): Length of the trace in days
+        interval (float): Seconds between samples
+        appliances (list): Appliance specifications, see DEFAULT_APPLIANCES
+        base_load (float): Constant always-on load in Watts
+        noise (float): Standard deviation of measurement noise in Watts
+        start (str): Timestamp of the first sample (UTC)
+        seed (int): Random seed
+
+    Returns:
+        tuple: (DataFrame with timestamp and power, DataFrame of events with
+            timestamp, appliance, change_type, power_change, power_before
+            and power_after)
+    """
+    rng = np.random.default_rng(seed)
+    appliances = appliances or DEFAULT_APPLIANCES
+    n_samples = int(days * 86400 / interval)
+
+    # Step changes of all appliances; the trace is their cumulative sum
+    steps = np.zeros(n_samples)
+    event_index, event_appliance, event_change = [], [], []
+    for appliance in appliances:
+        toggles = appliance_states(n_samples, appliance['mean_on'], appliance['mean_off'], interval, rng)
+        changes = np.where(np.arange(len(toggles)) % 2 == 0, appliance['power'], -appliance['power'])
+        np.add.at(steps, toggles, changes)
+        event_index.append(toggles)
+        event_appliance.append(np.full(len(toggles), appliance['name'], dtype=object))
+        event_change.append(changes)
+
+    clean = base_load + np.cumsum(steps)
+    power = clean + rng.normal(0, noise, n_samples) if noise else clean
+    timestamps = pd.date_range(pd.Timestamp(start, tz='UTC'), periods=n_samples,
+                               freq=pd.Timedelta(seconds=interval))
+    data = pd.DataFrame({'timestamp': timestamps, 'power': power})
+
+    index = np.concatenate(event_index) if event_index else np.empty(0, dtype=np.int64)
+    order = np.argsort(index, kind='stable')
+    index = index[order]
+    change = np.concatenate(event_change)[order] if event_index else np.empty(0)
+    events = pd.DataFrame({
+        'timestamp': timestamps[index],
+        'appliance': np.concatenate(event_appliance)[order] if event_index else [],
+        'change_type': np.where(change > 0, 'on', 'off'),
+        'power_change': change,
+        'power_before': clean[np.maximum(index - 1, 0)],
+        'power_after': clean[index],
+    })
+
+    logger.info(f"Generated {n_samples} samples and {len(events)} events for {len(appliances)} appliances")
+    return data, events
+
+def write_dataset(data, events, data_dir="data/raw", labeled=False):
+    """
+    Write a generated trace in the collector's file format.
+
+    Args:
+        data (pd.DataFrame): Power trace from :func:`generate_household`
+        events (pd.DataFrame): Ground-truth events
+        data_dir (str): Target directory
+        labeled (bool): Write the true appliance as label instead of 'unlabeled'
+
+    Returns:
+        tuple: Paths of the power data and device events files
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    suffix = datetime.now().strftime('%Y%m%d_%H%M%S')
+    power_path = os.path.join(data_dir, f"power_data_{suffix}.csv")
+    events_path = os.path.join(data_dir, f"device_events_{suffix}.csv")
+
+    pd.DataFrame({
+        'timestamp': data['timestamp'],
+        'power': data['power'].round(2),
+        'power_change': data['power'].diff().fillna(0).round(2),
+    }).to_csv(power_path, index=False, date_format=ISO_FORMAT)
+
+    pd.DataFrame({
+        'timestamp': events['timestamp'],
+        'power_change': events['power_change'],
+        'change_type': events['change_type'],
+        'power_before': events['power_before'].round(2),
+        'power_after': events['power_after'].round(2),
+        'device_name': events['appliance'] if labeled else 'unlabeled',
+        'confidence': 5 if labeled else 0,
+    }).to_csv(events_path, index=False, date_format=ISO_FORMAT)
+
+    logger.info(f"Wrote {len(data)} samples to {power_path} and {len(events)} events to {events_path}")
+    return power_path, events_path
+
+def main():
+    """Generate a synthetic dataset in the collector's format."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Generate a synthetic household power trace.")
+    parser.add_argument('--days', type=float, default=1.0)
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds between samples")
+    parser.add_argument('--noise', type=float, default=2.0, help="Noise standard deviation in Watts")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--labeled', action='store_true', help="Label events with the true appliance")
+    parser.add_argument('--output', default="data/raw")
+    args = parser.parse_args()
+
+    data, events = generate_household(args.days, args.interval, noise=args.noise, seed=args.seed)
+    write_dataset(data, events, args.output, labeled=args.labeled)
+
+if __name__ == "__main__":
+    main()
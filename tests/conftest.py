@@ -0,0 +1,6 @@
+"""Make the top-level modules importable from the tests."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+import data_loader
+import label_propagation
+
+def write_events(data_dir, suffix, power_changes):
+    path = os.path.join(data_dir, f"device_events_{suffix}.csv")
+    pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=len(power_changes), freq='min', tz='UTC'),
+        'power_change': power_changes,
+        'power_before': 0.0,
+        'power_after': power_changes,
+        'change_type': 'on',
+        'device_name': 'unlabeled',
+    }).to_csv(path, index=False)
+    return path
+
+def test_label_power_changes_defers_files_being_collected(tmp_path):
+    data_dir = str(tmp_path)
+    done = write_events(data_dir, '20240101_000000', [100.0, 2000.0, 100.0])
+    active = write_events(data_dir, '20240102_000000', [100.0, 50.0])
+    data_loader.mark_active(data_dir, '20240102_000000', ttl=60)
+    before = open(active).read()
+
+    labeled, deferred = label_propagation.label_power_changes([100.0], 'lamp', 4, data_dir)
+
+    assert len(labeled) == 2
+    assert list(pd.read_csv(done)['device_name']) == ['lamp', 'unlabeled', 'lamp']
+    assert open(active).read() == before
+    assert list(deferred['source_file']) == ['device_events_20240102_000000.csv']
+    assert list(deferred['power_change']) == [100.0]
+
+def test_label_power_changes_labels_file_once_collection_stopped(tmp_path):
+    data_dir = str(tmp_path)
+    active = write_events(data_dir, '20240102_000000', [100.0, 50.0])
+    data_loader.mark_active(data_dir, '20240102_000000', ttl=60)
+    label_propagation.label_power_changes([100.0], 'lamp', 4, data_dir)
+    data_loader.clear_active(data_dir, '20240102_000000')
+
+    labeled, deferred = label_propagation.label_power_changes([100.0], 'lamp', 4, data_dir)
+
+    assert len(labeled) == 1 and deferred.empty
+    assert list(pd.read_csv(active)['device_name']) == ['lamp', 'unlabeled']
@@ -0,0 +1,36 @@
+import os
+import pandas as pd
+import pytest
+import labeling_queue
+
+def write_events(data_dir, power_changes):
+    os.makedirs(data_dir, exist_ok=True)
+    pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=len(power_changes), freq='min', tz='UTC'),
+        'power_change': power_changes,
+        'power_before': 0.0,
+        'power_after': power_changes,
+        'change_type': 'on',
+        'device_name': 'unlabeled',
+    }).to_csv(os.path.join(data_dir, "device_events_20240101_000000.csv"), index=False)
+
+def test_snapshot_is_served_for_its_own_queue(tmp_path):
+    data_dir = str(tmp_path / "home")
+    write_events(data_dir, [100.0, 101.0, 2000.0])
+    snapshot, queue = labeling_queue.get_queue(data_dir, 0.05)
+
+    assert labeling_queue.get_snapshot(snapshot, data_dir, 0.05) is queue
+
+def test_snapshot_is_rejected_for_another_site_or_tolerance(tmp_path):
+    home, cabin = str(tmp_path / "home"), str(tmp_path / "cabin")
+    write_events(home, [100.0, 101.0, 2000.0])
+    write_events(cabin, [50.0])
+    snapshot, _ = labeling_queue.get_queue(home, 0.05)
+
+    with pytest.raises(labeling_queue.LabelingQueueError):
+        labeling_queue.get_snapshot(snapshot, cabin, 0.05)
+    with pytest.raises(labeling_queue.LabelingQueueError):
+        labeling_queue.get_snapshot(snapshot, home, 0.1)
+
+def test_unknown_snapshot_is_expired(tmp_path):
+    assert labeling_queue.get_snapshot("0" * 12, str(tmp_path), 0.05) is None
@@ -1,15 +1,20 @@
 """
 Script for training the NILM model using collected power consumption data.
+
+With ``--chunked`` the model is trained out of core by :mod:`chunked_training`,
+one data file at a time, for histories that do not fit in memory.
 """
 
 import os
-import glob
+import time
+import argparse
 import logging
-import yaml
 import pandas as pd
 import numpy as np
-from models.event_detector import EventDetector
-from models.nilm_model import NILMModel
+from model_store import save_model, appliance_profiles
+from data_loader import load_power_series
+import profiling
+from settings import load_config
 
 # Configure logging
 logging.basicConfig(
@@ -23,15 +28,6 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def load_config():
-    """Load configuration from config.yaml"""
-    try:
-        with open('config.yaml', 'r') as f:
-            return yaml.safe_load(f)
-    except Exception as e:
-        logger.error(f"Error loading configuration: {e}")
-        raise
-
 def load_data(data_dir):
     """
     Load and combine power consumption data from CSV files.
@@ -43,45 +39,71 @@ def load_data(data_dir):
         pd.Series: Combined power consumption data
     """
     try:
-        # Get all CSV files in the data directory
-        csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
-        
-        if not csv_files:
-            raise ValueError(f"No CSV files found in {data_dir}")
-        
-        # Load and combine data from all files
-        dfs = []
-        for file in csv_files:
-            df = pd.read_csv(file)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df.set_index('timestamp', inplace=True)
-            dfs.append(df)
-        
-        # Combine all data
-        combined_df = pd.concat(dfs)
-        combined_df.sort_index(inplace=True)
-        
-        logger.info(f"Loaded {len(combined_df)} data points from {len(csv_files)} files")
-        logger.info(f"Time range: {combined_df.index.min()} to {combined_df.index.max()}")
-        logger.info(f"Power range: {combined_df['watts'].min():.1f}W to {combined_df['watts'].max():.1f}W")
-        
-        return combined_df['watts']
-        
+        return load_power_series(data_dir)
     except Exception as e:
         logger.error(f"Error loading data: {e}")
         raise
 
+def train_chunked(config, workers=None):
+    """
+    Train and save the model out of core, one data file at a time.
+    
+    Args:
+        config (dict): Configuration dictionary
+        workers (int): Worker processes detecting events
+    """
+    import chunked_training
+    
+    train_start = time.perf_counter()
+    with profiling.profile('train_chunked'):
+        result = chunked_training.train(config['data_collection']['data_dir'], config, workers=workers)
+    training_seconds = time.perf_counter() - train_start
+    
+    logger.info("\nAppliance profiles:")
+    logger.info(pd.DataFrame(result['profiles']).T)
+    
+    with profiling.profile('train_save'):
+        save_model(
+            result['model'],
+            config,
+            data_range=result['data_range'],
+            metrics={**result['metrics'], 'training_seconds': round(training_seconds, 3)},
+            scalers={'features': result['scaler']},
+            profiles=result['profiles'],
+        )
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Train the NILM model on the collected power data.")
+    parser.add_argument('--chunked', action='store_true',
+                        help="Train out of core, one data file at a time")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes detecting events with --chunked")
+    return parser.parse_args()
+
 def main():
     """Main function for training the NILM model"""
     try:
+        args = parse_args()
+        
         # Load configuration
         config = load_config()
         
         # Create necessary directories
         os.makedirs(config['nilm_model']['model_dir'], exist_ok=True)
         
+        if args.chunked:
+            train_chunked(config, args.workers)
+            profiling.log_timings("Training")
+            logger.info("Model training completed successfully")
+            return
+        
+        from models.event_detector import EventDetector
+        from models.nilm_model import NILMModel
+        
         # Load power consumption data
-        power_data = load_data(config['data_collection']['data_dir'])
+        with profiling.profile('train_load'):
+            power_data = load_data(config['data_collection']['data_dir'])
         
         # Initialize event detector
         event_detector = EventDetector(
@@ -90,7 +112,8 @@ def main():
         )
         
         # Detect events
-        events = event_detector.detect_events(power_data)
+        with profiling.profile('train_detect'):
+            events = event_detector.detect_events(power_data)
         
         if events.empty:
             logger.warning("No events detected. Cannot train model.")
@@ -101,10 +124,14 @@ def main():
             n_appliances=config['nilm_model']['n_appliances']
         )
         
-        nilm_model.train(power_data, events)
+        train_start = time.perf_counter()
+        with profiling.profile('train_fit'):
+            nilm_model.train(power_data, events)
+        training_seconds = time.perf_counter() - train_start
         
         # Make predictions on training data
-        predictions = nilm_model.predict(power_data, events)
+        with profiling.profile('train_predict'):
+            predictions = nilm_model.predict(power_data, events)
         
         # Log prediction results
         logger.info("\nPrediction Results:")
@@ -113,6 +140,29 @@ def main():
             'power_after': ['mean', 'std']
         }))
         
+        # Save the trained model so other processes can reuse it
+        scaler = getattr(nilm_model, 'scaler', None)
+        with profiling.profile('train_save'):
+            save_model(
+                nilm_model,
+                config,
+                data_range={
+                    'start': power_data.index.min().isoformat(),
+                    'end': power_data.index.max().isoformat(),
+                    'n_samples': int(len(power_data)),
+                },
+                metrics={
+                    'n_events': int(len(events)),
+                    'events_per_appliance': {
+                        str(k): int(v) for k, v in predictions['appliance'].value_counts().items()
+                    },
+                    'training_seconds': round(training_seconds, 3),
+                },
+                scalers={'features': scaler} if scaler is not None else None,
+                profiles=appliance_profiles(predictions),
+            )
+        
+        profiling.log_timings("Training")
         logger.info("Model training completed successfully")
         
     except Exception as e:
@@ -3,13 +3,26 @@ Visualization module for analyzing power consumption data.
 """
 
 import os
-import glob
+import json
+import hashlib
 import logging
-import yaml
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks
+from data_loader import load_power_data
+import resample
+from sketches import SketchStore, SKETCH_DIR
+from lazy import lazy_import
+from settings import load_config
+
+def _use_agg():
+    # Plots are only written to files, so no GUI backend is needed
+    import matplotlib
+    matplotlib.use('Agg')
+
+# matplotlib and scipy are only imported once plots are actually drawn
+plt = lazy_import('matplotlib.pyplot', setup=_use_agg)
+features = lazy_import('features')  # Imports scipy.signal
 
 # Configure logging
 logging.basicConfig(
@@ -26,78 +39,42 @@ class VisualizationError(Exception):
     """Raised when there is an error generating visualizations."""
     pass
 
-def load_config():
-    """Load configuration from config.yaml."""
-    try:
-        with open("config.yaml", "r") as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError:
-        raise VisualizationError("config.yaml not found. Please create it first.")
-    except yaml.YAMLError as e:
-        raise VisualizationError(f"Error parsing config.yaml: {e}")
-
-def load_data():
+def load_data(data_dir="data/raw"):
     """Load and combine all power data files."""
     try:
-        # Get all CSV files in data/raw
-        files = glob.glob("data/raw/power_data_*.csv")
-        if not files:
-            raise VisualizationError("No data files found in data/raw/")
-        
-        # Load and combine all files
-        dfs = []
-        for file in files:
-            df = pd.read_csv(file)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            # Accept both 'power' and 'watts' columns
-            if 'watts' in df.columns and 'power' not in df.columns:
-                df.rename(columns={'watts': 'power'}, inplace=True)
-            dfs.append(df)
-        
-        # Combine and sort by timestamp
-        data = pd.concat(dfs, ignore_index=True)
-        data = data.sort_values('timestamp')
-        
-        logger.info(f"Loaded {len(data)} data points")
-        logger.info(f"Time range: {data['timestamp'].min()} to {data['timestamp'].max()}")
-        logger.info(f"Power range: {data['power'].min():.2f}W to {data['power'].max():.2f}W")
-        
-        return data
+        return load_power_data(data_dir)
     except Exception as e:
         raise VisualizationError(f"Error loading data: {e}")
 
 def detect_events(data, config):
-    """Detect power events using peak detection."""
+    """Detect power events using peak detection, never across gaps in the data."""
     try:
-        # Calculate power changes
-        power_changes = np.diff(data['power'])
-        
-        # Find peaks (both positive and negative)
-        peaks, _ = find_peaks(
-            np.abs(power_changes),
-            height=config['event_detection']['threshold'],
-            distance=config['event_detection']['min_peak_distance']
+        data = resample.prepare(data, config)
+        power = data['power'].to_numpy(dtype=float)
+        breaks = data['gap'].to_numpy(dtype=bool)
+        indices = features.detect_change_points(
+            power,
+            config['event_detection']['threshold'],
+            config['event_detection']['min_peak_distance'],
+            breaks=breaks
         )
         
-        # Only keep peaks where (peaks + 1) is a valid index
-        valid = (peaks + 1) < len(data)
-        peaks = peaks[valid]
-        
         # If no valid peaks, return empty DataFrame
-        if len(peaks) == 0:
+        if len(indices) == 0:
             logger.info("No valid events detected.")
             return pd.DataFrame(columns=['timestamp', 'type', 'magnitude', 'power_before', 'power_after'])
         
         # Create event DataFrame
+        power_changes = power[indices] - power[indices - 1]
         events = pd.DataFrame({
-            'timestamp': data['timestamp'].iloc[peaks + 1].values,
-            'type': ['on' if power_changes[i] > 0 else 'off' for i in peaks],
-            'magnitude': power_changes[peaks],
-            'power_before': data['power'].iloc[peaks].values,
-            'power_after': data['power'].iloc[peaks + 1].values
+            'timestamp': data['timestamp'].iloc[indices].values,
+            'type': np.where(power_changes > 0, 'on', 'off'),
+            'magnitude': power_changes,
+            'power_before': power[indices - 1],
+            'power_after': power[indices]
         })
         
-        logger.info(f"Detected {len(events)} events")
+        logger.info(f"Detected {len(events)} events ({int(breaks.sum())} gaps skipped)")
         logger.info("\nEvent Statistics:")
         logger.info(events.groupby('type').describe())
         
@@ -105,75 +82,295 @@ def detect_events(data, config):
     except Exception as e:
         raise VisualizationError(f"Error detecting events: {e}")
 
+def decimate_minmax(x, y, n_bins):
+    """
+    Reduce a line to the minimum and maximum of each pixel column.
+    
+    The decimated line is visually identical to the full line when drawn
+    with at most ``n_bins`` horizontal pixels, but its size depends only on
+    the output width.
+    
+    Args:
+        x (np.ndarray): X values, sorted
+        y (np.ndarray): Y values
+        n_bins (int): Number of pixel columns
+        
+    Returns:
+        tuple: (x, y) with at most 2 * n_bins points
+    """
+    n = len(y)
+    if n <= 2 * n_bins:
+        return x, y
+    
+    starts = np.linspace(0, n, n_bins + 1).astype(np.int64)[:-1]
+    y_min = np.minimum.reduceat(y, starts)
+    y_max = np.maximum.reduceat(y, starts)
+    
+    # Draw each column as a vertical segment from its min to its max
+    x_out = np.repeat(x[starts], 2)
+    y_out = np.empty(2 * len(starts), dtype=float)
+    y_out[0::2] = y_min
+    y_out[1::2] = y_max
+    return x_out, y_out
+
+def plot_width_pixels(config):
+    """Horizontal pixels of a saved figure."""
+    return int(config['visualization']['figure_size'][0] * config['visualization']['dpi'])
+
+def _plot_timestamps(data):
+    """Sample timestamps as naive UTC, matching the event timestamps."""
+    timestamps = data['timestamp']
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert(None)
+    return timestamps.to_numpy()
+
+def plot_power_consumption(data, events, config, path):
+    """Plot power consumption over time with the detected events."""
+    plt.style.use('ggplot')
+    plt.figure(figsize=tuple(config['visualization']['figure_size']))
+    plt.plot(*decimate_minmax(_plot_timestamps(data), data['power'].to_numpy(dtype=float),
+                              plot_width_pixels(config)),
+            color=config['visualization']['colors']['power'],
+            label='Power Consumption')
+    
+    # Add events
+    for event_type in ['on', 'off']:
+        event_data = events[events['type'] == event_type]
+        color = config['visualization']['colors'].get(event_type, config['visualization']['colors']['events'])
+        plt.scatter(event_data['timestamp'], event_data['power_after'],
+                   color=color,
+                   label=f'{event_type.capitalize()} Events',
+                   rasterized=True)
+    
+    plt.xlabel('Time')
+    plt.ylabel('Power (W)')
+    plt.title('Power Consumption Over Time')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(path, dpi=config['visualization']['dpi'], bbox_inches='tight')
+    plt.close()
+
+def plot_power_distribution(data, events, config, path, sketch=None):
+    """Plot the histogram of power values, from a sketch of them if given."""
+    bins = config['visualization']['histogram']['bins']
+    if sketch is not None:
+        counts, edges = sketch.histogram(bins)
+    else:
+        counts, edges = np.histogram(data['power'].to_numpy(dtype=float), bins=bins)
+    plt.style.use('ggplot')
+    plt.figure(figsize=tuple(config['visualization']['figure_size']))
+    plt.stairs(counts, edges, fill=True,
+              alpha=config['visualization']['histogram']['alpha'],
+              color=config['visualization']['colors']['power'])
+    plt.xlabel('Power (W)')
+    plt.ylabel('Frequency')
+    plt.title('Power Distribution Histogram')
+    plt.grid(True)
+    plt.savefig(path, dpi=config['visualization']['dpi'], bbox_inches='tight')
+    plt.close()
+
+def plot_power_changes(data, events, config, path):
+    """Plot power changes between consecutive samples with the threshold."""
+    power_changes = np.diff(data['power'].to_numpy(dtype=float))
+    plt.style.use('ggplot')
+    plt.figure(figsize=tuple(config['visualization']['figure_size']))
+    plt.plot(*decimate_minmax(_plot_timestamps(data)[1:], power_changes, plot_width_pixels(config)),
+            color=config['visualization']['colors']['power'],
+            label='Power Changes')
+    plt.axhline(y=config['event_detection']['threshold'],
+               color=config['visualization']['colors']['threshold'],
+               linestyle='--', label='Threshold')
+    plt.axhline(y=-config['event_detection']['threshold'],
+               color=config['visualization']['colors']['threshold'],
+               linestyle='--')
+    plt.xlabel('Time')
+    plt.ylabel('Power Change (W)')
+    plt.title('Power Changes Over Time')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(path, dpi=config['visualization']['dpi'], bbox_inches='tight')
+    plt.close()
+
+# Figure name -> plotting function
+FIGURES = {
+    'power_consumption': plot_power_consumption,
+    'power_distribution': plot_power_distribution,
+    'power_changes': plot_power_changes,
+}
+
 def create_plots(data, events, config):
     """Create visualization plots."""
     try:
         # Create plots directory
-        os.makedirs("plots", exist_ok=True)
-        
-        # Set plot style
-        plt.style.use('ggplot')
-        
-        # 1. Power Consumption Over Time
-        plt.figure(figsize=tuple(config['visualization']['figure_size']))
-        plt.plot(data['timestamp'], data['power'], 
-                color=config['visualization']['colors']['power'],
-                label='Power Consumption')
+        plot_dir = config['visualization'].get('plot_dir', 'plots')
+        os.makedirs(plot_dir, exist_ok=True)
         
         # Log available color keys for debugging
         logger.info(f"Available event color keys: {list(config['visualization']['colors'].keys())}")
-        # Add events
-        for event_type in ['on', 'off']:
-            event_data = events[events['type'] == event_type]
-            color = config['visualization']['colors'].get(event_type, config['visualization']['colors']['events'])
-            plt.scatter(event_data['timestamp'], event_data['power_after'],
-                       color=color,
-                       label=f'{event_type.capitalize()} Events')
-        
-        plt.xlabel('Time')
-        plt.ylabel('Power (W)')
-        plt.title('Power Consumption Over Time')
-        plt.legend()
-        plt.grid(True)
-        plt.savefig('plots/power_consumption.png', dpi=config['visualization']['dpi'], bbox_inches='tight')
-        plt.close()
-        
-        # 2. Power Distribution Histogram
-        plt.figure(figsize=tuple(config['visualization']['figure_size']))
-        plt.hist(data['power'], bins=config['visualization']['histogram']['bins'], 
-                alpha=config['visualization']['histogram']['alpha'],
-                color=config['visualization']['colors']['power'])
-        plt.xlabel('Power (W)')
-        plt.ylabel('Frequency')
-        plt.title('Power Distribution Histogram')
-        plt.grid(True)
-        plt.savefig('plots/power_distribution.png', dpi=config['visualization']['dpi'], bbox_inches='tight')
-        plt.close()
-        
-        # 3. Power Changes Over Time
-        power_changes = np.diff(data['power'])
-        plt.figure(figsize=tuple(config['visualization']['figure_size']))
-        plt.plot(data['timestamp'][1:], power_changes,
-                color=config['visualization']['colors']['power'],
-                label='Power Changes')
-        plt.axhline(y=config['event_detection']['threshold'],
-                   color=config['visualization']['colors']['threshold'],
-                   linestyle='--', label='Threshold')
-        plt.axhline(y=-config['event_detection']['threshold'],
-                   color=config['visualization']['colors']['threshold'],
-                   linestyle='--')
-        plt.xlabel('Time')
-        plt.ylabel('Power Change (W)')
-        plt.title('Power Changes Over Time')
-        plt.legend()
-        plt.grid(True)
-        plt.savefig('plots/power_changes.png', dpi=config['visualization']['dpi'], bbox_inches='tight')
-        plt.close()
+        
+        for name, plot in FIGURES.items():
+            plot(data, events, config, os.path.join(plot_dir, f'{name}.png'))
         
         logger.info("Plots generated successfully")
     except Exception as e:
         raise VisualizationError(f"Error creating plots: {e}")
 
+def _render(name, data, events, config, path, **kwargs):
+    """Worker task: draw one figure to a temporary file and move it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.png"
+    FIGURES[name](data, events, config, tmp_path, **kwargs)
+    os.replace(tmp_path, path)
+    return path
+
+def _days(timestamps):
+    """Day (YYYY-MM-DD, UTC) of each timestamp."""
+    timestamps = pd.to_datetime(timestamps)
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert(None)
+    days = timestamps.dt.normalize()
+    # Format each distinct day once instead of every sample
+    unique = pd.DatetimeIndex(days.unique())
+    return days.map(pd.Series(unique.strftime('%Y-%m-%d'), index=unique))
+
+def partition_versions(data, config):
+    """
+    Fingerprint the data of each day together with the plot settings.
+    
+    Args:
+        data (pd.DataFrame): Power data with timestamp and power columns
+        config (dict): Configuration dictionary
+        
+    Returns:
+        dict: Mapping of day (YYYY-MM-DD) to a version key
+    """
+    settings = json.dumps({
+        'visualization': config['visualization'],
+        'event_detection': config['event_detection'],
+    }, sort_keys=True, default=str)
+    
+    days = _days(data['timestamp'])
+    summary = data.groupby(days)['power'].agg(['count', 'sum', 'min', 'max'])
+    bounds = data.groupby(days)['timestamp'].agg(['min', 'max'])
+    
+    versions = {}
+    for day, row in summary.iterrows():
+        fingerprint = f"{settings}|{row.to_dict()}|{bounds.loc[day].to_dict()}"
+        versions[day] = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+    return versions
+
+def power_sketch(store, data, day=None):
+    """
+    Sketch of the power values of a day (or all data) if it covers exactly that data.
+    
+    Args:
+        store (SketchStore): Hourly sketches
+        data (pd.DataFrame): The power data the figure is drawn from
+        day (str): Day (YYYY-MM-DD, UTC), None for all data
+        
+    Returns:
+        Sketch: Merged sketch, or None if it does not match the data
+    """
+    if day is None:
+        sketch = store.query('power')
+    else:
+        start = pd.Timestamp(day, tz='UTC')
+        sketch = store.query('power', start, start + pd.Timedelta(days=1))
+    # Sketches skip missing readings, so compare with the finite ones
+    return sketch if sketch.count == int(np.isfinite(data['power'].to_numpy(dtype=float)).sum()) else None
+
+def generate_plots(data, events, config, max_workers=None, sketch_dir=SKETCH_DIR):
+    """
+    Generate overall and per-day plots, redrawing only what changed.
+    
+    Figures are drawn in a process pool. A figure is redrawn only if the
+    data of its day or the plot settings changed since it was last drawn,
+    as recorded in ``<plot_dir>/cache.json``; plots of days that no longer
+    have data are deleted. Power distributions come from the hourly
+    sketches when they cover the same samples, so those workers receive no
+    data.
+    
+    Args:
+        data (pd.DataFrame): Power data with timestamp and power columns
+        events (pd.DataFrame): Detected events
+        config (dict): Configuration dictionary
+        max_workers (int): Worker processes (defaults to CPU count)
+        sketch_dir (str): Directory of the hourly sketches
+        
+    Returns:
+        dict: Mapping of figure key ('<day>/<figure>' or '<figure>') to path
+    """
+    try:
+        plot_dir = config['visualization'].get('plot_dir', 'plots')
+        os.makedirs(plot_dir, exist_ok=True)
+        index_path = os.path.join(plot_dir, 'cache.json')
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        
+        versions = partition_versions(data, config)
+        overall = hashlib.sha1(json.dumps(versions, sort_keys=True).encode()).hexdigest()[:16]
+        
+        # (key, version, day or None) for every figure that should exist
+        targets = [(name, overall, None) for name in FIGURES]
+        targets += [(f"{day}/{name}", version, day) for day, version in versions.items() for name in FIGURES]
+        
+        paths = {key: os.path.join(plot_dir, f"{key}.png") for key, _, _ in targets}
+        stale = [(key, version, day) for key, version, day in targets
+                 if index.get(key) != version or not os.path.exists(paths[key])]
+        logger.info(f"{len(stale)} of {len(targets)} plots need to be redrawn")
+        
+        # Forget the plots of days that no longer have data
+        vanished = [key for key in index if key not in paths]
+        for key in vanished:
+            del index[key]
+            path = os.path.join(plot_dir, f"{key}.png")
+            if os.path.exists(path):
+                os.remove(path)
+            if os.path.dirname(key):
+                try:
+                    os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass  # Other figures of the day remain
+        if vanished:
+            logger.info(f"Removed {len(vanished)} plots of days without data")
+        
+        if stale:
+            event_days = _days(events['timestamp']) if not events.empty else None
+            data_days = _days(data['timestamp'])
+            store = SketchStore(sketch_dir)
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {}
+                for key, version, day in stale:
+                    name = key.split('/')[-1]
+                    if day is None:
+                        part, part_events = data, events
+                    else:
+                        part = data[data_days == day]
+                        part_events = events[event_days == day] if event_days is not None else events
+                    kwargs = {}
+                    if name == 'power_distribution':
+                        sketch = power_sketch(store, part, day)
+                        if sketch is not None:
+                            part, kwargs = part.iloc[:0], {'sketch': sketch}
+                    futures[pool.submit(_render, name, part, part_events, config, paths[key], **kwargs)] = (key, version)
+                
+                for future, (key, version) in futures.items():
+                    future.result()
+                    index[key] = version
+        
+        if stale or vanished:
+            with open(f"{index_path}.tmp", 'w') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(f"{index_path}.tmp", index_path)
+        
+        logger.info("Plots generated successfully")
+        return paths
+    except Exception as e:
+        raise VisualizationError(f"Error generating plots: {e}")
+
 def main():
     """Main function for visualization."""
     try:
@@ -182,13 +379,13 @@ def main():
         logger.info("Configuration loaded successfully")
         
         # Load data
-        data = load_data()
+        data = load_data(config['data_collection']['data_dir'])
         
         # Detect events
         events = detect_events(data, config)
         
-        # Create plots
-        create_plots(data, events, config)
+        # Create plots, redrawing only changed days
+        generate_plots(data, events, config)
         
     except Exception as e:
         logger.error(f"Fatal error: {e}")